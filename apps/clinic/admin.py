@@ -3,6 +3,8 @@ from django.utils.html import format_html
 from django.urls import reverse
 from django.utils import timezone
 from apps.clinic.models import Specialty, Service, WorkSchedule, Room, Appointment, Review
+from apps.clinic.conflicts import doctor_index, room_index
+from apps.clinic.services import AvailabilityService
 from clinic_management.admin import admin_site
 
 
@@ -255,6 +257,7 @@ class AppointmentAdmin(admin.ModelAdmin):
             status='CONFIRMED',
             confirmed_date=timezone.now()
         )
+        self.invalidate_availability(queryset)
         self.message_user(request, f'Đã xác nhận {updated} lịch hẹn')
 
     confirm_appointments.short_description = 'Xác nhận lịch hẹn'
@@ -264,6 +267,7 @@ class AppointmentAdmin(admin.ModelAdmin):
             status='CANCELLED',
             deleted_date=timezone.now()
         )
+        self.invalidate_availability(queryset)
         self.message_user(request, f'Đã hủy {updated} lịch hẹn')
 
     cancel_appointments.short_description = 'Hủy lịch hẹn'
@@ -273,10 +277,19 @@ class AppointmentAdmin(admin.ModelAdmin):
             status='COMPLETED',
             completed_date=timezone.now()
         )
+        self.invalidate_availability(queryset)
         self.message_user(request, f'Đã hoàn thành {updated} lịch hẹn')
 
     complete_appointments.short_description = 'Hoàn thành khám'
 
+    # update() ko bắn signal nên tự xóa cache lịch trống và index trùng lịch
+    def invalidate_availability(self, queryset):
+        for doctor_id, room_id, date in queryset.values_list('doctor_id', 'room_id', 'date').distinct():
+            AvailabilityService.invalidate(doctor_id)
+            doctor_index.invalidate((doctor_id, date))
+            if room_id:
+                room_index.invalidate((room_id, date))
+
 
 class ReviewAdmin(admin.ModelAdmin):
     list_display = [
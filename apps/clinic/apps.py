@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class ClinicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'apps.clinic'
\ No newline at end of file
+    name = 'apps.clinic'
+
+    def ready(self):
+        import apps.clinic.signals
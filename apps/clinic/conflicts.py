@@ -0,0 +1,170 @@
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from apps.clinic.models import Appointment, AppointmentStatus
+from apps.clinic.services import ACTIVE_APPOINTMENT_STATUSES, to_range
+
+
+def range_mask(start, end):
+    return ((1 << (end - start)) - 1) << start
+
+
+# index trùng lịch trong bộ nhớ: mỗi (bác sĩ/phòng, ngày) là 1 bitmap 1440 bit, bit i = phút thứ i đang bận
+# version của từng bác sĩ/phòng lưu ở cache chung để các process khác biết mà nạp lại từ db
+class ConflictIndex:
+    def __init__(self, name, field, statuses):
+        self.name = name
+        self.field = field
+        self.statuses = statuses
+        # (owner_id, date) -> {'version', 'bitmap', 'items': {appointment_id: (start, end)}}
+        self.entries = {}
+        # appointment_id -> (owner_id, date) để biết lịch hẹn đang nằm ở đâu khi cập nhật
+        self.locations = {}
+        self.lock = threading.Lock()
+
+    def version_key(self, key):
+        owner_id, date = key
+        return f"conflict_seq:{self.name}:{owner_id}:{date.isoformat()}"
+
+    # nạp các (owner, ngày) bị thiếu hoặc cũ bằng 1 query
+    def warm(self, date, owner_ids):
+        keys = {self.version_key((o, date)): o for o in owner_ids}
+        versions = {keys[k]: v for k, v in cache.get_many(keys.keys()).items()}
+
+        with self.lock:
+            self.prune()
+
+            stale = [o for o in owner_ids
+                     if (o, date) not in self.entries
+                     or self.entries[(o, date)]['version'] != versions.get(o, 0)]
+
+        if not stale:
+            return
+
+        rows = Appointment.objects.filter(
+            **{f'{self.field}__in': stale},
+            date=date,
+            status__in=self.statuses
+        ).values_list('id', self.field, 'start_time', 'end_time')
+
+        loaded = {o: {'version': versions.get(o, 0), 'bitmap': 0, 'items': {}} for o in stale}
+
+        for appointment_id, owner_id, start_time, end_time in rows:
+            start, end = to_range(start_time, end_time)
+            entry = loaded[owner_id]
+            entry['items'][appointment_id] = (start, end)
+            entry['bitmap'] |= range_mask(start, end)
+
+        with self.lock:
+            for owner_id, entry in loaded.items():
+                self.entries[(owner_id, date)] = entry
+
+                for appointment_id in entry['items']:
+                    self.locations[appointment_id] = (owner_id, date)
+
+    # bỏ các ngày đã qua cho nhẹ bộ nhớ
+    def prune(self):
+        today = timezone.now().date()
+
+        for key in [k for k in self.entries if k[1] < today]:
+            for appointment_id in self.entries.pop(key)['items']:
+                self.locations.pop(appointment_id, None)
+
+    def busy_owners(self, date, owner_ids, start_time, end_time, exclude_id=None):
+        owner_ids = list(owner_ids)
+        self.warm(date, owner_ids)
+
+        start, end = to_range(start_time, end_time)
+        mask = range_mask(start, end)
+        busy = set()
+
+        with self.lock:
+            for owner_id in owner_ids:
+                entry = self.entries.get((owner_id, date))
+                if not entry:
+                    continue
+
+                bitmap = entry['bitmap']
+
+                # lịch hẹn cần loại ra nằm trong ngày này thì dựng lại bitmap
+                if exclude_id in entry['items']:
+                    bitmap = 0
+                    for appointment_id, (s, e) in entry['items'].items():
+                        if appointment_id != exclude_id:
+                            bitmap |= range_mask(s, e)
+
+                if bitmap & mask:
+                    busy.add(owner_id)
+
+        return busy
+
+    def has_conflict(self, owner_id, date, start_time, end_time, exclude_id=None):
+        return owner_id in self.busy_owners(date, [owner_id], start_time, end_time, exclude_id)
+
+    # đánh dấu (owner, ngày) đã cũ, dùng cả khi cập nhật hàng loạt bằng update() (ko có signal)
+    # incr là atomic nên mỗi lần đổi được đúng 1 version riêng
+    def invalidate(self, key):
+        version_key = self.version_key(key)
+        cache.add(version_key, 0, timeout=None)
+
+        try:
+            return cache.incr(version_key)
+        except ValueError:
+            # key vừa bị xóa khỏi cache
+            cache.add(version_key, 1, timeout=None)
+            return None
+
+    # gọi từ post_save/post_delete: chụp lại vị trí cũ/mới rồi cập nhật sau khi transaction commit
+    # (trong post_save tracker vẫn giữ giá trị trước khi lưu, sang on_commit thì đã bị reset)
+    def track(self, appointment, deleted=False):
+        owner_id = getattr(appointment, self.field)
+        new_key = (owner_id, appointment.date) if owner_id else None
+
+        if deleted or appointment.status not in self.statuses:
+            new_key = None
+
+        old_owner_id = appointment.tracker.previous(self.field)
+        old_date = appointment.tracker.previous('date')
+        old_key = (old_owner_id, old_date) if old_owner_id and old_date else None
+
+        new_range = to_range(appointment.start_time, appointment.end_time)
+
+        transaction.on_commit(lambda: self.update(appointment.id, old_key, new_key, new_range))
+
+    def update(self, appointment_id, old_key, new_key, new_range):
+        with self.lock:
+            located_key = self.locations.pop(appointment_id, None)
+            affected = {k for k in [located_key, old_key, new_key] if k}
+
+            for key in affected:
+                version = self.invalidate(key)
+
+                entry = self.entries.get(key)
+                if not entry:
+                    continue
+
+                # chỉ sửa tại chỗ khi ko có thay đổi nào khác xen vào (version tăng đúng 1 từ bản đang giữ),
+                # ngược lại bỏ entry để lần sau nạp lại từ db
+                if version is None or entry['version'] != version - 1:
+                    self.entries.pop(key)
+                    continue
+
+                entry['items'].pop(appointment_id, None)
+
+                if key == new_key:
+                    entry['items'][appointment_id] = new_range
+                    self.locations[appointment_id] = key
+
+                entry['bitmap'] = 0
+                for s, e in entry['items'].values():
+                    entry['bitmap'] |= range_mask(s, e)
+
+                entry['version'] = version
+
+
+doctor_index = ConflictIndex('doctor', 'doctor_id', ACTIVE_APPOINTMENT_STATUSES)
+
+room_index = ConflictIndex('room', 'room_id', [AppointmentStatus.CONFIRMED, AppointmentStatus.IN_PROCESS])
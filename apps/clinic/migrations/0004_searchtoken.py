@@ -0,0 +1,76 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:51
+
+import re
+import unicodedata
+from html import unescape
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+# chép lại cách tách từ của apps.clinic.search lúc tạo migration, ko import để sau này sửa module đó
+# thì migration vẫn chạy như cũ
+
+TOKEN_LENGTH = 50
+
+WORD_RE = re.compile(r'\w+')
+
+
+def fold_char(c):
+    c = c.lower()
+    if c == 'đ':
+        return 'd'
+    return unicodedata.normalize('NFD', c)[:1] or c
+
+
+def tokenize(text):
+    text = ''.join(fold_char(c) for c in unescape(strip_tags(text or '')))
+    return [t[:TOKEN_LENGTH] for t in WORD_RE.findall(text)]
+
+
+def build_tokens(instance, fields):
+    tokens = {}
+
+    for field, weight in fields.items():
+        for token in tokenize(getattr(instance, field)):
+            tokens[token] = tokens.get(token, 0) + weight
+
+    return tokens
+
+
+# đánh index cho dịch vụ/thuốc đã có sẵn
+def build_search_index(apps, schema_editor):
+    SearchToken = apps.get_model('clinic', 'SearchToken')
+    fields = {'name': 3, 'description': 1}
+
+    for kind, model in [('service', apps.get_model('clinic', 'Service')),
+                        ('medicine', apps.get_model('pharmacy', 'Medicine'))]:
+        for instance in model.objects.only('id', *fields).iterator():
+            SearchToken.objects.bulk_create([
+                SearchToken(kind=kind, object_id=instance.pk, token=token, weight=weight)
+                for token, weight in build_tokens(instance, fields).items()
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0003_review'),
+        ('pharmacy', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('token', models.CharField(max_length=50)),
+                ('weight', models.IntegerField(default=1)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'token', 'object_id'], name='clinic_sear_kind_342ae6_idx'), models.Index(fields=['kind', 'object_id'], name='clinic_sear_kind_fe0ed7_idx')],
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
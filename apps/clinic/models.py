@@ -63,6 +63,9 @@ class Service(BaseModel):
     duration = models.IntegerField(default=30)
     image = CloudinaryField(blank=True, null=True)
 
+    # chỉ đánh lại index tìm kiếm khi tên/mô tả đổi
+    tracker = FieldTracker(fields=['name', 'description'])
+
     def __str__(self):
         return f"{self.name} - {self.specialty.name}"
 
@@ -164,3 +167,17 @@ class Review(BaseModel):
 
     def __str__(self):
         return f"Review {self.rating}* for {self.doctor.last_name}"
+
+
+# chỉ mục tìm kiếm: mỗi dòng là 1 từ (đã bỏ dấu) của 1 đối tượng (dịch vụ, thuốc...)
+class SearchToken(models.Model):
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    token = models.CharField(max_length=50)
+    weight = models.IntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'token', 'object_id']),
+            models.Index(fields=['kind', 'object_id']),
+        ]
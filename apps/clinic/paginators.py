@@ -1,8 +1,47 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 
 class ServicePaginator(PageNumberPagination):
     page_size = 5
 
-class AppointmentPaginator(PageNumberPagination):
-    page_size = 5
\ No newline at end of file
+
+# phân trang theo con trỏ (created_date, id): trang sâu cũng chỉ tốn như trang đầu, ko COUNT(*) và OFFSET
+class KeysetPaginator(CursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_paginator = None
+
+        # client cũ vẫn gửi ?page= thì phân trang theo số trang như trước
+        if request.query_params.get('page'):
+            self.page_paginator = PageNumberPagination()
+            self.page_paginator.page_size = self.get_page_size(request)
+
+            return self.page_paginator.paginate_queryset(queryset.order_by(*self.ordering), request, view)
+
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.page_paginator:
+            return self.page_paginator.get_paginated_response(data)
+
+        return super().get_paginated_response(data)
+
+
+# cho các api trước đây trả cả danh sách: chỉ phân trang khi client gửi cursor/page/page_size,
+# ko gửi gì thì vẫn trả list như cũ để client cũ ko bị đổi định dạng
+class OptionalKeysetPaginator(KeysetPaginator):
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_paginator = None
+
+        if not any(p in request.query_params for p in [self.cursor_query_param, 'page', self.page_size_query_param]):
+            return None
+
+        return super().paginate_queryset(queryset, request, view)
+
+
+class AppointmentPaginator(KeysetPaginator):
+    page_size = 5
@@ -0,0 +1,145 @@
+import re
+import unicodedata
+from functools import lru_cache
+from html import unescape
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery, Sum, Q
+from django.utils.html import strip_tags, escape
+
+from apps.clinic.models import SearchToken
+
+TOKEN_LENGTH = 50
+
+SNIPPET_LENGTH = 160
+
+WORD_RE = re.compile(r'\w+')
+
+
+# bỏ dấu từng ký tự, giữ nguyên độ dài chuỗi để map vị trí khi highlight
+@lru_cache(maxsize=4096)
+def fold_char(c):
+    c = c.lower()
+    if c == 'đ':
+        return 'd'
+    return unicodedata.normalize('NFD', c)[:1] or c
+
+
+def fold(text):
+    return ''.join(fold_char(c) for c in text)
+
+
+# mô tả lưu dạng html (ckeditor) nên bỏ thẻ trước khi index
+def clean(text):
+    return unescape(strip_tags(text or ''))
+
+
+def tokenize(text):
+    return [t[:TOKEN_LENGTH] for t in WORD_RE.findall(fold(clean(text)))]
+
+
+# từ -> trọng số, từ trong tên nặng hơn từ trong mô tả
+def build_tokens(instance, fields):
+    tokens = {}
+
+    for field, weight in fields.items():
+        for token in tokenize(getattr(instance, field)):
+            tokens[token] = tokens.get(token, 0) + weight
+
+    return tokens
+
+
+# đánh dấu các từ khớp (bắt đầu bằng từ khóa) bằng <mark>
+def highlight(text, terms):
+    folded = fold(text)
+
+    parts = []
+    cursor = 0
+    first = None
+
+    for m in WORD_RE.finditer(folded):
+        if not any(m.group().startswith(t) for t in terms):
+            continue
+
+        if first is None:
+            first = m.start()
+
+        parts.append(escape(text[cursor:m.start()]))
+        parts.append(f'<mark>{escape(text[m.start():m.end()])}</mark>')
+        cursor = m.end()
+
+    parts.append(escape(text[cursor:]))
+
+    return ''.join(parts), first
+
+
+# chỉ mục ngược cho 1 loại đối tượng, cập nhật khi lưu (signal), truy vấn bằng index (kind, token)
+class SearchIndex:
+    def __init__(self, kind, fields):
+        self.kind = kind
+        # field -> trọng số
+        self.fields = fields
+
+    def refresh(self, instance):
+        tokens = build_tokens(instance, self.fields)
+
+        with transaction.atomic():
+            SearchToken.objects.filter(kind=self.kind, object_id=instance.pk).delete()
+            SearchToken.objects.bulk_create([
+                SearchToken(kind=self.kind, object_id=instance.pk, token=token, weight=weight)
+                for token, weight in tokens.items()
+            ])
+
+    # lưu chỉ đổi tồn kho/giá... thì ko cần đánh lại
+    def changed(self, instance):
+        return any(instance.tracker.has_changed(field) for field in self.fields)
+
+    def remove(self, instance):
+        SearchToken.objects.filter(kind=self.kind, object_id=instance.pk).delete()
+
+    @staticmethod
+    def terms(q):
+        return list(dict.fromkeys(tokenize(q)))
+
+    # mọi từ khóa đều phải khớp (theo tiền tố để gõ tới đâu tìm tới đó), sắp xếp theo tổng trọng số
+    def search(self, queryset, q):
+        terms = self.terms(q)
+        if not terms:
+            return queryset.none()
+
+        tokens = SearchToken.objects.filter(kind=self.kind)
+
+        # từ dài nhất thường ít kết quả nhất nên dùng để lọc trước
+        terms_by_length = sorted(terms, key=len, reverse=True)
+        queryset = queryset.filter(pk__in=tokens.filter(token__startswith=terms_by_length[0]).values('object_id'))
+
+        for term in terms_by_length[1:]:
+            queryset = queryset.filter(Exists(tokens.filter(object_id=OuterRef('pk'), token__startswith=term)))
+
+        matched = Q()
+        for term in terms:
+            matched |= Q(token__startswith=term)
+
+        rank = tokens.filter(matched, object_id=OuterRef('pk')).values('object_id') \
+            .annotate(rank=Sum('weight')).values('rank')
+
+        return queryset.annotate(search_rank=Subquery(rank)).order_by('-search_rank', 'id')
+
+    # tên đánh dấu toàn bộ, mô tả cắt đoạn quanh chỗ khớp đầu tiên
+    def highlight(self, instance, terms):
+        result = {}
+
+        for field in self.fields:
+            text = clean(getattr(instance, field))
+
+            if len(text) > SNIPPET_LENGTH:
+                _, first = highlight(text, terms)
+                start = max((first or 0) - SNIPPET_LENGTH // 4, 0)
+                text = text[start:start + SNIPPET_LENGTH]
+
+            result[field], _ = highlight(text, terms)
+
+        return result
+
+
+service_index = SearchIndex('service', {'name': 3, 'description': 1})
@@ -7,6 +7,10 @@ from django.utils import timezone
 
 from apps.clinic.models import Specialty, Service, Appointment, WorkSchedule, AppointmentStatus, AppointmentType, Room, \
     Review
+from apps.clinic.conflicts import doctor_index, room_index
+from apps.clinic.search import service_index
+from apps.clinic.services import AvailabilityService, ACTIVE_APPOINTMENT_STATUSES
+from apps.clinic.utils import get_max_booking_date
 from apps.medical.models import MedicalRecord
 from apps.users.serializers import DoctorInfoSerializer, PatientInfoSerializer
 
@@ -27,6 +31,11 @@ class ServiceSerializer(serializers.ModelSerializer):
 
         data['image'] = instance.image.url if instance.image else ''
 
+        # đang tìm kiếm thì trả thêm đoạn khớp được đánh dấu
+        terms = self.context.get('search_terms')
+        if terms:
+            data['highlight'] = service_index.highlight(instance, terms)
+
         return data
 
 
@@ -130,34 +139,34 @@ class RegisterScheduleSerializer(serializers.Serializer):
             week_start=week_start
         )
 
-        # ktra coi có cuộc hẹn nào bị đụng tới ko
-        for old_schedule in old_schedules:
-            date = week_start + timedelta(days=old_schedule.day_of_week)
-
-            has_appointment = Appointment.objects.filter(
-                doctor=user,
-                date=date,
-                status__in=['PENDING', 'CONFIRMED'],
-                start_time__gte=old_schedule.start_time,
-                end_time__lte=old_schedule.end_time
-            ).first()
-
-            if has_appointment:
-                is_covered = False
-
-                for shift in schedules_data:
-                    if shift['day_of_week'] == old_schedule.day_of_week:
-                        if (shift['start_time'] <= has_appointment.start_time and
-                                shift['end_time'] >= has_appointment.end_time):
-                            is_covered = True
-                            break
-
-                if not is_covered:
-                    raise serializers.ValidationError(
-                        f"KHÔNG THỂ SỬA/XÓA ca làm việc Thứ {old_schedule.day_of_week + 2} ({old_schedule.start_time}-{old_schedule.end_time}) "
-                        f"vì lịch mới không bao phủ được cuộc hẹn lúc ({has_appointment.start_time} - {has_appointment.end_time}). "
-                        f"Vui lòng đảm bảo ca làm việc mới phải bao trùm cuộc hẹn này."
-                    )
+        # lấy hết cuộc hẹn còn hiệu lực trong tuần bằng 1 query rồi kiểm tra trong bộ nhớ
+        appointments = Appointment.objects.filter(
+            doctor=user,
+            date__gte=week_start,
+            date__lte=week_end,
+            status__in=[AppointmentStatus.PENDING, AppointmentStatus.CONFIRMED]
+        ).order_by('date', 'start_time').values_list('date', 'start_time', 'end_time')
+
+        shifts_by_day = {}
+        for shift in schedules_data:
+            shifts_by_day.setdefault(shift['day_of_week'], []).append((shift['start_time'], shift['end_time']))
+
+        # gom hết các cuộc hẹn ko được ca mới bao phủ để báo 1 lần
+        uncovered = []
+        for date, start_time, end_time in appointments:
+            is_covered = any(shift_start <= start_time and shift_end >= end_time
+                             for shift_start, shift_end in shifts_by_day.get(date.weekday(), []))
+
+            if not is_covered:
+                uncovered.append(
+                    f"Thứ {date.weekday() + 2} ({date.strftime('%d/%m/%Y')}): cuộc hẹn lúc ({start_time} - {end_time})"
+                )
+
+        if uncovered:
+            raise serializers.ValidationError(
+                ["KHÔNG THỂ SỬA/XÓA ca làm việc vì lịch mới không bao phủ được các cuộc hẹn sau. "
+                 "Vui lòng đảm bảo ca làm việc mới phải bao trùm các cuộc hẹn này."] + uncovered
+            )
 
         old_schedules.delete()
         schedules = []
@@ -175,7 +184,12 @@ class RegisterScheduleSerializer(serializers.Serializer):
             )
             schedules.append(schedule)
 
-        return WorkSchedule.objects.bulk_create(schedules)
+        schedules = WorkSchedule.objects.bulk_create(schedules)
+
+        # bulk_create ko bắn signal nên tự xóa cache lịch trống
+        AvailabilityService.invalidate(user.id)
+
+        return schedules
 
 
 # tạo lịch hẹn
@@ -190,9 +204,7 @@ class CreateAppointmentSerializer(serializers.ModelSerializer):
         if value < timezone.now().date():
             raise serializers.ValidationError('Không thể đặt lịch hẹn trong quá khứ.')
 
-        # giới hạn 2 tuần: ngày hôm nay + số ngày tới chủ nhật và thêm 1 tuần
-        max_date = timezone.now().date() + timedelta(days=6 - timezone.now().weekday()) + timedelta(days=7)
-        if value > max_date:
+        if value > get_max_booking_date():
             raise serializers.ValidationError('Chỉ có thể đặt lịch hẹn trước chủ nhật tuần sau.')
 
         return value
@@ -228,23 +240,19 @@ class CreateAppointmentSerializer(serializers.ModelSerializer):
         attrs['services'] = services
         attrs['total_price'] = total_price
 
-        # tìm ca làm phù hợp
-        has_schedule = WorkSchedule.objects.filter(
-            employee=doctor,
-            week_start__lte=date,
-            week_end__gte=date,
-            day_of_week=date.weekday(),
-            start_time__lte=start_time,
-            end_time__gte=end_time,
-            active=True
-        ).first()
+        # tìm ca làm phù hợp bằng dữ liệu lịch trống (có cache)
+        schedule_id = AvailabilityService.find_schedule(doctor.id, date, start_time, end_time)
 
-        if not has_schedule:
+        if not schedule_id:
             raise serializers.ValidationError(
                 f"Bác sĩ không có lịch làm việc vào thời gian này."
             )
 
-        attrs['work_schedule'] = has_schedule
+        # kiểm tra trùng lịch bằng index trong bộ nhớ
+        if doctor_index.has_conflict(doctor.id, date, start_time, end_time):
+            raise serializers.ValidationError('Bác sĩ đã có lịch hẹn vào thời gian này.')
+
+        attrs['work_schedule_id'] = schedule_id
         return attrs
 
     @transaction.atomic
@@ -259,11 +267,21 @@ class CreateAppointmentSerializer(serializers.ModelSerializer):
         # Xóa field input ảo
         validated_data.pop('service_ids')
 
+        # khóa dòng ca làm của bác sĩ để các lượt đặt cùng ca phải xếp hàng,
+        # phải là câu lệnh đầu tiên trong transaction để lần đọc sau thấy được lịch vừa commit
+        work_schedule = WorkSchedule.objects.select_for_update().filter(
+            id=validated_data['work_schedule_id'],
+            active=True
+        ).first()
+
+        if not work_schedule:
+            raise serializers.ValidationError('Bác sĩ không có lịch làm việc vào thời gian này.')
+
         # tìm coi có kẹt lịch với lịch khác ko
         overlapping = Appointment.objects.filter(
             doctor=doctor,
             date=date,
-            status__in=[AppointmentStatus.PENDING, AppointmentStatus.IN_PROCESS, AppointmentStatus.CONFIRMED],
+            status__in=ACTIVE_APPOINTMENT_STATUSES,
             start_time__lt=end_time,
             end_time__gt=start_time
         ).exists()
@@ -335,15 +353,36 @@ class ConfirmAppointmentSerializer(serializers.ModelSerializer):
         if appointment.type == AppointmentType.OFFLINE and not attrs.get('room'):
             raise serializers.ValidationError('Lịch hẹn offline cần có số phòng khám.')
 
+        # lọc nhanh bằng index, kiểm tra chắc chắn bằng db lúc lưu
+        if appointment.type == AppointmentType.OFFLINE and room_index.has_conflict(
+                attrs['room'].id, appointment.date, appointment.start_time, appointment.end_time,
+                exclude_id=appointment.id):
+            raise serializers.ValidationError('Phòng đã có lịch hẹn vào thời gian này.')
+
         return attrs
 
     @transaction.atomic
     def update(self, instance, validated_data):
+        if instance.type == AppointmentType.OFFLINE:
+            # khóa dòng phòng để các lượt xác nhận cùng phòng phải xếp hàng, rồi mới kiểm tra trùng trong db
+            room = Room.objects.select_for_update().get(id=validated_data['room'].id)
+
+            overlapping = Appointment.objects.filter(
+                room=room,
+                date=instance.date,
+                status__in=room_index.statuses,
+                start_time__lt=instance.end_time,
+                end_time__gt=instance.start_time
+            ).exclude(id=instance.id).exists()
+
+            if overlapping:
+                raise serializers.ValidationError('Phòng đã có lịch hẹn vào thời gian này.')
+
         instance.status = AppointmentStatus.CONFIRMED
         instance.confirmed_date = timezone.now()
         instance.doctor_note = validated_data['doctor_note']
         if instance.type == AppointmentType.OFFLINE:
-            instance.room = validated_data['room']
+            instance.room = room
             instance.meeting_link = None
 
         else:
@@ -0,0 +1,259 @@
+import hashlib
+from datetime import time, timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from apps.clinic.models import WorkSchedule, Appointment, AppointmentStatus
+
+# các trạng thái lịch hẹn còn chiếm chỗ của bác sĩ
+ACTIVE_APPOINTMENT_STATUSES = [AppointmentStatus.PENDING, AppointmentStatus.IN_PROCESS, AppointmentStatus.CONFIRMED]
+
+AVAILABILITY_TIMEOUT = 60 * 10
+
+CATALOG_TIMEOUT = 60 * 60
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def to_minutes(t):
+    return t.hour * 60 + t.minute
+
+
+def to_time(minutes):
+    # 24:00 ko biểu diễn được bằng time nên lấy 23:59
+    minutes = min(minutes, MINUTES_PER_DAY - 1)
+    return time(minutes // 60, minutes % 60)
+
+
+def to_range(start_time, end_time):
+    start = to_minutes(start_time)
+    end = to_minutes(end_time)
+
+    # giờ kết thúc qua nửa đêm thì tính tới cuối ngày
+    if end <= start:
+        end = MINUTES_PER_DAY
+
+    return start, end
+
+
+# tính khung giờ trống của bác sĩ: ca làm (WorkSchedule) trừ đi các lịch hẹn đang hoạt động
+# kết quả từng ngày được lưu cache theo version của bác sĩ, có thay đổi thì tăng version
+class AvailabilityService:
+    @staticmethod
+    def version_key(doctor_id):
+        return f"availability_version:{doctor_id}"
+
+    @staticmethod
+    def day_key(doctor_id, version, date):
+        return f"availability:{doctor_id}:{version}:{date.isoformat()}"
+
+    # gọi khi lịch hẹn hoặc lịch làm của bác sĩ thay đổi
+    @staticmethod
+    def invalidate(doctor_id):
+        cache.set(AvailabilityService.version_key(doctor_id), timezone.now().timestamp(), timeout=None)
+
+    @staticmethod
+    def invalidate_many(doctor_ids):
+        version = timezone.now().timestamp()
+        cache.set_many({AvailabilityService.version_key(d): version for d in doctor_ids}, timeout=None)
+
+    # lấy ca làm + giờ bận của từng ngày: đọc cache trước, ngày nào thiếu thì query 1 lần cho cả khoảng
+    @staticmethod
+    def get_days(doctor_id, from_date, to_date):
+        return AvailabilityService.get_days_many([doctor_id], from_date, to_date)[doctor_id]
+
+    # giống get_days nhưng cho nhiều bác sĩ, số query ko phụ thuộc số bác sĩ
+    @staticmethod
+    def get_days_many(doctor_ids, from_date, to_date):
+        version_keys = {AvailabilityService.version_key(d): d for d in doctor_ids}
+        versions = {version_keys[k]: v for k, v in cache.get_many(version_keys.keys()).items()}
+
+        dates = [from_date + timedelta(days=i) for i in range((to_date - from_date).days + 1)]
+        keys = {AvailabilityService.day_key(d, versions.get(d, 0), date): (d, date)
+                for d in doctor_ids for date in dates}
+
+        result = {d: {} for d in doctor_ids}
+        for k, v in cache.get_many(keys.keys()).items():
+            doctor_id, date = keys[k]
+            result[doctor_id][date] = v
+
+        missing = [(d, date) for d in doctor_ids for date in dates if date not in result[d]]
+        if missing:
+            missing_dates = [date for _, date in missing]
+            loaded = AvailabilityService.load_days({d for d, _ in missing}, min(missing_dates), max(missing_dates))
+
+            cache.set_many({
+                AvailabilityService.day_key(d, versions.get(d, 0), date): loaded[d][date] for d, date in missing
+            }, timeout=AVAILABILITY_TIMEOUT)
+
+            for d, date in missing:
+                result[d][date] = loaded[d][date]
+
+        return result
+
+    @staticmethod
+    def load_days(doctor_ids, from_date, to_date):
+        dates = [from_date + timedelta(days=i) for i in range((to_date - from_date).days + 1)]
+        result = {d: {date: {'schedules': [], 'busy': []} for date in dates} for d in doctor_ids}
+
+        # ca làm tính ngày theo week_start + day_of_week giống lúc đặt lịch
+        schedules = WorkSchedule.objects.filter(
+            employee_id__in=doctor_ids,
+            week_start__lte=to_date,
+            week_end__gte=from_date,
+            is_appointable=True,
+            active=True
+        ).values_list('id', 'employee_id', 'week_start', 'day_of_week', 'start_time', 'end_time')
+
+        for schedule_id, doctor_id, week_start, day_of_week, start_time, end_time in schedules:
+            date = week_start + timedelta(days=day_of_week)
+
+            if date in result[doctor_id]:
+                result[doctor_id][date]['schedules'].append((*to_range(start_time, end_time), schedule_id))
+
+        appointments = Appointment.objects.filter(
+            doctor_id__in=doctor_ids,
+            date__gte=from_date,
+            date__lte=to_date,
+            status__in=ACTIVE_APPOINTMENT_STATUSES
+        ).values_list('doctor_id', 'date', 'start_time', 'end_time')
+
+        for doctor_id, date, start_time, end_time in appointments:
+            result[doctor_id][date]['busy'].append(to_range(start_time, end_time))
+
+        for days in result.values():
+            for day in days.values():
+                day['schedules'].sort()
+                day['busy'].sort()
+
+        return result
+
+    # ca làm trừ giờ bận -> danh sách (start, end, schedule_id) tính bằng phút
+    @staticmethod
+    def free_intervals(day):
+        free = []
+
+        for start, end, schedule_id in day['schedules']:
+            cursor = start
+
+            for busy_start, busy_end in day['busy']:
+                if busy_end <= cursor or busy_start >= end:
+                    continue
+
+                if busy_start > cursor:
+                    free.append((cursor, busy_start, schedule_id))
+
+                cursor = max(cursor, busy_end)
+
+            if cursor < end:
+                free.append((cursor, end, schedule_id))
+
+        return free
+
+    @staticmethod
+    def get_free_intervals(doctor_id, from_date, to_date):
+        days = AvailabilityService.get_days(doctor_id, from_date, to_date)
+
+        return {date: AvailabilityService.free_intervals(day) for date, day in sorted(days.items())}
+
+    # cắt khoảng trống thành các slot liên tiếp dài duration phút
+    @staticmethod
+    def split_slots(intervals, duration, not_before=0):
+        slots = []
+
+        for start, end, schedule_id in intervals:
+            cursor = max(start, not_before)
+
+            while cursor + duration <= end:
+                slots.append((cursor, cursor + duration))
+                cursor += duration
+
+        return slots
+
+    # dữ liệu trả về cho api lịch trống, ngày hôm nay thì bỏ các slot đã qua
+    @staticmethod
+    def get_availability(doctor_id, from_date, to_date, duration):
+        now = timezone.localtime()
+        result = []
+
+        for date, intervals in AvailabilityService.get_free_intervals(doctor_id, from_date, to_date).items():
+            not_before = to_minutes(now) if date == now.date() else 0
+
+            result.append({
+                'date': date,
+                'free_intervals': [{'start': to_time(start), 'end': to_time(end)} for start, end, _ in intervals],
+                'slots': [{'start': to_time(start), 'end': to_time(end)}
+                          for start, end in AvailabilityService.split_slots(intervals, duration, not_before)]
+            })
+
+        return result
+
+    # tóm tắt lịch trống 1 ngày cho cả trang danh sách bác sĩ: slot trống gần nhất và tổng số phút trống
+    @staticmethod
+    def get_summary(doctor_ids, date, duration):
+        now = timezone.localtime()
+        not_before = to_minutes(now) if date == now.date() else 0
+
+        summary = {}
+
+        for doctor_id, days in AvailabilityService.get_days_many(doctor_ids, date, date).items():
+            intervals = [(max(start, not_before), end, schedule_id)
+                         for start, end, schedule_id in AvailabilityService.free_intervals(days[date])
+                         if end > not_before]
+            slots = AvailabilityService.split_slots(intervals, duration)
+
+            summary[doctor_id] = {
+                'date': date,
+                'next_free_slot': {'start': to_time(slots[0][0]), 'end': to_time(slots[0][1])} if slots else None,
+                'free_minutes': sum(end - start for start, end, _ in intervals),
+            }
+
+        return summary
+
+    # dùng khi đặt lịch: tìm ca làm chứa trọn khung giờ, ko có trả về None
+    @staticmethod
+    def find_schedule(doctor_id, date, start_time, end_time):
+        day = AvailabilityService.get_days(doctor_id, date, date)[date]
+        start, end = to_range(start_time, end_time)
+
+        return next((s_id for s_start, s_end, s_id in day['schedules'] if s_start <= start and s_end >= end), None)
+
+
+# cache cho các api danh mục công khai (chuyên khoa, dịch vụ)
+# key gồm version + url, Specialty/Service thay đổi thì đổi version là toàn bộ cache cũ hết hiệu lực
+class CatalogCache:
+    VERSION_KEY = 'catalog_version'
+
+    @staticmethod
+    def invalidate():
+        cache.set(CatalogCache.VERSION_KEY, timezone.now().timestamp(), timeout=None)
+
+    # trả response từ cache, chưa có thì gọi view để tạo; client gửi If-None-Match trùng ETag thì trả 304
+    @staticmethod
+    def response(request, view_func, *args, **kwargs):
+        version = cache.get(CatalogCache.VERSION_KEY, 0)
+        url = request.build_absolute_uri()
+
+        digest = hashlib.md5(f"{version}:{url}".encode()).hexdigest()
+        etag = f'"{digest}"'
+
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        key = f"catalog:{digest}"
+        data = cache.get(key)
+
+        if data is None:
+            response = view_func(request, *args, **kwargs)
+
+            # lỗi (404...) thì ko cache
+            if response.status_code != status.HTTP_200_OK:
+                return response
+
+            data = response.data
+            cache.set(key, data, timeout=CATALOG_TIMEOUT)
+
+        return Response(data, status=status.HTTP_200_OK, headers={'ETag': etag})
@@ -1,7 +1,10 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 
-from apps.clinic.models import Appointment, AppointmentStatus
+from apps.clinic.conflicts import doctor_index, room_index
+from apps.clinic.models import Appointment, AppointmentStatus, WorkSchedule, Specialty, Service
+from apps.clinic.search import service_index
+from apps.clinic.services import AvailabilityService, CatalogCache
 from apps.notifications.services import AppointmentNotifications
 
 
@@ -22,3 +25,50 @@ def create_appointment(sender, instance, created, **kwargs):
             AppointmentNotifications.notify_confirmed(instance)
         elif old_status == AppointmentStatus.CONFIRMED and new_status == AppointmentStatus.IN_PROCESS:
             AppointmentNotifications.notify_started(instance)
+
+
+# lịch hẹn/lịch làm thay đổi thì xóa cache lịch trống của bác sĩ
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def invalidate_appointment_availability(sender, instance, **kwargs):
+    AvailabilityService.invalidate(instance.doctor_id)
+
+
+# giữ index trùng lịch theo bác sĩ/phòng khớp với db
+@receiver(post_save, sender=Appointment)
+def update_conflict_index(sender, instance, **kwargs):
+    doctor_index.track(instance)
+    room_index.track(instance)
+
+
+@receiver(post_delete, sender=Appointment)
+def delete_conflict_index(sender, instance, **kwargs):
+    doctor_index.track(instance, deleted=True)
+    room_index.track(instance, deleted=True)
+
+
+@receiver(post_save, sender=WorkSchedule)
+@receiver(post_delete, sender=WorkSchedule)
+def invalidate_schedule_availability(sender, instance, **kwargs):
+    AvailabilityService.invalidate(instance.employee_id)
+
+
+# danh mục chuyên khoa/dịch vụ thay đổi thì bỏ cache các api công khai
+@receiver(post_save, sender=Specialty)
+@receiver(post_delete, sender=Specialty)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def invalidate_catalog(sender, instance, **kwargs):
+    CatalogCache.invalidate()
+
+
+# cập nhật chỉ mục tìm kiếm dịch vụ
+@receiver(post_save, sender=Service)
+def index_service(sender, instance, created, **kwargs):
+    if created or service_index.changed(instance):
+        service_index.refresh(instance)
+
+
+@receiver(post_delete, sender=Service)
+def unindex_service(sender, instance, **kwargs):
+    service_index.remove(instance)
@@ -0,0 +1,31 @@
+from django.db.models import Count, IntegerField, OuterRef, Subquery, F
+from django.db.models.functions import Coalesce
+
+from apps.clinic.models import Appointment, AppointmentStatus, Service
+from apps.medical.models import TestOrder, TestStatus
+
+
+# đếm số dòng của queryset theo từng service bằng subquery riêng (group theo service_id),
+# ko join thẳng nhiều bảng vào Service vì join lịch hẹn x xét nghiệm sẽ nhân số dòng và đếm sai
+def count_per_service(queryset):
+    counts = queryset.filter(service_id=OuterRef('pk')).order_by().values('service_id') \
+        .annotate(total=Count('*')).values('total')
+
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+# số liệu cho các trang thống kê ở admin
+class ServiceStats:
+    # số lượt dùng mỗi dịch vụ: trong lịch hẹn đã hoàn thành + xét nghiệm đã có kết quả
+    @staticmethod
+    def usage(queryset=None):
+        if queryset is None:
+            queryset = Service.objects.filter(active=True)
+
+        return queryset.annotate(
+            appointment_use=count_per_service(
+                Appointment.services.through.objects.filter(appointment__status=AppointmentStatus.COMPLETED)),
+            test_order_use=count_per_service(TestOrder.objects.filter(status=TestStatus.COMPLETED))
+        ).annotate(
+            total_use=F('appointment_use') + F('test_order_use')
+        )
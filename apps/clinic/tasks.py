@@ -1,50 +1,58 @@
 from celery import shared_task
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
 from datetime import timedelta
 from .models import WorkSchedule
-from apps.users.models import User, UserRole
+from .services import AvailabilityService
+from .utils import get_monday_of_week
+from apps.users.models import UserRole
 
+CLONE_BATCH_SIZE = 500
 
+
+# copy lịch tuần này sang tuần sau cho các nhân viên chưa có lịch tuần sau,
+# ai đã có (đăng ký/sửa tay, hoặc lần chạy trước đã copy) thì giữ nguyên nên chạy lại ko mất gì
 @shared_task
 def auto_clone_schedule():
-    #hôm nay là thứ 2
-    today = timezone.now().date()
+    # dùng ngày theo giờ VN, lấy thứ 2 của tuần để chạy lại ngày khác vẫn đúng
+    current_monday = get_monday_of_week(timezone.localdate())
 
-    next_monday = today + timedelta(days=7)
+    next_monday = current_monday + timedelta(days=7)
     next_sunday = next_monday + timedelta(days=6)
 
-    employees = User.objects.filter(is_active=True, user_role=UserRole.EMPLOYEE)
-
-    for employee in employees:
-        current = WorkSchedule.objects.filter(
-            employee=employee,
-            from_date=today,
-            active=True
+    current = list(WorkSchedule.objects.filter(
+        week_start=current_monday,
+        active=True,
+        employee__is_active=True,
+        employee__user_role=UserRole.EMPLOYEE
+    ).exclude(
+        Exists(WorkSchedule.objects.filter(employee_id=OuterRef('employee_id'), week_start=next_monday))
+    ).values('employee_id', 'day_of_week', 'start_time', 'end_time', 'shift', 'is_appointable'))
+
+    employee_ids = {s['employee_id'] for s in current}
+
+    new_schedules = [
+        WorkSchedule(
+            week_start=next_monday,
+            week_end=next_sunday,
+            date=next_monday + timedelta(days=s['day_of_week']),
+            active=True,
+            **s
         )
+        for s in current
+    ]
 
-        if current:
-            WorkSchedule.objects.filter(
-                employee=employee,
-                from_date=next_monday
-            ).delete()
-
-            new_schedules = []
+    created = WorkSchedule.objects.bulk_create(new_schedules, batch_size=CLONE_BATCH_SIZE)
 
-            for schedule in current:
-                ws = WorkSchedule(
-                    employee=schedule.employee,
-                    day_of_week=schedule.day_of_week,
-                    start_time=schedule.start_time,
-                    end_time=schedule.end_time,
-                    shift=schedule.shift,
-                    is_appointable=schedule.is_appointable,
-                    from_date=next_monday,
-                    to_date=next_sunday,
-                    active=True
-                )
-                new_schedules.append(ws)
+    # bulk_create ko bắn signal nên tự xóa cache lịch trống
+    AvailabilityService.invalidate_many(employee_ids)
 
+    result = {
+        'week_start': next_monday.isoformat(),
+        'employees': len(employee_ids),
+        'created': len(created),
+    }
 
-            WorkSchedule.objects.bulk_create(new_schedules)
+    print(f"✅ Đã xong: {result}")
 
-    print("✅ Đã xong")
\ No newline at end of file
+    return result
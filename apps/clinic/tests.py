@@ -1,3 +1,140 @@
-from django.test import TestCase
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import time, timedelta
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework import serializers
+
+from apps.clinic.models import Specialty, Service, WorkSchedule, Appointment, AppointmentStatus
+from apps.clinic.serializers import CreateAppointmentSerializer
+from apps.clinic.stats import ServiceStats
+from apps.clinic.utils import get_monday_of_week
+from apps.medical.models import MedicalRecord, TestOrder, TestStatus
+from apps.users.models import User, UserRole, EmployeeRole
+
+
+# bắn nhiều lượt đặt cùng 1 slot song song, chỉ được đúng 1 lượt thành công
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentBookingTest(TransactionTestCase):
+    ATTEMPTS = 200
+    WORKERS = 20
+
+    def setUp(self):
+        self.doctor = User.objects.create_user(email='doctor@clinic.com', password='123', first_name='A',
+                                               last_name='B', user_role=UserRole.EMPLOYEE,
+                                               employee_role=EmployeeRole.DOCTOR)
+        self.patients = [
+            User.objects.create_user(email=f'patient{i}@clinic.com', password='123', first_name='P',
+                                     last_name=str(i), user_role=UserRole.PATIENT)
+            for i in range(self.WORKERS)
+        ]
+
+        specialty = Specialty.objects.create(name='Nội khoa')
+        self.service = Service.objects.create(specialty=specialty, name='Khám tổng quát', price=100000, duration=30)
+
+        self.date = timezone.now().date() + timedelta(days=1)
+        WorkSchedule.objects.create(employee=self.doctor, week_start=get_monday_of_week(self.date), date=self.date,
+                                    day_of_week=self.date.weekday(), start_time=time(0, 0), end_time=time(23, 0),
+                                    shift='OTHER')
+
+    def book(self, i):
+        try:
+            serializer = CreateAppointmentSerializer(data={
+                'doctor': self.doctor.id,
+                'service_ids': [self.service.id],
+                'date': self.date,
+                'start_time': time(9, 0),
+                'type': 'OFFLINE',
+            }, context={'request': SimpleNamespace(user=self.patients[i % self.WORKERS])})
+
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return True
+
+        except serializers.ValidationError:
+            return False
+
+        finally:
+            connection.close()
+
+    def test_only_one_booking_wins(self):
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            results = list(executor.map(self.book, range(self.ATTEMPTS)))
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Appointment.objects.filter(doctor=self.doctor, date=self.date).count(), 1)
+
+
+# số lượt dùng dịch vụ tính bằng query phải khớp với đếm tay trên dữ liệu ngẫu nhiên
+# (lịch hẹn có nhiều dịch vụ + nhiều xét nghiệm là trường hợp join bị nhân dòng)
+class ServiceStatsTest(TestCase):
+    def setUp(self):
+        rng = random.Random(2024)
+
+        doctor = User.objects.create_user(email='doctor@clinic.com', password='123', first_name='A', last_name='B',
+                                          user_role=UserRole.EMPLOYEE, employee_role=EmployeeRole.DOCTOR)
+        patient = User.objects.create_user(email='patient@clinic.com', password='123', first_name='P',
+                                           last_name='Q', user_role=UserRole.PATIENT)
+
+        specialty = Specialty.objects.create(name='Nội khoa')
+        self.services = [Service.objects.create(specialty=specialty, name=f'Dịch vụ {i}', price=100000, duration=30)
+                         for i in range(6)]
+        self.inactive = Service.objects.create(specialty=specialty, name='Ngưng', price=1, duration=30, active=False)
+        all_services = self.services + [self.inactive]
+
+        # bulk_create để ko chạy signal (thông báo, thanh toán...)
+        date = timezone.now().date()
+        appointments = Appointment.objects.bulk_create([
+            Appointment(doctor=doctor, patient=patient, date=date, start_time=time(8, 0), end_time=time(8, 30),
+                        status=rng.choice(AppointmentStatus.values))
+            for _ in range(60)
+        ])
+        appointments = list(Appointment.objects.filter(doctor=doctor))
+
+        Appointment.services.through.objects.bulk_create([
+            Appointment.services.through(appointment_id=a.id, service_id=service.id)
+            for a in appointments for service in rng.sample(all_services, rng.randint(0, 4))
+        ])
+
+        records = MedicalRecord.objects.bulk_create([MedicalRecord(appointment=a) for a in appointments
+                                                     if rng.random() < 0.7])
+
+        TestOrder.objects.bulk_create([
+            TestOrder(medical_record=record, service=rng.choice(all_services), status=rng.choice(TestStatus.values))
+            for record in records for _ in range(rng.randint(0, 5))
+        ])
+
+    def brute_force(self):
+        usage = {s.id: 0 for s in Service.objects.filter(active=True)}
+
+        for appointment in Appointment.objects.all():
+            if appointment.status != AppointmentStatus.COMPLETED:
+                continue
+
+            for service in appointment.services.all():
+                if service.id in usage:
+                    usage[service.id] += 1
+
+        for test_order in TestOrder.objects.all():
+            if test_order.status == TestStatus.COMPLETED and test_order.service_id in usage:
+                usage[test_order.service_id] += 1
+
+        return usage
+
+    def test_usage_matches_brute_force(self):
+        with self.assertNumQueries(1):
+            usage = {s.id: s.total_use for s in ServiceStats.usage()}
+
+        self.assertEqual(usage, self.brute_force())
+        self.assertNotIn(self.inactive.id, usage)
+        self.assertTrue(any(usage.values()))
+
+    def test_unused_service_counts_zero(self):
+        service = Service.objects.create(specialty=self.services[0].specialty, name='Mới', price=1, duration=30)
+
+        stats = ServiceStats.usage(Service.objects.filter(id=service.id)).get()
+
+        self.assertEqual((stats.appointment_use, stats.test_order_use, stats.total_use), (0, 0, 0))
@@ -1,5 +1,6 @@
 from datetime import timedelta
 
+from django.utils import timezone
 from drf_yasg import openapi
 
 param_status = openapi.Parameter('status', openapi.IN_QUERY, description="Lọc theo trạng thái lịch hẹn",
@@ -8,7 +9,7 @@ param_week_start = openapi.Parameter('week_start', openapi.IN_QUERY, description
                                      type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE)
 param_to_date = openapi.Parameter('to_date', openapi.IN_QUERY, description="Lọc đến ngày (YYYY-MM-DD)",
                                   type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE)
-param_q = openapi.Parameter('q', openapi.IN_QUERY, description="Từ khóa tìm kiếm (tên dịch vụ)",
+param_q = openapi.Parameter('q', openapi.IN_QUERY, description="Từ khóa tìm kiếm (tên, mô tả dịch vụ; ko phân biệt dấu)",
                             type=openapi.TYPE_STRING)
 
 schedule_custom_response = openapi.Schema(
@@ -27,3 +28,9 @@ schedule_custom_response = openapi.Schema(
 
 def get_monday_of_week(date):
     return date - timedelta(days=date.weekday())
+
+
+# giới hạn 2 tuần: ngày hôm nay + số ngày tới chủ nhật và thêm 1 tuần
+def get_max_booking_date():
+    today = timezone.now().date()
+    return today + timedelta(days=6 - today.weekday()) + timedelta(days=7)
@@ -10,6 +10,7 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
 from apps.clinic import paginators
+from apps.clinic.conflicts import room_index
 from apps.clinic.models import Specialty, Service, WorkSchedule, Appointment, AppointmentType, AppointmentStatus, Room, \
     Review
 from apps.clinic.perms import IsOwnerAppointment, IsOwnerSchedule
@@ -17,6 +18,8 @@ from apps.clinic.serializers import SpecialtySerializer, ServiceSerializer, Work
     RegisterScheduleSerializer, CreateAppointmentSerializer, AppointmentDetailSerializer, AppointmentSerializer, \
     ConfirmAppointmentSerializer, RoomSerializer, StartAppointmentSerializer, CancelAppointmentSerializer, \
     AppointmentStateSerializer, CompleteAppointmentSerializer, CreateReviewSerializer
+from apps.clinic.search import service_index
+from apps.clinic.services import CatalogCache
 from apps.clinic.utils import get_monday_of_week, param_q, schedule_custom_response, param_to_date, param_week_start, \
     param_status
 from apps.medical.models import MedicalRecord, TestOrder
@@ -36,7 +39,7 @@ class SpecialtyView(viewsets.ViewSet, generics.ListAPIView):
         responses={200: SpecialtySerializer(many=True)}
     )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return CatalogCache.response(request, super().list, *args, **kwargs)
 
     @swagger_auto_schema(
         operation_description='Lấy danh sách dịch vụ thuộc chuyên khoa (Hỗ trợ phân trang)',
@@ -44,6 +47,9 @@ class SpecialtyView(viewsets.ViewSet, generics.ListAPIView):
     )
     @action(methods=['get'], detail=True, url_path='services')
     def get_services(self, request, pk):
+        return CatalogCache.response(request, self.load_services, pk)
+
+    def load_services(self, request, pk):
         services = self.get_object().services.filter(active=True)
 
         p = paginators.ServicePaginator()
@@ -67,24 +73,33 @@ class ServiceView(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
         operation_description="Tra cứu danh sách dịch vụ y tế (Có thể tìm kiếm theo tên)"
     )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return CatalogCache.response(request, super().list, *args, **kwargs)
 
     @swagger_auto_schema(
         operation_description="Xem chi tiết thông tin một dịch vụ",
         responses={200: ServiceSerializer()}
     )
     def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+        return CatalogCache.response(request, super().retrieve, *args, **kwargs)
 
     def get_queryset(self):
         query = self.queryset
 
         q = self.request.query_params.get('q')
-        if q:
-            query = query.filter(name__icontains=q)
+        if q and self.action == 'list':
+            query = service_index.search(query, q)
 
         return query
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+
+        q = self.request.query_params.get('q')
+        if q and self.action == 'list':
+            context['search_terms'] = service_index.terms(q)
+
+        return context
+
 
 class WorkScheduleView(viewsets.GenericViewSet):
     permission_classes = [IsOwnerSchedule, IsEmployee]
@@ -284,17 +299,25 @@ class AppointmentView(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPI
         if appointment.type == AppointmentType.ONLINE:
             return Response([], status=status.HTTP_200_OK)
 
-        busy_room_ids = Appointment.objects.filter(
+        rooms = list(Room.objects.filter(active=True))
+
+        # index trong bộ nhớ chỉ để lọc trước, các phòng còn lại vẫn kiểm tra lại bằng db
+        busy_room_ids = room_index.busy_owners(appointment.date, [r.id for r in rooms], appointment.start_time,
+                                               appointment.end_time, exclude_id=appointment.id)
+
+        rooms = [r for r in rooms if r.id not in busy_room_ids]
+
+        busy_room_ids = set(Appointment.objects.filter(
+            room_id__in=[r.id for r in rooms],
             date=appointment.date,
-            status__in=[AppointmentStatus.CONFIRMED, AppointmentStatus.IN_PROCESS],
-            room__isnull=False,
+            status__in=room_index.statuses,
             start_time__lt=appointment.end_time,
             end_time__gt=appointment.start_time
         ).exclude(
             id=appointment.id
-        ).values_list('room_id', flat=True)
+        ).values_list('room_id', flat=True))
 
-        available_rooms = Room.objects.filter(active=True).exclude(id__in=busy_room_ids)
+        available_rooms = [r for r in rooms if r.id not in busy_room_ids]
 
         return Response(self.get_serializer(available_rooms, many=True).data, status=status.HTTP_200_OK)
 
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class MedicalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'apps.medical'
\ No newline at end of file
+    name = 'apps.medical'
+
+    def ready(self):
+        import apps.medical.signals
\ No newline at end of file
@@ -1,7 +1,18 @@
+import asyncio
 import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from apps.notifications.services import NotificationService
+from apps.notifications.serializers import NotificationWebSocketSerializer
+from apps.notifications.services import NotificationService, PresenceRegistry, PRESENCE_REFRESH_INTERVAL
+
+# số thông báo mỗi trang khi gửi bù lúc reconnect
+SYNC_PAGE_SIZE = 50
+
+# gửi bù tối đa bấy nhiêu trang, nhiều hơn thì client tải lại qua api
+SYNC_MAX_PAGES = 10
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     # async def connect(self):
@@ -20,6 +31,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
     
         await self.accept()
+
+        await sync_to_async(PresenceRegistry.connect)(self.user.id)
+        self.presence_task = asyncio.create_task(self.keep_presence())
     
         unread_count = await self.get_unread_count()
     
@@ -28,9 +42,18 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             "count": unread_count
         }))
 
+        # reconnect kèm ?last_seen_id=... thì gửi bù các thông báo bị lỡ
+        last_seen_id = parse_qs(self.scope.get('query_string', b'').decode()).get('last_seen_id')
+        if last_seen_id:
+            await self.sync_missed(last_seen_id[0])
+
     async def disconnect(self, close_code):
+        if hasattr(self, 'presence_task'):
+            self.presence_task.cancel()
+
         if hasattr(self, 'room_group_name'):
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+            await sync_to_async(PresenceRegistry.disconnect)(self.user.id)
         print("WS Disconnected")
 
     # async def disconnect(self, close_code):
@@ -43,13 +66,21 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
             if message_type == 'mark_as_read':
                 notification_id = data.get('notification_id')
+                # số chưa đọc mới được đẩy về qua unread_count_update cho mọi kết nối của user
                 await self.mark_notification_as_read(notification_id)
 
-                unread_count = await self.get_unread_count()
-                await self.send(text_data=json.dumps({
-                    "type": "unread_count",
-                    "count": unread_count
-                }))
+            # đánh dấu nhiều: gửi notification_ids, hoặc up_to_id (mọi thông báo tới id này), bỏ trống là tất cả
+            elif message_type == 'mark_all_read':
+                await self.mark_notifications_as_read(data.get('notification_ids'), data.get('up_to_id'))
+
+            # hoặc gửi last_seen_id qua message sau khi kết nối
+            elif message_type == 'sync':
+                await self.sync_missed(data.get('last_seen_id'))
+
+            # server đã tự giữ online, heartbeat chỉ để client kiểm tra kết nối
+            elif message_type == 'heartbeat':
+                await sync_to_async(PresenceRegistry.heartbeat)(self.user.id)
+                await self.send(text_data=json.dumps({"type": "heartbeat_ack"}))
 
             elif message_type == 'get_unread_count':
                 count = await self.get_unread_count()
@@ -61,6 +92,45 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             print(str(e))
 
+    # giữ trạng thái online suốt lúc kết nối còn mở, client cũ ko gửi heartbeat vẫn nhận được websocket
+    async def keep_presence(self):
+        while True:
+            await asyncio.sleep(PRESENCE_REFRESH_INTERVAL)
+
+            try:
+                await sync_to_async(PresenceRegistry.heartbeat)(self.user.id)
+            except Exception as e:
+                print(str(e))
+
+    # gửi bù theo từng trang, cũ -> mới; last_seen_id ko hợp lệ/đã bị xóa thì báo client tải lại toàn bộ
+    async def sync_missed(self, last_seen_id):
+        try:
+            cursor = await self.get_sync_cursor(int(last_seen_id))
+        except (TypeError, ValueError):
+            cursor = None
+
+        if not cursor:
+            await self.send(text_data=json.dumps({"type": "sync_reset"}))
+            return
+
+        for _ in range(SYNC_MAX_PAGES):
+            notifications, cursor, has_more = await self.get_missed(cursor)
+
+            if notifications:
+                await self.send(text_data=json.dumps({
+                    "type": "missed_notifications",
+                    "notifications": notifications
+                }))
+
+            if not has_more:
+                break
+        else:
+            # còn nữa nhưng đã quá giới hạn
+            await self.send(text_data=json.dumps({"type": "sync_reset"}))
+            return
+
+        await self.send(text_data=json.dumps({"type": "sync_complete", "last_id": cursor[1]}))
+
     async def notification_message(self, event):
         notification = event.get("notification")
 
@@ -84,6 +154,28 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     def get_unread_count(self):
         return NotificationService.get_unread_count(self.user)
 
+    @database_sync_to_async
+    def get_sync_cursor(self, last_seen_id):
+        return NotificationService.get_sync_cursor(self.user, last_seen_id)
+
+    # lấy dư 1 dòng để biết còn trang sau ko
+    @database_sync_to_async
+    def get_missed(self, cursor):
+        notifications = NotificationService.get_missed(self.user, cursor, SYNC_PAGE_SIZE + 1)
+
+        has_more = len(notifications) > SYNC_PAGE_SIZE
+        notifications = notifications[:SYNC_PAGE_SIZE]
+        if not notifications:
+            return [], cursor, False
+
+        last = notifications[-1]
+        return [NotificationWebSocketSerializer.serialize(n) for n in notifications], (last.created_date, last.id), \
+            has_more
+
     @database_sync_to_async
     def mark_notification_as_read(self, id):
         return NotificationService.mark_as_read(id, self.user)
+
+    @database_sync_to_async
+    def mark_notifications_as_read(self, ids, up_to_id):
+        return NotificationService.mark_many_as_read(self.user, ids=ids, up_to_id=up_to_id)
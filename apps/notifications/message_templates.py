@@ -0,0 +1,255 @@
+from datetime import datetime
+
+from django.template import Context, Engine
+from django.utils import timezone
+
+from apps.clinic.models import Appointment
+from apps.medical.models import TestOrder
+from apps.notifications.models import Notification, NotificationType
+from apps.payment.models import Payment
+from apps.pharmacy.models import Prescription
+
+# thông báo là text thuần nên ko escape html
+ENGINE = Engine(autoescape=False)
+
+
+def format_money(amount):
+    return f"{amount:,.0f}".replace(',', '.')
+
+
+# 1440 -> "1 ngày", 300 -> "5 tiếng", 15 -> "15 phút"
+def format_duration(minutes):
+    if minutes >= 24 * 60:
+        return f"{round(minutes / (24 * 60))} ngày"
+    if minutes >= 60:
+        return f"{round(minutes / 60)} tiếng"
+    return f"{max(minutes, 1)} phút"
+
+
+def appointment_time(appointment):
+    return (f"{appointment.date.strftime('%d/%m/%Y')} "
+            f"({appointment.start_time.strftime('%H:%M')} - {appointment.end_time.strftime('%H:%M')})")
+
+
+# nguồn dữ liệu cho 1 nhóm mẫu: lấy đối tượng kèm quan hệ bằng 1 query,
+# tên/thời gian... tính sẵn 1 lần cho mỗi đối tượng rồi dùng chung cho mọi mẫu
+class ContextSource:
+    def __init__(self, queryset, build):
+        self.queryset = queryset
+        self.build = build
+
+    def load(self, objects):
+        ids = [o.pk for o in objects]
+        loaded = {o.pk: o for o in self.queryset.filter(pk__in=ids)}
+
+        return [self.build(loaded[pk]) for pk in ids if pk in loaded]
+
+
+def build_appointment_context(appointment):
+    start = timezone.make_aware(datetime.combine(appointment.date, appointment.start_time))
+
+    return {
+        'appointment': appointment,
+        'appointment_id': appointment.id,
+        'doctor_id': appointment.doctor_id,
+        'patient_id': appointment.patient_id,
+        'doctor_name': appointment.doctor.get_full_name(),
+        'time': appointment_time(appointment),
+        'time_left': format_duration(int((start - timezone.now()).total_seconds() // 60)),
+        'room': appointment.room.name if appointment.room else None,
+        'meeting_link': appointment.meeting_link or None,
+    }
+
+
+def build_test_order_context(test_order):
+    appointment = test_order.medical_record.appointment
+
+    return {
+        'test_order': test_order,
+        'test_order_id': test_order.id,
+        'appointment_id': appointment.id,
+        'patient_id': appointment.patient_id,
+        'doctor_name': appointment.doctor.get_full_name(),
+        'service_name': test_order.service.name,
+    }
+
+
+def build_prescription_context(prescription):
+    appointment = prescription.appointment
+
+    return {
+        'prescription': prescription,
+        'prescription_id': prescription.id,
+        'appointment_id': appointment.id,
+        'patient_id': appointment.patient_id,
+        'doctor_name': appointment.doctor.get_full_name(),
+    }
+
+
+def build_payment_context(payment):
+    return {
+        'payment': payment,
+        'payment_id': payment.id,
+        'patient_id': payment.patient_id,
+        'appointment_id': payment.appointment_id,
+        'prescription_id': payment.prescription_id,
+        'doctor_name': payment.appointment.doctor.get_full_name() if payment.appointment else None,
+        'amount': format_money(payment.amount),
+        'raw_amount': str(payment.amount),
+        'method': payment.method,
+        'method_display': payment.get_method_display(),
+        'screen': 'AppointmentDetail' if payment.appointment_id else 'Prescription',
+    }
+
+
+APPOINTMENT = ContextSource(Appointment.objects.select_related('doctor', 'room'), build_appointment_context)
+
+TEST_ORDER = ContextSource(TestOrder.objects.select_related('service', 'medical_record__appointment__doctor'),
+                           build_test_order_context)
+
+PRESCRIPTION = ContextSource(Prescription.objects.select_related('appointment__doctor'), build_prescription_context)
+
+PAYMENT = ContextSource(Payment.objects.select_related('appointment__doctor'), build_payment_context)
+
+
+# 1 mẫu thông báo: biên dịch title/message 1 lần lúc import,
+# recipient là key trong context chứa id người nhận, data: key metadata -> key context (None thì bỏ),
+# screen None thì lấy theo context
+class MessageTemplate:
+    def __init__(self, source, recipient, title, message, data, screen):
+        self.source = source
+        self.recipient = recipient
+        self.title = ENGINE.from_string(title)
+        self.message = ENGINE.from_string(message)
+        self.data = data
+        self.screen = screen
+
+    def render(self, notification_type, context):
+        c = Context(context)
+
+        metadata = {key: context[name] for key, name in self.data.items() if context.get(name) is not None}
+        metadata['screen'] = self.screen or context['screen']
+
+        return Notification(
+            recipient_id=context[self.recipient],
+            type=notification_type,
+            title=self.title.render(c),
+            message=self.message.render(c),
+            metadata=metadata
+        )
+
+
+APPOINTMENT_DATA = {'appointment_id': 'appointment_id'}
+TEST_ORDER_DATA = {'appointment_id': 'appointment_id', 'test_order_id': 'test_order_id'}
+PRESCRIPTION_DATA = {'appointment_id': 'appointment_id', 'prescription_id': 'prescription_id'}
+PAYMENT_DATA = {'payment_id': 'payment_id', 'amount': 'raw_amount', 'appointment_id': 'appointment_id',
+                'prescription_id': 'prescription_id'}
+
+TEMPLATES = {
+    NotificationType.APPOINTMENT_CREATED: [
+        MessageTemplate(APPOINTMENT, 'doctor_id', "Lịch hẹn mới",
+                        "Bạn có lịch hẹn mới! {{ time }}",
+                        APPOINTMENT_DATA, 'AppointmentDetail'),
+        MessageTemplate(APPOINTMENT, 'patient_id', "Đặt lịch hẹn thành công",
+                        "Lịch hẹn của bạn với bác sĩ {{ doctor_name }} {{ time }} đang chờ xác nhận.",
+                        APPOINTMENT_DATA, 'AppointmentDetail'),
+    ],
+    NotificationType.APPOINTMENT_CONFIRMED: [
+        MessageTemplate(APPOINTMENT, 'patient_id', "Lịch hẹn đã được xác nhận",
+                        "Lịch hẹn của bạn với bác sĩ {{ doctor_name }}\n{{ time }} đã được xác nhận.\n"
+                        "{% if appointment.type == 'ONLINE' %}Link meeting: {{ meeting_link }}"
+                        "{% else %}Số phòng: {{ room }}{% endif %}",
+                        {**APPOINTMENT_DATA, 'meeting_link': 'meeting_link', 'room': 'room'}, 'AppointmentDetail'),
+    ],
+    NotificationType.APPOINTMENT_CANCELLED: [
+        MessageTemplate(APPOINTMENT, 'patient_id', "Lịch hẹn bị hủy",
+                        "Lịch hẹn của bạn với bác sĩ {{ doctor_name }} {{ time }} đã bị hủy.\n"
+                        "Lý do: {{ appointment.reason }}\nXin lỗi bạn vì sự bất tiện trên.",
+                        APPOINTMENT_DATA, 'AppointmentDetail'),
+    ],
+    NotificationType.APPOINTMENT_STARTED: [
+        MessageTemplate(APPOINTMENT, 'patient_id', "Lịch hẹn đang bắt đầu",
+                        "Bác sĩ {{ doctor_name }} đã bắt đầu khám bệnh cho bạn.",
+                        APPOINTMENT_DATA, 'AppointmentDetail'),
+    ],
+    NotificationType.APPOINTMENT_COMPLETED: [
+        MessageTemplate(APPOINTMENT, 'patient_id', "Lịch hẹn đã hoàn thành",
+                        "Lịch hẹn của bạn với bác sĩ {{ doctor_name }} đã hoàn thành. Cảm ơn bạn đã sử dụng dịch vụ.",
+                        APPOINTMENT_DATA, 'AppointmentDetail'),
+    ],
+    NotificationType.APPOINTMENT_REMINDER: [
+        MessageTemplate(APPOINTMENT, 'patient_id', "Nhắc nhở lịch hẹn",
+                        "Lịch hẹn của bạn với bác sĩ {{ doctor_name }} {{ time }} "
+                        "còn {{ time_left }} nữa, vui lòng đúng giờ hẹn.",
+                        {**APPOINTMENT_DATA, 'lead_minutes': 'lead_minutes'}, 'AppointmentDetail'),
+    ],
+    NotificationType.TEST_ORDER_REQUESTED: [
+        MessageTemplate(TEST_ORDER, 'patient_id', "Xét nghiệm mới được chỉ định",
+                        "Bác sĩ {{ doctor_name }} đã chỉ định xét nghiệm {{ service_name }} cho bạn.",
+                        TEST_ORDER_DATA, 'MedicalRecord'),
+    ],
+    NotificationType.TEST_ORDER_PROCESSING: [
+        MessageTemplate(TEST_ORDER, 'patient_id', "Xét nghiệm đang được xử lý",
+                        "Xét nghiệm {{ service_name }} của bạn đang được xử lý.\n"
+                        "Vui lòng chờ cho đến khi có được kết quả",
+                        TEST_ORDER_DATA, 'MedicalRecord'),
+    ],
+    NotificationType.TEST_ORDER_COMPLETED: [
+        MessageTemplate(TEST_ORDER, 'patient_id', "Kết quả xét nghiệm đã có",
+                        "Kết quả xét nghiệm {{ service_name }} của bạn đã có. "
+                        "Vui lòng xem chi tiết trong hồ sơ bệnh án.",
+                        TEST_ORDER_DATA, 'MedicalRecord'),
+    ],
+    NotificationType.TEST_ORDER_CANCELLED: [
+        MessageTemplate(TEST_ORDER, 'patient_id', "Xét nghiệm đã bị hủy",
+                        "Xét nghiệm {{ service_name }} của bạn đã bị hủy.\n"
+                        "Lý do: {{ test_order.reason }}\nXin lỗi bạn vì sự bất tiện trên.",
+                        TEST_ORDER_DATA, 'MedicalRecord'),
+    ],
+    NotificationType.PRESCRIPTION_CREATED: [
+        MessageTemplate(PRESCRIPTION, 'patient_id', "Đơn thuốc đã được kê",
+                        "Bác sĩ {{ doctor_name }} đã kê đơn thuốc cho bạn. "
+                        "Vui lòng xem chi tiết và thực hiện theo hướng dẫn.",
+                        PRESCRIPTION_DATA, 'Prescription'),
+    ],
+    NotificationType.PRESCRIPTION_COMPLETED: [
+        MessageTemplate(PRESCRIPTION, 'patient_id', "Đơn thuốc đã hoàn tất",
+                        "Dược sĩ đã soạn xong đơn thuốc cho bạn.\nVui lòng đến quầy để nhận thuốc",
+                        PRESCRIPTION_DATA, 'Prescription'),
+    ],
+    NotificationType.PAYMENT_CREATED: [
+        MessageTemplate(PAYMENT, 'patient_id', "Hóa đơn thanh toán mới",
+                        "{% if appointment_id %}Bạn có hóa đơn thanh toán lịch khám với bác sĩ {{ doctor_name }}"
+                        "{% else %}Bạn có hóa đơn thanh toán đơn thuốc{% endif %}\n"
+                        "với số tiền {{ amount }} VNĐ.\nMã thanh toán: {{ payment_id }}",
+                        PAYMENT_DATA, None),
+    ],
+    NotificationType.PAYMENT_SUCCESS: [
+        MessageTemplate(PAYMENT, 'patient_id', "Thanh toán thành công",
+                        "Bạn đã thanh toán thành công {{ amount }} VNĐ\n"
+                        "{% if appointment_id %}cho lịch khám với bác sĩ {{ doctor_name }}"
+                        "{% else %}cho đơn thuốc{% endif %}\n"
+                        "bằng phương thức {{ method_display }}.\nMã giao dịch: {{ payment_id }}",
+                        {**PAYMENT_DATA, 'method': 'method'}, 'PaymentDetail'),
+    ],
+}
+
+
+# render thông báo loại notification_type cho nhiều đối tượng: mỗi nguồn dữ liệu chỉ 1 query
+# extra: giá trị thêm vào context của mọi đối tượng (vd lead_minutes)
+def render(notification_type, objects, **extra):
+    notifications = []
+    contexts = {}
+
+    for template in TEMPLATES[notification_type]:
+        if template.source not in contexts:
+            contexts[template.source] = template.source.load(objects)
+
+        for context in contexts[template.source]:
+            # ko có người nhận (vd lịch hẹn chưa gán bệnh nhân) thì bỏ qua
+            if context.get(template.recipient) is None:
+                continue
+
+            notifications.append(template.render(notification_type, {**context, **extra}))
+
+    return notifications
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# thông báo cũ đã gửi trực tiếp rồi nên đánh dấu là đã gửi để ko bị quét gửi lại
+def mark_delivered(apps, schema_editor):
+    Notification = apps.get_model('notifications', 'Notification')
+    Notification.objects.filter(delivered_date__isnull=True).update(delivered_date=models.F('created_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('notifications', '0003_alter_notification_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='delivered_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['delivered_date', 'created_date'], name='notificatio_deliver_c08c79_idx'),
+        ),
+        migrations.RunPython(mark_delivered, migrations.RunPython.noop),
+    ]
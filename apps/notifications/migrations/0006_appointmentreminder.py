@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0004_searchtoken'),
+        ('notifications', '0005_notification_read_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lead_minutes', models.IntegerField()),
+                ('batch', models.UUIDField(db_index=True)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='clinic.appointment')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('appointment', 'lead_minutes'), name='unique_appointment_reminder')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0006_appointmentreminder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='delivery_attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='failed_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='websocket_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0007_notification_delivery_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='batch',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+    ]
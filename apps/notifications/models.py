@@ -42,6 +42,7 @@ class Notification(models.Model):
     action_url = models.CharField(max_length=500, blank=True)
 
     is_read = models.BooleanField(default=False)
+    read_at = models.DateTimeField(null=True, blank=True)
 
     metadata = models.JSONField(default=dict, blank=True)
 
@@ -50,9 +51,20 @@ class Notification(models.Model):
     is_deleted = models.BooleanField(default=False)
     deleted_date = models.DateTimeField(null=True, blank=True)
 
+    # null = chưa gửi firebase/websocket, dòng thông báo đóng vai trò outbox
+    delivered_date = models.DateTimeField(null=True, blank=True)
+    # websocket đã gửi lúc nào, gửi lại (retry/quét outbox) thì chỉ gửi firebase
+    websocket_date = models.DateTimeField(null=True, blank=True)
+    # số lần thử gửi firebase, hết lượt hoặc lỗi ko thử lại được thì ghi failed_date và thôi ko gửi nữa
+    delivery_attempts = models.IntegerField(default=0)
+    failed_date = models.DateTimeField(null=True, blank=True)
+    # lô insert chung (save_many), để đọc lại đúng các dòng của lô khi db ko trả id
+    batch = models.UUIDField(null=True, blank=True, db_index=True)
+
     class Meta:
         ordering = ['-created_date']
         indexes = [
+            models.Index(fields=['delivered_date', 'created_date']),
             models.Index(fields=['recipient', '-created_date']),
             models.Index(fields=['recipient', 'is_read', '-created_date']),
             models.Index(fields=['type', '-created_date']),
@@ -64,4 +76,18 @@ class Notification(models.Model):
     def soft_delete(self):
         self.is_deleted = True
         self.deleted_date = timezone.now()
-        self.save(update_fields=['is_deleted', 'deleted_date'])
\ No newline at end of file
+        self.save(update_fields=['is_deleted', 'deleted_date'])
+
+
+# đánh dấu đã nhắc lịch hẹn với từng mốc (phút trước giờ hẹn), unique để mỗi mốc chỉ nhắc 1 lần
+class AppointmentReminder(models.Model):
+    appointment = models.ForeignKey('clinic.Appointment', on_delete=models.CASCADE, related_name='reminders')
+    lead_minutes = models.IntegerField()
+    # lượt chạy nào đã giành được mốc nhắc này
+    batch = models.UUIDField(db_index=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['appointment', 'lead_minutes'], name='unique_appointment_reminder')
+        ]
@@ -0,0 +1,5 @@
+from apps.clinic.paginators import OptionalKeysetPaginator
+
+
+class NotificationPaginator(OptionalKeysetPaginator):
+    page_size = 20
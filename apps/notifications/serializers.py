@@ -8,7 +8,21 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'type', 'type_display', 'title', 'message',
-                  'metadata', 'is_read', 'created_date']
+                  'metadata', 'is_read', 'read_at', 'created_date']
+
+
+# tối đa số id mỗi lần đánh dấu theo danh sách
+MARK_READ_MAX_IDS = 500
+
+
+class MarkReadSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=MARK_READ_MAX_IDS)
+
+
+# mốc đánh dấu: tới id hoặc tới thời điểm, bỏ trống thì đánh dấu tất cả
+class MarkAllReadSerializer(serializers.Serializer):
+    up_to_id = serializers.IntegerField(required=False)
+    up_to_date = serializers.DateTimeField(required=False)
 
 #seri cho thông báo của bên websocket
 class NotificationWebSocketSerializer:
@@ -22,5 +36,6 @@ class NotificationWebSocketSerializer:
             "message": notification.message,
             "metadata": notification.metadata,
             "is_read": notification.is_read,
-            "created_at": notification.created_at.isoformat(),
+            "read_at": notification.read_at.isoformat() if notification.read_at else None,
+            "created_date": notification.created_date.isoformat(),
         }
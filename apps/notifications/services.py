@@ -1,14 +1,227 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+
+import requests
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from firebase_admin import messaging
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import QuerySet, Count, Q, F
+from django.utils import timezone
+from firebase_admin import messaging, exceptions
 
-from apps.clinic.models import AppointmentType
+from apps.notifications import message_templates
 from apps.notifications.models import Notification, NotificationType
 from apps.notifications.serializers import NotificationWebSocketSerializer
+from apps.users.models import User
+
+# số thông báo mỗi lần insert khi gửi hàng loạt
+NOTIFICATION_BATCH_SIZE = 1000
+
+# firebase giới hạn 500 token mỗi multicast
+FCM_BATCH_SIZE = 500
+
+# số lần thử gửi firebase tối đa cho 1 thông báo (tính cả retry của celery và task quét outbox)
+MAX_DELIVERY_ATTEMPTS = 7
+
+# lỗi tạm thời (mạng, firebase quá tải) mới thử lại, lỗi khác (token/payload sai...) gửi lại cũng vậy
+TRANSIENT_FCM_ERRORS = (exceptions.UnavailableError, exceptions.InternalError, exceptions.DeadlineExceededError,
+                        exceptions.ResourceExhaustedError, requests.ConnectionError, requests.Timeout)
+
+
+# raise để celery retry task gửi thông báo
+class RetryDelivery(Exception):
+    pass
+
+
+# ko được làm mới trong bấy nhiêu giây thì coi là offline (server chết ko kịp disconnect)
+PRESENCE_TIMEOUT = 90
+
+# consumer tự làm mới presence mỗi bấy nhiêu giây khi kết nối còn mở, ko cần client gửi heartbeat
+PRESENCE_REFRESH_INTERVAL = 30
+
+# bộ đếm kết nối chỉ xóa khi disconnect, TTL dài chỉ để dọn khi server chết
+PRESENCE_CONNECTIONS_TIMEOUT = 60 * 60 * 24
+
+# số chưa đọc giữ trong cache tối đa bấy nhiêu giây rồi đếm lại từ db
+UNREAD_COUNT_TIMEOUT = 60 * 60 * 6
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+# gửi nhiều event websocket (group, event) song song trong cùng 1 event loop
+def group_send_many(events):
+    channel_layer = get_channel_layer()
+
+    async def send_all():
+        results = await asyncio.gather(*[channel_layer.group_send(group, event) for group, event in events],
+                                       return_exceptions=True)
+
+        for r in results:
+            if isinstance(r, Exception):
+                print(str(r))
+
+    async_to_sync(send_all)()
+
+
+# user nào đang có kết nối websocket: consumer ghi khi connect/disconnect và làm mới định kỳ,
+# bên gửi đọc để bỏ qua group_send cho người đang offline
+class PresenceRegistry:
+    @staticmethod
+    def key(user_id):
+        return f"presence:{user_id}"
+
+    # số kết nối đang mở (nhiều thiết bị), về 0 mới offline
+    @staticmethod
+    def connections_key(user_id):
+        return f"presence_connections:{user_id}"
+
+    @staticmethod
+    def connect(user_id):
+        connections_key = PresenceRegistry.connections_key(user_id)
+
+        cache.add(connections_key, 0, timeout=PRESENCE_CONNECTIONS_TIMEOUT)
+        cache.incr(connections_key)
+        PresenceRegistry.heartbeat(user_id)
+
+    # giữ online thêm PRESENCE_TIMEOUT giây; server chết ko kịp disconnect thì tự hết hạn
+    @staticmethod
+    def heartbeat(user_id):
+        cache.set(PresenceRegistry.key(user_id), timezone.now().timestamp(), timeout=PRESENCE_TIMEOUT)
+        cache.touch(PresenceRegistry.connections_key(user_id), timeout=PRESENCE_CONNECTIONS_TIMEOUT)
+
+    @staticmethod
+    def disconnect(user_id):
+        try:
+            left = cache.decr(PresenceRegistry.connections_key(user_id))
+        except ValueError:
+            left = 0
+
+        if left <= 0:
+            cache.delete_many([PresenceRegistry.key(user_id), PresenceRegistry.connections_key(user_id)])
+
+    @staticmethod
+    def is_online(user_id):
+        return user_id in PresenceRegistry.online_many([user_id])
+
+    # lọc các user đang online bằng 1 lần đọc cache
+    @staticmethod
+    def online_many(user_ids):
+        keys = {PresenceRegistry.key(u): u for u in user_ids}
+        return {keys[k] for k in cache.get_many(keys.keys())}
+
+    # lần cuối thấy online, offline thì None
+    @staticmethod
+    def last_seen(user_id):
+        timestamp = cache.get(PresenceRegistry.key(user_id))
+        return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc) if timestamp else None
+
+
+# bộ đếm thông báo chưa đọc của từng user trong redis: tạo thì +, đọc thì -,
+# chưa có trong cache thì đếm từ db 1 lần; task reconcile định kỳ so lại với db
+class UnreadCounter:
+    @staticmethod
+    def key(user_id):
+        return f"unread_count:{user_id}"
+
+    @staticmethod
+    def get(user_id):
+        return UnreadCounter.get_many([user_id])[user_id]
+
+    @staticmethod
+    def get_many(user_ids):
+        keys = {UnreadCounter.key(u): u for u in user_ids}
+        counts = {keys[k]: v for k, v in cache.get_many(keys.keys()).items()}
+
+        missing = [u for u in user_ids if u not in counts]
+        if missing:
+            loaded = UnreadCounter.count_db(missing)
+
+            for user_id in missing:
+                # add để ko ghi đè nếu process khác vừa tăng/giảm
+                cache.add(UnreadCounter.key(user_id), loaded[user_id], timeout=UNREAD_COUNT_TIMEOUT)
+                counts[user_id] = loaded[user_id]
+
+        return counts
+
+    # đếm chưa đọc của nhiều user bằng 1 query group by
+    @staticmethod
+    def count_db(user_ids):
+        counts = dict(Notification.objects.filter(recipient_id__in=user_ids, is_read=False)
+                      .values('recipient_id').annotate(count=Count('id')).values_list('recipient_id', 'count'))
+
+        return {u: counts.get(u, 0) for u in user_ids}
+
+    # chưa có trong cache thì bỏ qua, lần đọc sau sẽ đếm từ db
+    @staticmethod
+    def incr(user_id, n=1):
+        try:
+            cache.incr(UnreadCounter.key(user_id), n)
+        except ValueError:
+            pass
+
+    @staticmethod
+    def decr(user_id, n=1):
+        try:
+            if cache.decr(UnreadCounter.key(user_id), n) < 0:
+                cache.delete(UnreadCounter.key(user_id))
+        except ValueError:
+            pass
+
+    # đẩy số chưa đọc mới cho mọi kết nối websocket của các user đang online
+    @staticmethod
+    def push_many(user_ids, counts=None):
+        try:
+            online = PresenceRegistry.online_many(user_ids)
+            user_ids = [u for u in user_ids if u in online]
+            if not user_ids:
+                return
+
+            counts = counts or UnreadCounter.get_many(user_ids)
+
+            group_send_many([(f"notifications_{u}", {
+                "type": "unread_count_update",
+                "count": counts[u]
+            }) for u in user_ids])
+
+        except Exception as e:
+            print(str(e))
+
+    @staticmethod
+    def push(user_id):
+        UnreadCounter.push_many([user_id])
+
+    # so bộ đếm đang có trong cache với db, lệch thì sửa và đẩy lại cho client
+    @staticmethod
+    def reconcile(user_ids):
+        fixed = 0
+
+        for batch in batched(user_ids, NOTIFICATION_BATCH_SIZE):
+            keys = {UnreadCounter.key(u): u for u in batch}
+            cached = {keys[k]: v for k, v in cache.get_many(keys.keys()).items()}
+            if not cached:
+                continue
+
+            actual = UnreadCounter.count_db(list(cached))
+            changed = {u: actual[u] for u in cached if cached[u] != actual[u]}
+
+            if changed:
+                cache.set_many({UnreadCounter.key(u): c for u, c in changed.items()}, timeout=UNREAD_COUNT_TIMEOUT)
+                UnreadCounter.push_many(list(changed), changed)
+                fixed += len(changed)
+
+        return fixed
 
 
 class NotificationService:
-    # gửi tbao 1 ng
+    # gửi tbao 1 ng: chỉ lưu dòng thông báo cùng transaction của người gọi,
+    # commit xong mới đẩy cho celery gửi firebase/websocket (rollback thì ko gửi gì)
     @staticmethod
     def create_notification(recipient, notification_type, title, message,
                             data, send_push=True):
@@ -18,13 +231,10 @@ class NotificationService:
                 type=notification_type,
                 title=title,
                 message=message,
-                data=data or {}
+                metadata=data or {}
             )
 
-            if send_push and hasattr(recipient, 'fcm_token'):
-                NotificationService.send_firebase(recipient.fcm_token, title, message, data or {})
-
-            NotificationService.send_websocket(recipient.id, notification)
+            transaction.on_commit(lambda: NotificationService.on_created(notification, send_push))
 
             return notification
 
@@ -32,71 +242,193 @@ class NotificationService:
             print(str(e))
             return None
 
-    # gửi tbao nhiều ng
     @staticmethod
-    def create_notifications(recipients, notification_type, title, message, data):
+    def on_created(notification, send_push=True):
+        UnreadCounter.incr(notification.recipient_id)
+        NotificationService.enqueue(notification.id, send_push)
+
+    @staticmethod
+    def enqueue(notification_id, send_push=True):
+        from apps.notifications.tasks import deliver_notification
+
         try:
-            notifications = []
-            fcm_tokens = []
-
-            for recipient in recipients:
-                notification = Notification.objects.create(
-                    recipient=recipient,
-                    type=notification_type,
-                    title=title,
-                    message=message,
-                    data=data or {}
-                )
-                notifications.append(notification)
+            deliver_notification.delay(notification_id, send_push)
+        except Exception as e:
+            # broker lỗi thì để lại, task quét outbox sẽ gửi lại sau
+            print(str(e))
+
+    # chạy trong celery worker; firebase lỗi tạm thời thì raise RetryDelivery để task retry
+    @staticmethod
+    def deliver(notification_id, send_push=True):
+        pending = Notification.objects.filter(id=notification_id, delivered_date__isnull=True,
+                                              failed_date__isnull=True)
 
-                if hasattr(recipient, 'fcm_token'):
-                    fcm_tokens.append(recipient.fcm_token)
+        notification = pending.select_related('recipient').first()
+        if not notification:
+            return False
+
+        # websocket chỉ gửi 1 lần: update có điều kiện để lần retry/worker khác ko gửi lại
+        if Notification.objects.filter(id=notification_id, websocket_date__isnull=True) \
+                .update(websocket_date=timezone.now()):
+            NotificationService.send_websocket(notification.recipient_id, notification)
+            UnreadCounter.push(notification.recipient_id)
+
+        token = notification.recipient.fcm_token
+        if send_push and token:
+            pending.update(delivery_attempts=F('delivery_attempts') + 1)
+
+            try:
+                sent = NotificationService.send_firebase(token, notification.title, notification.message,
+                                                         notification.metadata, raise_errors=True)
+            except TRANSIENT_FCM_ERRORS as e:
+                if notification.delivery_attempts + 1 < MAX_DELIVERY_ATTEMPTS:
+                    raise RetryDelivery(str(e)) from e
+                sent = False
+
+            if not sent:
+                pending.update(failed_date=timezone.now())
+                return False
+
+        # chỉ đánh dấu nếu chưa có worker khác làm
+        return pending.update(delivered_date=timezone.now()) > 0
+
+    # gửi tbao nhiều ng (recipients là list user hoặc queryset): tạo theo lô, mỗi lô 1 lần insert,
+    # firebase gửi theo lô 500 token, websocket gửi hết trong 1 event loop
+    @staticmethod
+    def create_notifications(recipients, notification_type, title, message, data, send_push=True):
+        result = {'created': 0, 'push_success': 0, 'push_failure': 0}
+
+        try:
+            if isinstance(recipients, QuerySet):
+                rows = recipients.values_list('id', 'fcm_token').iterator(chunk_size=NOTIFICATION_BATCH_SIZE)
+            else:
+                rows = ((r.id, r.fcm_token) for r in recipients)
 
-            if fcm_tokens:
-                NotificationService.send_firebase_multicast(fcm_tokens, title, message, data or {})
+            for batch in batched(rows, NOTIFICATION_BATCH_SIZE):
+                notifications = NotificationService.bulk_create(
+                    [recipient_id for recipient_id, _ in batch], notification_type, title, message, data or {})
+                result['created'] += len(notifications)
 
-            return notifications
+                recipient_ids = [n.recipient_id for n in notifications]
+                for recipient_id in recipient_ids:
+                    UnreadCounter.incr(recipient_id)
+
+                NotificationService.send_websocket_many(notifications)
+                UnreadCounter.push_many(recipient_ids)
+
+                tokens = [token for _, token in batch if token]
+                if send_push and tokens:
+                    success, failure = NotificationService.send_firebase_multicast(tokens, title, message, data or {})
+                    result['push_success'] += success
+                    result['push_failure'] += failure
+
+            return result
 
         except Exception as e:
             print(str(e))
-            return None
+            return result
+
+    @staticmethod
+    def bulk_create(recipient_ids, notification_type, title, message, data):
+        return NotificationService.save_many([
+            Notification(recipient_id=recipient_id, type=notification_type, title=title, message=message,
+                         metadata=data, delivered_date=timezone.now())
+            for recipient_id in recipient_ids
+        ])
+
+    # lưu nhiều thông báo bằng 1 lần insert
+    @staticmethod
+    def save_many(notifications):
+        batch = uuid.uuid4()
+        for n in notifications:
+            n.batch = batch
+
+        notifications = Notification.objects.bulk_create(notifications)
+
+        # mysql ko trả id sau bulk_create nên đọc lại theo batch (ko lẫn dòng của request/worker khác) để gửi đi có id
+        if notifications and notifications[0].pk is None:
+            notifications = list(Notification.objects.filter(batch=batch).order_by('id'))
+
+        return notifications
+
+    # giống create_notification nhưng cho nhiều thông báo khác nhau: 1 lần insert, commit xong đẩy 1 task gửi cả lô
+    @staticmethod
+    def create_many(notifications, send_push=True):
+        notifications = NotificationService.save_many(notifications)
+
+        transaction.on_commit(lambda: NotificationService.on_created_many(notifications, send_push))
+
+        return notifications
+
+    @staticmethod
+    def on_created_many(notifications, send_push=True):
+        from apps.notifications.tasks import deliver_notifications
+
+        for n in notifications:
+            UnreadCounter.incr(n.recipient_id)
+
+        try:
+            deliver_notifications.delay([n.id for n in notifications], send_push)
+        except Exception as e:
+            print(str(e))
+
+    @staticmethod
+    def build_android_config():
+        return messaging.AndroidConfig(
+            priority='high',
+            notification=messaging.AndroidNotification(
+                sound='default',
+                priority='high',
+            )
+        )
 
-    # gửi 1 message cho firebase
     @staticmethod
-    def send_firebase(token, title, body, data):
+    def build_apns_config():
+        return messaging.APNSConfig(
+            payload=messaging.APNSPayload(
+                aps=messaging.Aps(
+                    sound='default',
+                    badge=1,
+                )
+            )
+        )
+
+    # gửi 1 message cho firebase, trả về False nếu ko gửi được;
+    # raise_errors thì lỗi tạm thời (TRANSIENT_FCM_ERRORS) được raise ra để người gọi thử lại
+    @staticmethod
+    def send_firebase(token, title, body, data, raise_errors=False):
         try:
             message = messaging.Message(
                 notification=messaging.Notification(title=title, body=body),
                 data={str(k): str(v) for k, v in data.items()},
                 token=token,
                 # cấu hình tùy điện thoại
-                android=messaging.AndroidConfig(
-                    priority='high',
-                    notification=messaging.AndroidNotification(
-                        sound='default',
-                        priority='high',
-                    )
-                ),
-                apns=messaging.APNSConfig(
-                    payload=messaging.APNSPayload(
-                        aps=messaging.Aps(
-                            sound='default',
-                            badge=1,
-                        )
-                    )
-                )
+                android=NotificationService.build_android_config(),
+                apns=NotificationService.build_apns_config()
             )
             messaging.send(message)
+            return True
 
-        except messaging.UnregisteredError:
+        except (messaging.UnregisteredError, messaging.SenderIdMismatchError):
             print(f"FCM token chưa đăng ký: {token}")
+            NotificationService.clear_fcm_tokens([token])
+        except TRANSIENT_FCM_ERRORS as e:
+            print(str(e))
+            if raise_errors:
+                raise
         except Exception as e:
             print(str(e))
 
+        return False
+
     # gửi message websocket
     @staticmethod
     def send_websocket(user_id, notification):
         try:
+            # offline thì ko gửi, user sẽ nhận qua firebase
+            if not PresenceRegistry.is_online(user_id):
+                return
+
             channel_layer = get_channel_layer()
 
             async_to_sync(channel_layer.group_send)(
@@ -109,343 +441,215 @@ class NotificationService:
         except Exception as e:
             print(str(e))
 
-    # gửi n message cho firebase
+    # gửi websocket cho nhiều ng: mỗi ng 1 group_send, chạy song song trong cùng 1 event loop
     @staticmethod
-    def send_firebase_multicast(tokens, title, body, data):
+    def send_websocket_many(notifications):
         try:
-            messaging.MulticastMessage(
-                notification=messaging.Notification(title=title, body=body),
-                data={str(k): str(v) for k, v in data.items()},
-                tokens=tokens,
-                android=messaging.AndroidConfig(
-                    priority='high',
-                    notification=messaging.AndroidNotification(
-                        sound='default',
-                        priority='high',
-                    )
-                ),
-                apns=messaging.APNSConfig(
-                    payload=messaging.APNSPayload(
-                        aps=messaging.Aps(
-                            sound='default',
-                            badge=1,
-                        )
-                    )
-                )
-            )
+            online = PresenceRegistry.online_many({n.recipient_id for n in notifications})
+
+            group_send_many([(f"notifications_{n.recipient_id}", {
+                "type": "notification_message",
+                "notification": NotificationWebSocketSerializer.serialize(n)
+            }) for n in notifications if n.recipient_id in online])
 
-        except messaging.UnregisteredError:
-            print("Có FCM token chưa đăng ký")
         except Exception as e:
             print(str(e))
 
+    # gửi n message cho firebase, mỗi lần tối đa 500 token; token hết hạn thì xóa khỏi user
+    @staticmethod
+    def send_firebase_multicast(tokens, title, body, data):
+        success = 0
+        failure = 0
+        invalid_tokens = []
+
+        for batch in batched(tokens, FCM_BATCH_SIZE):
+            try:
+                response = messaging.send_each_for_multicast(messaging.MulticastMessage(
+                    notification=messaging.Notification(title=title, body=body),
+                    data={str(k): str(v) for k, v in data.items()},
+                    tokens=batch,
+                    android=NotificationService.build_android_config(),
+                    apns=NotificationService.build_apns_config()
+                ))
+
+                success += response.success_count
+                failure += response.failure_count
+
+                for token, r in zip(batch, response.responses):
+                    if r.success:
+                        continue
+
+                    if isinstance(r.exception, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+                        invalid_tokens.append(token)
+                    else:
+                        print(f"Gửi FCM lỗi ({token}): {r.exception}")
+
+            except Exception as e:
+                failure += len(batch)
+                print(str(e))
+
+        if invalid_tokens:
+            print(f"Có {len(invalid_tokens)} FCM token chưa đăng ký")
+            NotificationService.clear_fcm_tokens(invalid_tokens)
+
+        return success, failure
+
+    @staticmethod
+    def clear_fcm_tokens(tokens):
+        User.objects.filter(fcm_token__in=tokens).update(fcm_token=None)
+
     # đánh dấu đã đọc
     @staticmethod
     def mark_as_read(notification_id, user):
-        try:
-            Notification.objects.get(id=notification_id, recipient=user).update(is_read=True)
+        if NotificationService.mark_many_as_read(user, ids=[notification_id]):
             return True
-        except Notification.DoesNotExist:
-            return False
+
+        return Notification.objects.filter(id=notification_id, recipient=user).exists()
+
+    # đánh dấu đã đọc hàng loạt bằng 1 câu update: theo danh sách id, hoặc mọi thông báo tới id/thời điểm mốc,
+    # ko truyền gì thì đánh dấu tất cả; số chưa đọc chỉ đẩy về client 1 lần
+    @staticmethod
+    def mark_many_as_read(user, ids=None, up_to_id=None, up_to_date=None):
+        query = Notification.objects.filter(recipient=user, is_read=False)
+
+        if ids is not None:
+            query = query.filter(id__in=ids)
+        if up_to_id is not None:
+            query = query.filter(id__lte=up_to_id)
+        if up_to_date is not None:
+            query = query.filter(created_date__lte=up_to_date)
+
+        # update có điều kiện để biết thật sự có bao nhiêu thông báo đổi từ chưa đọc sang đã đọc
+        updated = query.update(is_read=True, read_at=timezone.now())
+
+        if updated:
+            UnreadCounter.decr(user.id, updated)
+            UnreadCounter.push(user.id)
+
+        return updated
+
+    # mốc đồng bộ lại khi reconnect: (created_date, id) của thông báo cuối client đã thấy, ko còn thì None
+    @staticmethod
+    def get_sync_cursor(user, last_seen_id):
+        return Notification.objects.filter(id=last_seen_id, recipient=user) \
+            .values_list('created_date', 'id').first()
+
+    # 1 trang thông báo mới hơn mốc, cũ -> mới, theo index (recipient, created_date)
+    @staticmethod
+    def get_missed(user, cursor, limit):
+        created_date, notification_id = cursor
+
+        return list(Notification.objects.filter(
+            Q(created_date__gt=created_date) | Q(created_date=created_date, id__gt=notification_id),
+            recipient=user,
+            is_deleted=False
+        ).order_by('created_date', 'id')[:limit])
 
     # get sl chưa đọc
     @staticmethod
     def get_unread_count(user):
-        return Notification.objects.filter(recipient=user, is_read=False).count()
+        return UnreadCounter.get(user.id)
+
+
+# thông báo theo mẫu (message_templates): render cả lô rồi lưu 1 lần, commit xong gửi theo lô
+def notify(notification_type, objects, **extra):
+    objects = [o for o in objects if o is not None]
+    if not objects:
+        return []
+
+    # gọi từ signal trong transaction nghiệp vụ (đặt lịch, xác nhận, thanh toán...) nên lỗi thông báo
+    # chỉ rollback savepoint của nó, ko làm hỏng transaction bên ngoài
+    try:
+        with transaction.atomic():
+            notifications = message_templates.render(notification_type, objects, **extra)
+            if not notifications:
+                return []
+
+            return NotificationService.create_many(notifications)
+
+    except Exception as e:
+        print(str(e))
+        return []
 
 
 # thông báo về lịch hẹn
 class AppointmentNotifications:
     @staticmethod
     def notify_created(appointment):
-        NotificationService.create_notification(
-            recipient=appointment.doctor,
-            notification_type=NotificationType.APPOINTMENT_CREATED,
-            title="Lịch hẹn mới",
-            message=f"Bạn có lịch hẹn mới!"
-                    f"{appointment.date.strftime('%d/%m/%Y')} ({appointment.start_time.strftime('%H:%M')}:{appointment.end_time.strftime('%H:%M')})",
-            data={
-                'appointment_id': appointment.id,
-                'screen': 'AppointmentDetail',
-            }
-        )
-
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.APPOINTMENT_CREATED,
-            title="Đặt lịch hẹn thành công",
-            message=f"Lịch hẹn của bạn với bác sĩ {appointment.doctor.get_full_name()} "
-                    f"{appointment.date.strftime('%d/%m/%Y')} ({appointment.start_time.strftime('%H:%M')}:{appointment.end_time.strftime('%H:%M')})"
-                    f"đang chờ xác nhận.",
-            data={
-                'appointment_id': appointment.id,
-                'screen': 'AppointmentDetail',
-            }
-        )
+        return notify(NotificationType.APPOINTMENT_CREATED, [appointment])
 
     @staticmethod
     def notify_confirmed(appointment):
-        if appointment.type == AppointmentType.ONLINE:
-            message = (f"Lịch hẹn của bạn với bác sĩ {appointment.doctor.get_full_name()}\n"
-                       f"{appointment.date.strftime('%d/%m/%Y')} ({appointment.start_time.strftime('%H:%M')}:{appointment.end_time.strftime('%H:%M')})"
-                       "đã được xác nhận."
-                       f"Link meeting: {appointment.meeting_link}")
-            data = {
-                'appointment_id': appointment.id,
-                'screen': 'AppointmentDetail',
-                'meeting_link': appointment.meeting_link
-            }
-        else:
-            message = (f"Lịch hẹn của bạn với bác sĩ {appointment.doctor.get_full_name()}\n"
-                       f"{appointment.date.strftime('%d/%m/%Y')} ({appointment.start_time.strftime('%H:%M')}:{appointment.end_time.strftime('%H:%M')})"
-                       "đã được xác nhận."
-                       f"Số phòng: {appointment.room.name}")
-            data = {
-                'appointment_id': appointment.id,
-                'screen': 'AppointmentDetail',
-                'room': appointment.room.name
-            }
-
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.APPOINTMENT_CONFIRMED,
-            title="Lịch hẹn đã được xác nhận",
-            message=message,
-            data=data
-        )
+        return notify(NotificationType.APPOINTMENT_CONFIRMED, [appointment])
 
     @staticmethod
     def notify_cancelled(appointment):
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.APPOINTMENT_CANCELLED,
-            title="Lịch hẹn bị hủy",
-            message=f"Lịch hẹn của bạn với bác sĩ {appointment.doctor.get_full_name()}"
-                    f"{appointment.date.strftime('%d/%m/%Y')} ({appointment.start_time.strftime('%H:%M')}:{appointment.end_time.strftime('%H:%M')})"
-                    f"Lý do: {appointment.reason}"
-                    f"Xin lỗi bạn vì sự bất tiện trên.",
-            data={
-                'appointment_id': appointment.id,
-                'screen': 'AppointmentDetail',
-            }
-        )
+        return notify(NotificationType.APPOINTMENT_CANCELLED, [appointment])
 
     @staticmethod
     def notify_started(appointment):
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.APPOINTMENT_STARTED,
-            title="Lịch hẹn đang bắt đầu",
-            message=f"Bác sĩ {appointment.doctor.get_full_name()} đã bắt đầu khám bệnh cho bạn.",
-            data={
-                'appointment_id': appointment.id,
-                'screen': 'AppointmentDetail',
-            }
-        )
+        return notify(NotificationType.APPOINTMENT_STARTED, [appointment])
 
     @staticmethod
     def notify_completed(appointment):
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.APPOINTMENT_COMPLETED,
-            title="Lịch hẹn đã hoàn thành",
-            message=f"Lịch hẹn của bạn với bác sĩ {appointment.doctor.get_full_name()} đã hoàn thành. "
-                    f"Cảm ơn bạn đã sử dụng dịch vụ.",
-            data={
-                'appointment_id': appointment.id,
-                'screen': 'AppointmentDetail',
-            }
-        )
+        return notify(NotificationType.APPOINTMENT_COMPLETED, [appointment])
 
     @staticmethod
-    def notify_reminder(appointment):
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.APPOINTMENT_REMINDER,
-            title="Nhắc nhở lịch hẹn",
-            message=(f"Lịch hẹn của bạn với bác sĩ {appointment.doctor.get_full_name()}"
-                     f"{appointment.date.strftime('%d/%m/%Y')} ({appointment.start_time.strftime('%H:%M')}:{appointment.end_time.strftime('%H:%M')})"
-                     "còn 2 tiếng nữa, vui lòng đúng giờ hẹn."),
-            data={
-                'appointment_id': appointment.id,
-                'screen': 'AppointmentDetail',
-            }
-        )
+    def notify_reminder(appointment, lead_minutes=120):
+        return AppointmentNotifications.notify_reminders([appointment], lead_minutes)
+
+    @staticmethod
+    def notify_reminders(appointments, lead_minutes):
+        return notify(NotificationType.APPOINTMENT_REMINDER, appointments, lead_minutes=lead_minutes)
 
 
 # thông báo về xét nghiệm
 class TestOrderNotifications:
     @staticmethod
     def notify_created(test_order):
-        appointment = test_order.medical_record.appointment
-
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.TEST_ORDER_REQUESTED,
-            title="Xét nghiệm mới được chỉ định",
-            message=f"Bác sĩ {appointment.doctor.get_full_name()} đã chỉ định "
-                    f"xét nghiệm {test_order.service.name} cho bạn.",
-            data={
-                'appointment_id': appointment.id,
-                'test_order_id': test_order.id,
-                'screen': 'MedicalRecord',
-            }
-        )
+        return notify(NotificationType.TEST_ORDER_REQUESTED, [test_order])
 
     @staticmethod
     def notify_completed(test_order):
-        appointment = test_order.medical_record.appointment
-
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.TEST_ORDER_COMPLETED,
-            title="Kết quả xét nghiệm đã có",
-            message=f"Kết quả xét nghiệm {test_order.service.name} của bạn đã có. "
-                    f"Vui lòng xem chi tiết trong hồ sơ bệnh án.",
-            data={
-                'appointment_id': appointment.id,
-                'test_order_id': test_order.id,
-                'screen': 'MedicalRecord',
-            }
-        )
+        return notify(NotificationType.TEST_ORDER_COMPLETED, [test_order])
 
     @staticmethod
     def notify_cancelled(test_order):
-        appointment = test_order.medical_record.appointment
-
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.TEST_ORDER_CANCELLED,
-            title="Xét nghiệm đã bị hủy",
-            message=f"Xét nghiệm {test_order.service.name} của bạn đã bị hủy."
-                    f"Lý do: {test_order.reason}"
-                    f"Xin lỗi bạn vì sự bất tiện trên.",
-            data={
-                'appointment_id': appointment.id,
-                'test_order_id': test_order.id,
-                'screen': 'MedicalRecord',
-            }
-        )
+        return notify(NotificationType.TEST_ORDER_CANCELLED, [test_order])
 
     @staticmethod
     def notify_processing(test_order):
-        appointment = test_order.medical_record.appointment
-
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.TEST_ORDER_PROCESSING,
-            title="Xét nghiệm đang được xử lý",
-            message=f"Xét nghiệm {test_order.service.name} của bạn đang được xử lý.\n"
-                    f"Vui lòng chờ cho đến khi có được kết quả",
-            data={
-                'appointment_id': appointment.id,
-                'test_order_id': test_order.id,
-                'screen': 'MedicalRecord',
-            }
-        )
+        return notify(NotificationType.TEST_ORDER_PROCESSING, [test_order])
 
 
 class PrescriptionNotifications:
     @staticmethod
     def notify_created(prescription):
-        appointment = prescription.appointment
-
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.PRESCRIPTION_CREATED,
-            title="Đơn thuốc đã được kê",
-            message=f"Bác sĩ {appointment.doctor.get_full_name()} đã kê đơn thuốc cho bạn. "
-                    f"Vui lòng xem chi tiết và thực hiện theo hướng dẫn.",
-            data={
-                'appointment_id': appointment.id,
-                'prescription_id': prescription.id,
-                'screen': 'Prescription',
-            }
-        )
+        return notify(NotificationType.PRESCRIPTION_CREATED, [prescription])
 
     @staticmethod
     def notify_completed(prescription):
-        appointment = prescription.appointment
-
-        NotificationService.create_notification(
-            recipient=appointment.patient,
-            notification_type=NotificationType.PRESCRIPTION_COMPLETED,
-            title="Đơn thuốc đã hoàn tất",
-            message="Dược sĩ đã soạn xong đơn thuốc cho bạn.\n"
-                    "Vui lòng đến quầy để nhận thuốc",
-            data={
-                'appointment_id': appointment.id,
-                'prescription_id': prescription.id,
-                'screen': 'Prescription',
-            }
-        )
+        return notify(NotificationType.PRESCRIPTION_COMPLETED, [prescription])
 
 
 class PaymentNotifications:
     @staticmethod
     def notify_created(payment):
-        amount = f"{payment.amount:,.0f}".replace(',', '.')
-        message = ''
-        screen = 'AppointmentDetail'
-
-        if payment.appointment:
-            message = (f"Bạn có hóa đơn thanh toán lịch khám với bác sĩ {payment.appointment.doctor.get_full_name()}\n"
-                       f"với số tiền {amount} VNĐ.\n"
-                       f"Mã thanh toán: {payment.id}")
-        elif payment.get_prescription:
-            message = (f"Bạn có hóa đơn thanh toán đơn thuốc\n"
-                       f"với số tiền {amount} VNĐ.\n"
-                       f"Mã thanh toán: {payment.id}")
-            screen = 'Prescription'  # sửa lại cho đúng screen
-
-        NotificationService.create_notification(
-            recipient=payment.patient,
-            notification_type=NotificationType.PAYMENT_CREATED,
-            title="Hóa đơn thanh toán mới",
-            message=message,
-            data={
-                'payment_id': payment.id,
-                'amount': str(payment.amount),
-                'appointment_id': payment.appointment_id if payment.appointment else None,
-                'prescription_id': payment.prescription_id if payment.prescription else None,
-                'screen': screen,
-            }
-        )
+        return notify(NotificationType.PAYMENT_CREATED, [payment])
 
     @staticmethod
     def notify_completed(payment):
-        amount = f"{payment.amount:,.0f}".replace(',', '.')
-        message = ''
-
-        if payment.appointment:
-            message = (f"Bạn đã thanh toán thành công {amount} VNĐ\n"
-                       f"cho lịch khám với bác sĩ {payment.appointment.doctor.get_full_name()}\n"
-                       f"bằng phương thức {payment.get_method_display()}.\n"
-                       f"Mã giao dịch: {payment.id}")
-        elif payment.prescription:
-            message = (f"Bạn đã thanh toán thành công {amount} VNĐ\n"
-                       f"cho đơn thuốc\n"
-                       f"bằng phương thức {payment.get_method_display()}.\n"
-                       f"Mã giao dịch: {payment.id}")
-
-        NotificationService.create_notification(
-            recipient=payment.patient,
-            notification_type=NotificationType.PAYMENT_COMPLETED,
-            title="Thanh toán thành công",
-            message=message,
-            data={
-                'payment_id': payment.id,
-                'amount': str(payment.amount),
-                'method': payment.method,
-                'appointment_id': payment.appointment_id if payment.appointment else None,
-                'prescription_id': payment.prescription_id if payment.get_prescription else None,
-                'screen': 'PaymentDetail',
-            }
-        )
+        return notify(NotificationType.PAYMENT_SUCCESS, [payment])
+
+    # dùng khi cập nhật hàng loạt bằng bulk_update (ko có signal)
+    @staticmethod
+    def notify_completed_many(payments):
+        return notify(NotificationType.PAYMENT_SUCCESS, payments)
 
-# class SystemNotifications:
-#     @staticmethod
-#     def notify_system_announcement(users, title, message):
-#         NotificationService.create_notifications(recipients=users,
-#                                                  notification_type=NotificationType.SYSTEM_ANNOUNCEMENT, title=title,
-#                                                  message=message, data={'screen': 'Home'})
+
+class SystemNotifications:
+    @staticmethod
+    def notify_system_announcement(users, title, message):
+        return NotificationService.create_notifications(recipients=users,
+                                                        notification_type=NotificationType.SYSTEM_ANNOUNCEMENT,
+                                                        title=title, message=message, data={'screen': 'Home'})
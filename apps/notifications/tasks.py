@@ -1,29 +1,215 @@
+import time
+import uuid
+
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Exists, OuterRef
 from django.utils import timezone
-from datetime import timedelta
+from datetime import timedelta, datetime
 
 from apps.clinic.models import Appointment, AppointmentStatus
-from apps.notifications.models import Notification
-from apps.notifications.services import AppointmentNotifications
+from apps.notifications.models import Notification, AppointmentReminder
+from apps.notifications.services import NotificationService, AppointmentNotifications, SystemNotifications, \
+    UnreadCounter, batched, RetryDelivery, MAX_DELIVERY_ATTEMPTS
+from apps.users.models import User, UserRole
+
+# thông báo chưa gửi sau bấy nhiêu phút thì coi là kẹt
+REDELIVER_AFTER_MINUTES = 10
+
+# quá thời gian này thì thôi ko gửi nữa
+REDELIVER_WINDOW_HOURS = 24
+
+REDELIVER_BATCH_SIZE = 1000
+
+# số lịch hẹn mỗi lô khi gửi nhắc
+REMINDER_BATCH_SIZE = 500
+
+# số id mỗi đoạn khi dọn thông báo
+CLEANUP_CHUNK_SIZE = 5000
+
+# so lại bộ đếm chưa đọc của những ng có thông báo mới trong khoảng này
+RECONCILE_WINDOW_HOURS = 2
+
+
+# lịch hẹn bắt đầu trong khoảng (start, end], viết theo (date, start_time) để dùng được index
+def starting_between(start, end):
+    if start.date() == end.date():
+        return Q(date=start.date(), start_time__gt=start.time(), start_time__lte=end.time())
+
+    return (Q(date=start.date(), start_time__gt=start.time())
+            | Q(date__gt=start.date(), date__lt=end.date())
+            | Q(date=end.date(), start_time__lte=end.time()))
+
+
+def appointment_start(appointment):
+    return timezone.make_aware(datetime.combine(appointment.date, appointment.start_time))
+
+
+# giành mốc nhắc cho 1 lô lịch hẹn rồi tạo thông báo trong cùng transaction:
+# insert bỏ qua trùng, dòng nào mang batch của lượt này mới là của mình -> mỗi mốc chỉ nhắc đúng 1 lần
+def send_reminders(appointments, lead_minutes, skip_before):
+    batch = uuid.uuid4()
+
+    with transaction.atomic():
+        AppointmentReminder.objects.bulk_create([
+            AppointmentReminder(appointment=a, lead_minutes=lead_minutes, batch=batch) for a in appointments
+        ], ignore_conflicts=True)
+
+        claimed = set(AppointmentReminder.objects.filter(batch=batch).values_list('appointment_id', flat=True))
 
-#chay 24/7
+        # lịch đã lọt vào mốc nhỏ hơn (vd đặt sát giờ) thì chỉ đánh dấu, mốc nhỏ hơn đã nhắc rồi
+        due = [a for a in appointments if a.id in claimed and appointment_start(a) > skip_before]
+
+        AppointmentNotifications.notify_reminders(due, lead_minutes)
+
+    return len(due)
+
+
+# chạy mỗi 5 phút: với từng mốc (vd 15 phút, 2 tiếng, 1 ngày) nhắc các lịch hẹn sắp tới chưa được nhắc mốc đó
 @shared_task
 def send_appointment_reminders():
-    now = timezone.now()
+    now = timezone.localtime()
+    leads = sorted(settings.APPOINTMENT_REMINDER_LEAD_MINUTES)
+    result = {}
+
+    for i, lead in enumerate(leads):
+        skip_before = now + timedelta(minutes=leads[i - 1]) if i else now
+
+        appointments = list(Appointment.objects.filter(
+            starting_between(now, now + timedelta(minutes=lead)),
+            status=AppointmentStatus.CONFIRMED
+        ).exclude(
+            Exists(AppointmentReminder.objects.filter(appointment=OuterRef('pk'), lead_minutes=lead))
+        ).select_related('doctor', 'patient'))
+
+        result[lead] = sum(send_reminders(batch, lead, skip_before)
+                           for batch in batched(appointments, REMINDER_BATCH_SIZE))
 
-    # Lịch hẹn trong 2 giờ tới
-    check_time = now + timedelta(hours=2)
-    appointments = Appointment.objects.filter(
-        date=check_time.date(),
-        start_time__hour=check_time.hour,
-        status=AppointmentStatus.CONFIRMED
-    )
+    return result
 
-    for appointment in appointments:
-        AppointmentNotifications.notify_reminder(appointment)
 
+# thông báo đã đọc trước mốc (dữ liệu cũ chưa có read_at thì tính theo ngày tạo)
+def read_before(cutoff):
+    return Q(is_read=True) & (Q(read_at__lt=cutoff) | Q(read_at__isnull=True, created_date__lt=cutoff))
+
+
+# điều kiện xóa theo từng loại thông báo + thông báo đã xóa mềm, cấu hình trong settings
+def retention_rules(now):
+    days = dict(settings.NOTIFICATION_RETENTION_DAYS)
+    default_days = days.pop('default')
+    deleted_days = settings.NOTIFICATION_DELETED_RETENTION_DAYS
+
+    rules = {t: Q(type=t) & read_before(now - timedelta(days=d)) for t, d in days.items()}
+    rules['default'] = ~Q(type__in=list(days)) & read_before(now - timedelta(days=default_days))
+    rules['deleted'] = Q(is_deleted=True, deleted_date__lt=now - timedelta(days=deleted_days))
+
+    # thông báo tạo sau mốc này chắc chắn chưa hết hạn theo điều kiện nào
+    newest_cutoff = now - timedelta(days=min([default_days, deleted_days, *days.values()]))
+
+    return rules, newest_cutoff
+
+
+# xóa thông báo hết hạn theo từng đoạn id, mỗi câu delete chỉ đụng tối đa CLEANUP_CHUNK_SIZE dòng
+# nên ko khóa bảng lâu; id tăng theo thời gian nên gặp đoạn còn mới là dừng
 @shared_task
 def cleanup_notifications():
-    month = timezone.now() - timedelta(days=30)
+    started = time.monotonic()
+    rules, newest_cutoff = retention_rules(timezone.now())
+
+    purged = dict.fromkeys(rules, 0)
+    chunks = 0
+
+    start_id = Notification.objects.order_by('id').values_list('id', flat=True).first()
+
+    while start_id is not None:
+        first_created = Notification.objects.filter(id__gte=start_id).order_by('id') \
+            .values_list('created_date', flat=True).first()
+
+        if first_created is None or first_created >= newest_cutoff:
+            break
+
+        end_id = start_id + CLEANUP_CHUNK_SIZE
+        chunk = Notification.objects.filter(id__gte=start_id, id__lt=end_id)
+
+        for name, rule in rules.items():
+            purged[name] += chunk.filter(rule).delete()[0]
+
+        chunks += 1
+        start_id = Notification.objects.filter(id__gte=end_id).order_by('id').values_list('id', flat=True).first()
+
+    result = {
+        'purged': {name: count for name, count in purged.items() if count},
+        'total': sum(purged.values()),
+        'chunks': chunks,
+        'seconds': round(time.monotonic() - started, 2),
+    }
+
+    print(f"🧹 Dọn thông báo: {result}")
+
+    return result
+
+
+# thông báo hệ thống cho toàn bộ bệnh nhân
+@shared_task
+def send_system_announcement(title, message):
+    patients = User.objects.filter(user_role=UserRole.PATIENT, is_active=True)
+
+    return SystemNotifications.notify_system_announcement(patients, title, message)
+
+
+# gửi firebase/websocket cho 1 thông báo đã lưu, firebase lỗi tạm thời thì thử lại với thời gian chờ tăng dần
+# (số lần thử đếm trên dòng thông báo, hết lượt thì deliver tự đánh dấu thất bại)
+@shared_task(autoretry_for=(RetryDelivery,), retry_backoff=5, retry_backoff_max=600, retry_jitter=True,
+             max_retries=MAX_DELIVERY_ATTEMPTS - 1)
+def deliver_notification(notification_id, send_push=True):
+    return NotificationService.deliver(notification_id, send_push)
+
+
+# gửi cả lô thông báo, cái nào lỗi tạm thời thì retry cả lô (cái đã gửi/đã thất bại sẽ được bỏ qua)
+@shared_task(autoretry_for=(RetryDelivery,), retry_backoff=5, retry_backoff_max=600, retry_jitter=True,
+             max_retries=MAX_DELIVERY_ATTEMPTS - 1)
+def deliver_notifications(notification_ids, send_push=True):
+    failed = 0
+
+    for notification_id in notification_ids:
+        try:
+            NotificationService.deliver(notification_id, send_push)
+        except RetryDelivery:
+            failed += 1
+        except Exception as e:
+            print(str(e))
+
+    if failed:
+        raise RetryDelivery(f"{failed}/{len(notification_ids)} thông báo gửi lỗi")
+
+    return len(notification_ids)
+
+
+# quét outbox: thông báo đã lưu mà chưa gửi được (broker lỗi, worker chết...) thì đẩy lại
+@shared_task
+def redeliver_notifications():
+    now = timezone.now()
+
+    ids = list(Notification.objects.filter(
+        delivered_date__isnull=True,
+        failed_date__isnull=True,
+        delivery_attempts__lt=MAX_DELIVERY_ATTEMPTS,
+        created_date__lt=now - timedelta(minutes=REDELIVER_AFTER_MINUTES),
+        created_date__gte=now - timedelta(hours=REDELIVER_WINDOW_HOURS)
+    ).values_list('id', flat=True)[:REDELIVER_BATCH_SIZE])
+
+    for notification_id in ids:
+        NotificationService.enqueue(notification_id)
+
+    return len(ids)
+
+
+# sửa bộ đếm chưa đọc trong redis bị lệch so với db
+@shared_task
+def reconcile_unread_counts():
+    since = timezone.now() - timedelta(hours=RECONCILE_WINDOW_HOURS)
+
+    user_ids = set(Notification.objects.filter(created_date__gte=since).values_list('recipient_id', flat=True))
 
-    return Notification.objects.filter(is_read=True, read_at__lt=month).delete()
\ No newline at end of file
+    return UnreadCounter.reconcile(user_ids)
@@ -27,3 +27,11 @@ message_response = openapi.Schema(
         'message': openapi.Schema(type=openapi.TYPE_STRING, example='Đã đánh dấu thông báo')
     }
 )
+
+mark_read_response = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'message': openapi.Schema(type=openapi.TYPE_STRING, example='Đã đánh dấu thông báo'),
+        'updated': openapi.Schema(type=openapi.TYPE_INTEGER, description='Số thông báo vừa được đánh dấu đã đọc')
+    }
+)
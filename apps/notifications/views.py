@@ -4,16 +4,19 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from apps.notifications import paginators
 from apps.notifications.models import Notification
 from apps.notifications.perms import IsOwnerNotification
-from apps.notifications.serializers import NotificationSerializer
+from apps.notifications.serializers import NotificationSerializer, MarkReadSerializer, MarkAllReadSerializer
 from apps.notifications.services import NotificationService
-from apps.notifications.ultis import param_is_read, param_notif_type, message_response, unread_count_response
+from apps.notifications.ultis import param_is_read, param_notif_type, message_response, unread_count_response, \
+    mark_read_response
 
 
 class NotificationView(viewsets.ViewSet, generics.ListAPIView):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated, IsOwnerNotification]
+    pagination_class = paginators.NotificationPaginator
 
     def get_queryset(self):
         query = Notification.objects.filter(recipient=self.request.user).select_related('recipient')
@@ -47,6 +50,34 @@ class NotificationView(viewsets.ViewSet, generics.ListAPIView):
 
         return Response({"message": "Đã đánh dấu thông báo"}, status=status.HTTP_200_OK)
 
+    @swagger_auto_schema(
+        operation_description='Đánh dấu đã đọc nhiều thông báo theo danh sách id',
+        request_body=MarkReadSerializer,
+        responses={status.HTTP_200_OK: mark_read_response}
+    )
+    @action(methods=['post'], detail=False, url_path='mark-read')
+    def mark_read(self, request):
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        updated = NotificationService.mark_many_as_read(request.user, ids=serializer.validated_data['ids'])
+
+        return Response({"message": "Đã đánh dấu thông báo", "updated": updated}, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description='Đánh dấu đã đọc tất cả thông báo, hoặc tất cả tới id/thời điểm mốc (up_to_id, up_to_date)',
+        request_body=MarkAllReadSerializer,
+        responses={status.HTTP_200_OK: mark_read_response}
+    )
+    @action(methods=['post'], detail=False, url_path='mark-all-read')
+    def mark_all_read(self, request):
+        serializer = MarkAllReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        updated = NotificationService.mark_many_as_read(request.user, **serializer.validated_data)
+
+        return Response({"message": "Đã đánh dấu tất cả thông báo", "updated": updated}, status=status.HTTP_200_OK)
+
     # api chỉ để lấy sl
     @swagger_auto_schema(
         operation_description='Lấy số lượng thông báo chưa đọc',
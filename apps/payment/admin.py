@@ -3,9 +3,11 @@ from django.utils.html import format_html
 from django.urls import reverse
 from django.db.models import Sum
 from django.utils import timezone
+from django.db import transaction
 
 from clinic_management.admin import admin_site
-from .models import Payment
+from .models import Payment, ReconciliationRun
+from .revenue import RevenueRollupService
 
 
 class PaymentAdmin(admin.ModelAdmin):
@@ -91,11 +93,22 @@ class PaymentAdmin(admin.ModelAdmin):
     source_display.short_description = 'Nguồn'
 
     def mark_as_paid(self, request, queryset):
-        updated = queryset.filter(is_paid=False).update(
-            is_paid=True,
-            paid_date=timezone.now(),
-            nurse=request.user
-        )
+        now = timezone.now()
+
+        with transaction.atomic():
+            payments = list(queryset.select_for_update().filter(is_paid=False))
+            updated = Payment.objects.filter(id__in=[p.id for p in payments]).update(
+                is_paid=True,
+                paid_date=now,
+                nurse=request.user
+            )
+
+            # update() ko có signal nên tự cộng doanh thu
+            for payment in payments:
+                payment.is_paid = True
+                payment.paid_date = now
+            RevenueRollupService.apply([(payment, 1) for payment in payments])
+
         self.message_user(request, f'Đã đánh dấu {updated} thanh toán hoàn thành')
 
     mark_as_paid.short_description = 'Đánh dấu đã thanh toán'
@@ -111,4 +124,20 @@ class PaymentAdmin(admin.ModelAdmin):
     export_revenue_report.short_description = 'Xem báo cáo doanh thu'
 
 
+class ReconciliationRunAdmin(admin.ModelAdmin):
+    list_display = ['id', 'started_date', 'finished_date', 'checked', 'paid', 'pending', 'failed', 'mismatched',
+                    'errors']
+    date_hierarchy = 'started_date'
+    readonly_fields = ['started_date', 'finished_date', 'checked', 'paid', 'pending', 'failed', 'mismatched',
+                       'errors', 'details']
+
+    # báo cáo do celery tạo, chỉ xem
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 admin_site.register(Payment, PaymentAdmin)
+admin_site.register(ReconciliationRun, ReconciliationRunAdmin)
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) tính bằng giây: ko kết nối được thì bỏ sớm, còn đọc thì chờ cổng xử lý
+GATEWAY_TIMEOUT = (3.05, 15)
+
+# số kết nối giữ sẵn (keep-alive) cho mỗi cổng thanh toán
+GATEWAY_POOL_SIZE = 20
+
+GATEWAY_RETRIES = 2
+
+
+# POST tạo giao dịch ko idempotent nên chỉ retry khi chưa kết nối được (request chưa gửi đi),
+# còn 502/503/504 thì urllib3 chỉ retry cho GET/HEAD...
+def create_session(retries=GATEWAY_RETRIES):
+    retry = Retry(total=None, connect=retries, read=0, redirect=0, other=0, status=retries,
+                  status_forcelist=(502, 503, 504), backoff_factor=0.3, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=GATEWAY_POOL_SIZE, pool_maxsize=GATEWAY_POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+# bản async cho ASGI, httpx cũng chỉ retry lỗi kết nối
+def create_async_client(retries=GATEWAY_RETRIES):
+    connect, read = GATEWAY_TIMEOUT
+    limits = httpx.Limits(max_connections=GATEWAY_POOL_SIZE, max_keepalive_connections=GATEWAY_POOL_SIZE)
+
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read, connect=connect),
+        transport=httpx.AsyncHTTPTransport(retries=retries, limits=limits)
+    )
+
+
+# client http dùng chung cả process để giữ kết nối TLS tới cổng thanh toán giữa các request
+# tạo lúc dùng lần đầu (sau khi gunicorn/celery fork) để mỗi process có pool riêng
+class GatewayClients:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._session = None
+        # AsyncClient gắn với event loop tạo ra nó nên mỗi loop 1 client
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self.lock:
+                if self._session is None:
+                    self._session = create_session()
+
+        return self._session
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+
+        if client is None:
+            client = self._async_clients[loop] = create_async_client()
+
+        return client
+
+    async def aclose(self):
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+
+        if client is not None:
+            await client.aclose()
+
+
+gateway_clients = GatewayClients()
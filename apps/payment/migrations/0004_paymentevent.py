@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0003_remove_payment_code_payment_transaction_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gateway', models.CharField(max_length=20)),
+                ('event_id', models.CharField(max_length=255)),
+                ('is_success', models.BooleanField(default=False)),
+                ('transaction_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('processed_date', models.DateTimeField(blank=True, null=True)),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='payment.payment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_date', 'created_date'], name='payment_pay_process_e83252_idx')],
+                'constraints': [models.UniqueConstraint(fields=('gateway', 'event_id'), name='unique_payment_event')],
+            },
+        ),
+    ]
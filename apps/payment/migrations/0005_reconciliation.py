@@ -0,0 +1,41 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0004_searchtoken'),
+        ('payment', '0004_paymentevent'),
+        ('pharmacy', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_date', models.DateTimeField(auto_now_add=True)),
+                ('finished_date', models.DateTimeField(blank=True, null=True)),
+                ('checked', models.IntegerField(default=0)),
+                ('paid', models.IntegerField(default=0)),
+                ('pending', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('mismatched', models.IntegerField(default=0)),
+                ('errors', models.IntegerField(default=0)),
+                ('details', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='gateway_ref',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['is_paid', 'created_date'], name='payment_pay_is_paid_93d86e_idx'),
+        ),
+    ]
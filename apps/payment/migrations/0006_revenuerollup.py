@@ -0,0 +1,30 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0005_reconciliation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('DAY', 'Ngày'), ('MONTH', 'Tháng')], max_length=10)),
+                ('date', models.DateField()),
+                ('source', models.CharField(choices=[('APPOINTMENT', 'Khám/Dịch vụ'), ('PRESCRIPTION', 'Bán thuốc')], max_length=20)),
+                ('method', models.CharField(blank=True, default='', max_length=20)),
+                ('specialty_id', models.BigIntegerField(default=0)),
+                ('service_id', models.BigIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=0, default=0, max_digits=15)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period', 'date', 'source', 'method', 'specialty_id', 'service_id'), name='unique_revenue_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:29
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+# hóa đơn online đang chờ thanh toán từ trước: lần lưu gateway_ref là lần cập nhật cuối
+def backfill_checkout_date(apps, schema_editor):
+    Payment = apps.get_model('payment', 'Payment')
+    Payment.objects.filter(is_paid=False, gateway_ref__isnull=False).update(checkout_date=F('updated_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0004_searchtoken'),
+        ('payment', '0006_revenuerollup'),
+        ('pharmacy', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='payment_pay_is_paid_93d86e_idx',
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='checkout_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['is_paid', 'checkout_date'], name='payment_pay_is_paid_e40151_idx'),
+        ),
+        migrations.RunPython(backfill_checkout_date, migrations.RunPython.noop),
+    ]
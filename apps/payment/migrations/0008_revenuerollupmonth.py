@@ -0,0 +1,21 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0007_payment_checkout_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollupMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('rebuilt_date', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -37,6 +37,12 @@ class Payment(BaseModel):
 
     transaction_id = models.CharField(max_length=255, blank=True, null=True)
 
+    # mã đơn bên cổng lúc tạo giao dịch online (orderId MoMo, PaymentIntent Stripe, TxnRef VNPay) để tra cứu lại
+    gateway_ref = models.CharField(max_length=255, blank=True, null=True)
+
+    # lúc tạo giao dịch online gần nhất, đối soát lọc theo mốc này (hóa đơn có thể tạo từ lâu mới thanh toán)
+    checkout_date = models.DateTimeField(null=True, blank=True)
+
     tracker = FieldTracker()
 
     class Meta:
@@ -47,3 +53,107 @@ class Payment(BaseModel):
                 name='payment_must_have_source'
             )
         ]
+        indexes = [
+            models.Index(fields=['is_paid', 'checkout_date'])
+        ]
+
+
+# sự kiện callback (IPN/webhook) nhận từ cổng thanh toán, lưu nguyên dữ liệu rồi mới xử lý
+# cổng gửi lại cùng 1 sự kiện thì trùng (gateway, event_id) nên chỉ lưu + xử lý 1 lần
+class PaymentEvent(models.Model):
+    gateway = models.CharField(max_length=20)
+
+    event_id = models.CharField(max_length=255)
+
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='events')
+
+    is_success = models.BooleanField(default=False)
+
+    transaction_id = models.CharField(max_length=255, blank=True, null=True)
+
+    payload = models.JSONField(default=dict)
+
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    processed_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['gateway', 'event_id'], name='unique_payment_event')
+        ]
+        indexes = [
+            models.Index(fields=['processed_date', 'created_date'])
+        ]
+
+
+# kết quả 1 lần đối soát các hóa đơn chưa thanh toán với cổng thanh toán
+class ReconciliationRun(models.Model):
+    started_date = models.DateTimeField(auto_now_add=True)
+
+    finished_date = models.DateTimeField(null=True, blank=True)
+
+    checked = models.IntegerField(default=0)
+
+    # cổng báo đã thanh toán mà mình chưa ghi nhận -> đã cập nhật
+    paid = models.IntegerField(default=0)
+
+    pending = models.IntegerField(default=0)
+
+    failed = models.IntegerField(default=0)
+
+    # số tiền bên cổng khác hóa đơn, ko tự cập nhật mà để kế toán xem
+    mismatched = models.IntegerField(default=0)
+
+    errors = models.IntegerField(default=0)
+
+    # chi tiết các hóa đơn cần chú ý (paid/mismatch/error)
+    details = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"Đối soát {self.started_date:%d/%m/%Y %H:%M}"
+
+
+class RevenueSource(models.TextChoices):
+    APPOINTMENT = 'APPOINTMENT', 'Khám/Dịch vụ'
+    PRESCRIPTION = 'PRESCRIPTION', 'Bán thuốc'
+
+
+class RevenuePeriod(models.TextChoices):
+    DAY = 'DAY', 'Ngày'
+    MONTH = 'MONTH', 'Tháng'
+
+
+# doanh thu cộng dồn theo ngày/tháng (date là ngày đầu tháng nếu MONTH) để dashboard ko phải quét bảng Payment
+# specialty_id/service_id = 0 là ko có (để unique được, null thì ko so trùng)
+class RevenueRollup(models.Model):
+    period = models.CharField(max_length=10, choices=RevenuePeriod.choices)
+
+    date = models.DateField()
+
+    source = models.CharField(max_length=20, choices=RevenueSource.choices)
+
+    method = models.CharField(max_length=20, blank=True, default='')
+
+    specialty_id = models.BigIntegerField(default=0)
+
+    service_id = models.BigIntegerField(default=0)
+
+    amount = models.DecimalField(max_digits=15, decimal_places=0, default=0)
+
+    # số lượt (dịch vụ đã dùng, lượt khám, đơn thuốc)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'date', 'source', 'method', 'specialty_id', 'service_id'],
+                                    name='unique_revenue_rollup')
+        ]
+
+
+# mỗi tháng 1 dòng làm khóa: cộng dồn (apply) và tính lại (rebuild_month) đều select_for_update dòng của tháng đó
+# nên ko chạy xen nhau (tính lại xong mới cộng tiếp, ko mất phần cộng giữa lúc đọc và lúc ghi đè)
+class RevenueRollupMonth(models.Model):
+    month = models.DateField(unique=True)
+
+    # lần tính lại gần nhất
+    rebuilt_date = models.DateTimeField(null=True, blank=True)
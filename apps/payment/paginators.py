@@ -0,0 +1,5 @@
+from apps.clinic.paginators import OptionalKeysetPaginator
+
+
+class PaymentPaginator(OptionalKeysetPaginator):
+    page_size = 10
@@ -0,0 +1,218 @@
+import copy
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction, IntegrityError
+from django.db.models import F, Min
+from django.utils import timezone
+
+from apps.clinic.models import Appointment
+from apps.medical.models import TestOrder
+from apps.notifications.services import batched
+from apps.payment.models import Payment, RevenueRollup, RevenueSource, RevenuePeriod, RevenueRollupMonth
+
+REBUILD_BATCH_SIZE = 1000
+
+# tính lại hằng đêm bấy nhiêu tháng gần nhất (tính cả tháng này), cả lịch sử thì gọi rebuild(full=True)
+REBUILD_RECENT_MONTHS = 2
+
+KEY_FIELDS = ['period', 'date', 'source', 'method', 'specialty_id', 'service_id']
+
+
+def next_month(date):
+    return (date.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def previous_month(date):
+    return (date.replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
+# khóa dòng RevenueRollupMonth của các tháng (theo thứ tự để ko deadlock), phải gọi trong transaction
+def lock_months(months):
+    months = sorted(set(months))
+    locked = list(RevenueRollupMonth.objects.select_for_update().filter(month__in=months).order_by('month'))
+
+    if len(locked) < len(months):
+        for month in months:
+            RevenueRollupMonth.objects.get_or_create(month=month)
+        locked = list(RevenueRollupMonth.objects.select_for_update().filter(month__in=months).order_by('month'))
+
+    return locked
+
+
+# tách doanh thu từng hóa đơn thành các dòng (source, specialty_id, service_id, amount, count), số query ko phụ thuộc
+# số hóa đơn: hóa đơn lịch khám chia theo giá dịch vụ + xét nghiệm (giống lúc tính tiền),
+# phần còn lại (phí khám) tính cho chuyên khoa của bác sĩ nên tổng các dòng luôn bằng amount
+def revenue_lines(payments):
+    appointment_ids = {p.appointment_id for p in payments if p.appointment_id}
+    services = defaultdict(list)
+    specialties = {}
+
+    if appointment_ids:
+        used = list(Appointment.services.through.objects.filter(appointment_id__in=appointment_ids).values_list(
+            'appointment_id', 'service__specialty_id', 'service_id', 'service__price'))
+        used += list(TestOrder.objects.filter(medical_record__appointment_id__in=appointment_ids,
+                                              deleted_date__isnull=True).values_list(
+            'medical_record__appointment_id', 'service__specialty_id', 'service_id', 'service__price'))
+
+        for appointment_id, specialty_id, service_id, price in used:
+            services[appointment_id].append((specialty_id, service_id, price))
+
+        specialties = dict(Appointment.objects.filter(id__in=appointment_ids)
+                           .values_list('id', 'doctor__doctor_profile__specialty_id'))
+
+    result = []
+
+    for payment in payments:
+        if payment.appointment_id:
+            items = services[payment.appointment_id]
+            lines = [(RevenueSource.APPOINTMENT, specialty_id, service_id, price, 1)
+                     for specialty_id, service_id, price in items]
+            lines.append((RevenueSource.APPOINTMENT, specialties.get(payment.appointment_id) or 0, 0,
+                          payment.amount - sum(price for _, _, price in items), 1))
+        else:
+            lines = [(RevenueSource.PRESCRIPTION, 0, 0, payment.amount, 1)]
+
+        result.append(lines)
+
+    return result
+
+
+# cộng các dòng của hóa đơn (nhân sign) vào totals theo key của cả bảng ngày và bảng tháng
+def collect(entries, totals):
+    for (payment, sign), lines in zip(entries, revenue_lines([p for p, _ in entries])):
+        day = timezone.localdate(payment.paid_date)
+
+        for period, date in [(RevenuePeriod.DAY, day), (RevenuePeriod.MONTH, day.replace(day=1))]:
+            for source, specialty_id, service_id, amount, count in lines:
+                total = totals[(period, date, source, payment.method or '', specialty_id, service_id)]
+                total[0] += sign * amount
+                total[1] += sign * count
+
+    return totals
+
+
+class RevenueRollupService:
+    # entries: [(payment, 1 | -1)], payment mang paid_date/method/amount cần cộng hoặc trừ
+    @staticmethod
+    def apply(entries):
+        entries = [(p, sign) for p, sign in entries if p.paid_date]
+        if not entries:
+            return
+
+        with transaction.atomic():
+            # giữ khóa tới hết transaction của người gọi, tháng đang tính lại thì chờ tính xong
+            lock_months(timezone.localdate(p.paid_date).replace(day=1) for p, _ in entries)
+
+            for key, (amount, count) in collect(entries, defaultdict(lambda: [0, 0])).items():
+                if not amount and not count:
+                    continue
+
+                fields = dict(zip(KEY_FIELDS, key))
+                increment = {'amount': F('amount') + amount, 'count': F('count') + count}
+
+                if RevenueRollup.objects.filter(**fields).update(**increment):
+                    continue
+
+                try:
+                    with transaction.atomic():
+                        RevenueRollup.objects.create(**fields, amount=amount, count=count)
+                except IntegrityError:
+                    # process khác vừa tạo dòng này
+                    RevenueRollup.objects.filter(**fields).update(**increment)
+
+    # gọi từ post_save: trừ phần cũ (nếu trước đó đã thanh toán) rồi cộng phần mới
+    @staticmethod
+    def track(payment):
+        tracker = payment.tracker
+        if not any(tracker.has_changed(f) for f in ['is_paid', 'paid_date', 'method', 'amount']):
+            return
+
+        entries = []
+
+        if tracker.previous('is_paid'):
+            old = copy.copy(payment)
+            old.paid_date = tracker.previous('paid_date')
+            old.method = tracker.previous('method')
+            old.amount = tracker.previous('amount')
+            entries.append((old, -1))
+
+        if payment.is_paid:
+            entries.append((payment, 1))
+
+        RevenueRollupService.apply(entries)
+
+    # tính lại từ bảng Payment theo từng tháng, sửa các chỗ cộng dồn bị lệch
+    # (update() ko có signal, dịch vụ/xét nghiệm của lịch hẹn đổi sau khi thanh toán...)
+    # mặc định chỉ REBUILD_RECENT_MONTHS tháng gần nhất, full thì tính lại toàn bộ lịch sử
+    # (lịch sử chưa từng được tính, vd lần chạy đầu sau khi deploy, thì cũng tính lại toàn bộ)
+    @staticmethod
+    def rebuild(full=False):
+        today = timezone.localdate()
+
+        if not full and not RevenueRollupService.history_rebuilt():
+            full = True
+
+        if full:
+            paid = Payment.objects.filter(is_paid=True, paid_date__isnull=False)
+            first = paid.aggregate(first=Min('paid_date'))['first']
+
+            if not first:
+                RevenueRollup.objects.all().delete()
+                return 0
+
+            month = timezone.localdate(first).replace(day=1)
+            RevenueRollup.objects.filter(date__lt=month).delete()
+        else:
+            month = today.replace(day=1)
+            for _ in range(REBUILD_RECENT_MONTHS - 1):
+                month = previous_month(month)
+
+        rows = 0
+
+        while month <= today:
+            rows += RevenueRollupService.rebuild_month(month)
+            month = next_month(month)
+
+        if full:
+            RevenueRollup.objects.filter(date__gte=month).delete()
+
+        return rows
+
+    # tháng có hóa đơn thanh toán sớm nhất đã được tính lại chưa
+    @staticmethod
+    def history_rebuilt():
+        first = Payment.objects.filter(is_paid=True, paid_date__isnull=False).aggregate(first=Min('paid_date'))['first']
+        if not first:
+            return True
+
+        return RevenueRollupMonth.objects.filter(month=timezone.localdate(first).replace(day=1),
+                                                 rebuilt_date__isnull=False).exists()
+
+    @staticmethod
+    def rebuild_month(month):
+        start = timezone.make_aware(datetime.combine(month, time.min))
+        end = timezone.make_aware(datetime.combine(next_month(month), time.min))
+
+        payments = Payment.objects.filter(is_paid=True, paid_date__gte=start, paid_date__lt=end) \
+            .only('id', 'appointment_id', 'amount', 'paid_date', 'method').order_by('id')
+
+        # đọc và ghi đè cùng 1 lần khóa: apply() của tháng này chờ tới khi xong,
+        # hóa đơn commit trước khi lấy được khóa thì đã nằm trong lần đọc
+        with transaction.atomic():
+            marker, = lock_months([month])
+
+            totals = defaultdict(lambda: [0, 0])
+            for batch in batched(payments.iterator(chunk_size=REBUILD_BATCH_SIZE), REBUILD_BATCH_SIZE):
+                collect([(p, 1) for p in batch], totals)
+
+            rollups = [RevenueRollup(**dict(zip(KEY_FIELDS, key)), amount=amount, count=count)
+                       for key, (amount, count) in totals.items() if amount or count]
+
+            RevenueRollup.objects.filter(date__gte=month, date__lt=next_month(month)).delete()
+            RevenueRollup.objects.bulk_create(rollups, batch_size=REBUILD_BATCH_SIZE)
+
+            marker.rebuilt_date = timezone.now()
+            marker.save(update_fields=['rebuilt_date'])
+
+        return len(rollups)
@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from apps.notifications.services import PaymentNotifications
+from apps.payment.models import Payment, PaymentEvent, ReconciliationRun
+from apps.payment.revenue import RevenueRollupService
+from apps.payment.strategies import PaymentStrategyFactory, QUERY_PAID, QUERY_PENDING, QUERY_FAILED
+
+# các phương thức có api tra cứu để đối soát
+RECONCILE_METHODS = ['MOMO', 'STRIPE', 'VNPAY']
+
+# trạng thái thêm khi đối soát: số tiền lệch / tra cứu lỗi
+RECONCILE_MISMATCH = 'MISMATCH'
+RECONCILE_ERROR = 'ERROR'
+
+
+# xử lý callback của cổng thanh toán theo kiểu lưu trước xử lý sau:
+# callback chỉ lưu sự kiện (unique theo event_id) rồi trả 200 ngay, cập nhật hóa đơn + thông báo chạy trong celery
+class PaymentEventService:
+    # lưu sự kiện, cổng gửi lại sự kiện đã có thì trả về False
+    @staticmethod
+    def record(gateway, payment_id, callback, payload):
+        try:
+            with transaction.atomic():
+                event = PaymentEvent.objects.create(
+                    gateway=gateway,
+                    event_id=callback['event_id'],
+                    payment_id=payment_id,
+                    is_success=callback['is_success'],
+                    transaction_id=callback['transaction_id'],
+                    payload=payload
+                )
+        except IntegrityError:
+            return False
+
+        transaction.on_commit(lambda: PaymentEventService.enqueue(event.id))
+
+        return True
+
+    @staticmethod
+    def enqueue(event_id):
+        from apps.payment.tasks import process_payment_event
+
+        try:
+            process_payment_event.delay(event_id)
+        except Exception as e:
+            # broker lỗi thì để lại, task quét sẽ xử lý sau
+            print(str(e))
+
+    # chạy trong celery worker, gọi nhiều lần cho cùng 1 sự kiện vẫn chỉ xử lý 1 lần
+    @staticmethod
+    def process(event_id):
+        with transaction.atomic():
+            # update có điều kiện để nhận sự kiện, worker khác nhận trước thì bỏ qua
+            claimed = PaymentEvent.objects.filter(id=event_id, processed_date__isnull=True) \
+                .update(processed_date=timezone.now())
+            if not claimed:
+                return False
+
+            event = PaymentEvent.objects.get(id=event_id)
+            if not event.is_success:
+                return False
+
+            # khóa hóa đơn để các sự kiện thành công của cùng 1 hóa đơn xếp hàng, chỉ cái đầu tiên được ghi
+            payment = Payment.objects.select_for_update().filter(id=event.payment_id, active=True).first()
+            if not payment or payment.is_paid:
+                return False
+
+            payment.is_paid = True
+            payment.paid_date = timezone.now()
+            payment.transaction_id = event.transaction_id
+            # save để signal gửi thông báo thanh toán thành công (đúng 1 lần vì is_paid chỉ đổi 1 lần)
+            payment.save(update_fields=['is_paid', 'paid_date', 'transaction_id', 'updated_date'])
+
+        return True
+
+
+# đối soát hóa đơn online chưa thanh toán với cổng (callback bị mất thì cổng đã thu tiền mà mình chưa biết)
+# mỗi đoạn hóa đơn tra cứu song song bằng thread pool, cái nào đã thanh toán thì cập nhật 1 lần bằng bulk_update
+class ReconciliationService:
+    # chạy trong thread của pool, chỉ gọi http ko đụng db
+    @staticmethod
+    def query(payment):
+        try:
+            result = PaymentStrategyFactory.get_strategy(payment.method).query(payment)
+        except Exception as e:
+            return {'status': RECONCILE_ERROR, 'message': str(e)}
+
+        if result['status'] == QUERY_PAID and Decimal(str(result['amount'] or 0)) != payment.amount:
+            return {**result, 'status': RECONCILE_MISMATCH}
+
+        return result
+
+    @staticmethod
+    def query_many(payments, workers):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(ReconciliationService.query, payments))
+
+    # ghi nhận các hóa đơn cổng báo đã thanh toán, khóa lại để ko đè lên callback đang xử lý cùng lúc
+    @staticmethod
+    def mark_paid(results):
+        now = timezone.now()
+        transaction_ids = {payment.id: result['transaction_id'] for payment, result in results}
+
+        with transaction.atomic():
+            payments = list(Payment.objects.select_for_update()
+                            .filter(id__in=transaction_ids.keys(), is_paid=False, active=True))
+
+            for payment in payments:
+                payment.is_paid = True
+                payment.paid_date = now
+                payment.transaction_id = transaction_ids[payment.id]
+                payment.updated_date = now
+
+            Payment.objects.bulk_update(payments, ['is_paid', 'paid_date', 'transaction_id', 'updated_date'])
+            # bulk_update ko có signal nên tự cộng doanh thu
+            RevenueRollupService.apply([(payment, 1) for payment in payments])
+
+            transaction.on_commit(lambda: PaymentNotifications.notify_completed_many(payments))
+
+        return {payment.id for payment in payments}
+
+    @staticmethod
+    def run(checkout_before, checkout_after, chunk_size, workers):
+        report = ReconciliationRun.objects.create()
+
+        queryset = Payment.objects.filter(
+            is_paid=False,
+            active=True,
+            method__in=RECONCILE_METHODS,
+            gateway_ref__isnull=False,
+            checkout_date__lt=checkout_before,
+            checkout_date__gte=checkout_after
+        ).order_by('id')
+
+        last_id = 0
+
+        while True:
+            payments = list(queryset.filter(id__gt=last_id)[:chunk_size])
+            if not payments:
+                break
+
+            last_id = payments[-1].id
+            results = list(zip(payments, ReconciliationService.query_many(payments, workers)))
+
+            paid_ids = ReconciliationService.mark_paid([(p, r) for p, r in results if r['status'] == QUERY_PAID])
+
+            report.checked += len(payments)
+            report.paid += len(paid_ids)
+
+            for payment, result in results:
+                if result['status'] == QUERY_PENDING:
+                    report.pending += 1
+                elif result['status'] == QUERY_FAILED:
+                    report.failed += 1
+                elif result['status'] == RECONCILE_MISMATCH:
+                    report.mismatched += 1
+                elif result['status'] == RECONCILE_ERROR:
+                    report.errors += 1
+
+                # callback về trước khi kịp khóa thì ko tính là đối soát cập nhật
+                if result['status'] == QUERY_PAID and payment.id not in paid_ids:
+                    continue
+
+                if result['status'] not in [QUERY_PENDING, QUERY_FAILED]:
+                    report.details.append({
+                        'payment_id': payment.id,
+                        'method': payment.method,
+                        'gateway_ref': payment.gateway_ref,
+                        'amount': str(payment.amount),
+                        'status': result['status'],
+                        'gateway_amount': str(result['amount']) if result.get('amount') is not None else None,
+                        'transaction_id': result.get('transaction_id'),
+                        'message': result.get('message'),
+                    })
+
+        report.finished_date = timezone.now()
+        report.save()
+
+        return report
@@ -1,10 +1,11 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver, Signal
 from django.db.models import Sum
 
 from apps.clinic.models import Appointment, AppointmentStatus
 from apps.notifications.services import PrescriptionNotifications, PaymentNotifications
 from apps.payment.models import Payment
+from apps.payment.revenue import RevenueRollupService
 
 
 @receiver(post_save, sender=Appointment)
@@ -55,3 +56,15 @@ def create_payment(sender, instance, created, **kwargs):
 
     if instance.tracker.has_changed('is_paid') and instance.is_paid == True:
         PaymentNotifications.notify_completed(instance)
+
+
+# cộng dồn doanh thu ngay khi hóa đơn được thanh toán (hoặc bị sửa/hủy thanh toán)
+@receiver(post_save, sender=Payment)
+def update_revenue_rollups(sender, instance, created, **kwargs):
+    RevenueRollupService.track(instance)
+
+
+@receiver(post_delete, sender=Payment)
+def remove_revenue_rollups(sender, instance, **kwargs):
+    if instance.is_paid:
+        RevenueRollupService.apply([(instance, -1)])
@@ -1,25 +1,56 @@
 import hashlib
 import hmac
-import requests
+import threading
+import httpx
 import stripe
+from asgiref.sync import sync_to_async
 from abc import ABC, abstractmethod
 from django.conf import settings
 from django.utils import timezone
 import uuid
 
+from apps.payment.clients import gateway_clients, create_session, GATEWAY_TIMEOUT, GATEWAY_RETRIES
 from apps.payment.models import PaymentMethod
 from apps.payment.ultis import vnpay
 
 
+# trạng thái giao dịch khi tra cứu bên cổng
+QUERY_PAID = 'PAID'
+QUERY_PENDING = 'PENDING'
+QUERY_FAILED = 'FAILED'
+
+
+# chỉ dùng *_id để gọi được trong async (ko truy vấn quan hệ)
+def order_info(payment):
+    if payment.appointment_id:
+        return "Thanh toán lịch khám"
+    if payment.prescription_id:
+        return "Thanh toán đơn thuốc"
+    return ''
+
+
 class PaymentStrategy(ABC):
     @abstractmethod
     def process(self, payment, **kwargs):
         pass
 
+    # bản async cho view chạy trên ASGI, cổng nào gọi http thì tự viết lại bằng client async
+    async def aprocess(self, payment, **kwargs):
+        return await sync_to_async(self.process)(payment, **kwargs)
+
     @abstractmethod
     def verify(self, payment, transaction_data):
         pass
 
+    # tra cứu giao dịch theo payment.gateway_ref (dùng khi đối soát),
+    # trả về {'status': QUERY_*, 'amount', 'transaction_id', 'message'}, lỗi kết nối thì raise
+    def query(self, payment):
+        raise ValueError("Phương thức thanh toán không hỗ trợ tra cứu")
+
+    # đọc dữ liệu callback của cổng: event_id (cổng gửi lại thì vẫn giữ nguyên), payment_id, kết quả, mã giao dịch
+    def parse_callback(self, transaction_data):
+        raise ValueError("Phương thức thanh toán không có callback")
+
 
 class CashPaymentStrategy(PaymentStrategy):
     def process(self, payment, **kwargs):
@@ -68,18 +99,17 @@ class MoMoPaymentStrategy(PaymentStrategy):
         self.secret_key = settings.MOMO_SECRET_KEY
         self.endpoint = settings.MOMO_ENDPOINT
         self.ipn_url = settings.MOMO_IPN_URL
+        # api tra cứu nằm cạnh api tạo đơn: .../v2/gateway/api/create -> .../v2/gateway/api/query
+        self.query_endpoint = self.endpoint.rsplit('/', 1)[0] + '/query'
+        self.session = gateway_clients.session
 
-    def process(self, payment, **kwargs):
+    # tạo payload đã ký, trả về (payload, order_id, request_id)
+    def build_request(self, payment, redirect_url):
         timestamp = int(timezone.now().timestamp())
         order_id = f"{payment.id}_{timestamp}"
         request_id = str(uuid.uuid4())
         extra_data = ''
-        order_info = ''
-        redirect_url = kwargs.get('redirect_url')
-        if payment.appointment:
-            order_info = "Thanh toán lịch khám"
-        elif payment.get_prescription:
-            order_info = "Thanh toán đơn thuốc"
+        info = order_info(payment)
 
         raw_signature = (
             f"accessKey={self.access_key}"
@@ -87,7 +117,7 @@ class MoMoPaymentStrategy(PaymentStrategy):
             f"&extraData={extra_data}"
             f"&ipnUrl={self.ipn_url}"
             f"&orderId={order_id}"
-            f"&orderInfo={order_info}"
+            f"&orderInfo={info}"
             f"&partnerCode={self.partner_code}"
             f"&redirectUrl={redirect_url}"
             f"&requestId={request_id}"
@@ -104,7 +134,7 @@ class MoMoPaymentStrategy(PaymentStrategy):
             "requestId": request_id,
             "amount": str(int(payment.amount)),
             "orderId": order_id,
-            "orderInfo": order_info,
+            "orderInfo": info,
             "redirectUrl": redirect_url,
             "ipnUrl": self.ipn_url,
             "lang": "vi",
@@ -113,37 +143,60 @@ class MoMoPaymentStrategy(PaymentStrategy):
             "signature": signature,
         }
 
-        try:
-            response = requests.post(self.endpoint, json=payload, timeout=30)
-
-            res_json = response.json()
+        return payload, order_id, request_id
 
-            if res_json.get("resultCode") == 0:
-                return {
-                    'success': True,
-                    'transaction_id': request_id,
-                    'message': 'Tạo thanh toán MoMo thành công',
-                    'data': {
-                        'pay_url': res_json.get('payUrl'),
-                        'qr_code_url': res_json.get('qrCodeUrl'),
-                        'deep_link': res_json.get('deeplink'),
-                        'order_id': order_id
-                    }
-                }
-            else:
-                return {
-                    'success': False,
-                    'transaction_id': None,
-                    'message': f"MoMo error: {res_json.get('message')}"
+    @staticmethod
+    def build_result(res_json, order_id, request_id):
+        if res_json.get("resultCode") == 0:
+            return {
+                'success': True,
+                'transaction_id': request_id,
+                'gateway_ref': order_id,
+                'message': 'Tạo thanh toán MoMo thành công',
+                'data': {
+                    'pay_url': res_json.get('payUrl'),
+                    'qr_code_url': res_json.get('qrCodeUrl'),
+                    'deep_link': res_json.get('deeplink'),
+                    'order_id': order_id
                 }
-
-        except Exception as e:
+            }
+        else:
             return {
                 'success': False,
                 'transaction_id': None,
-                'message': f'Lỗi kết nối MoMo: {str(e)}'
+                'message': f"MoMo error: {res_json.get('message')}"
             }
 
+    @staticmethod
+    def build_error(e):
+        return {
+            'success': False,
+            'transaction_id': None,
+            'message': f'Lỗi kết nối MoMo: {str(e)}'
+        }
+
+    def process(self, payment, **kwargs):
+        payload, order_id, request_id = self.build_request(payment, kwargs.get('redirect_url'))
+
+        try:
+            response = self.session.post(self.endpoint, json=payload, timeout=GATEWAY_TIMEOUT)
+
+            return self.build_result(response.json(), order_id, request_id)
+
+        except Exception as e:
+            return self.build_error(e)
+
+    async def aprocess(self, payment, **kwargs):
+        payload, order_id, request_id = self.build_request(payment, kwargs.get('redirect_url'))
+
+        try:
+            response = await gateway_clients.async_client().post(self.endpoint, json=payload)
+
+            return self.build_result(response.json(), order_id, request_id)
+
+        except Exception as e:
+            return self.build_error(e)
+
     def verify(self, payment, transaction_data):
         try:
             # lấy chữ ký đã gửi
@@ -175,56 +228,133 @@ class MoMoPaymentStrategy(PaymentStrategy):
             print(str(e))
             return False
 
+    def query(self, payment):
+        request_id = str(uuid.uuid4())
+
+        raw_signature = (
+            f"accessKey={self.access_key}"
+            f"&orderId={payment.gateway_ref}"
+            f"&partnerCode={self.partner_code}"
+            f"&requestId={request_id}"
+        )
+
+        signature = hmac.new(self.secret_key.encode('utf-8'), raw_signature.encode('utf-8'),
+                             hashlib.sha256).hexdigest()
+
+        response = self.session.post(self.query_endpoint, json={
+            "partnerCode": self.partner_code,
+            "requestId": request_id,
+            "orderId": payment.gateway_ref,
+            "lang": "vi",
+            "signature": signature,
+        }, timeout=GATEWAY_TIMEOUT)
+        response.raise_for_status()
+        res_json = response.json()
+
+        result_code = res_json.get('resultCode')
+        if result_code == 0:
+            query_status = QUERY_PAID
+        # 1000: chờ người dùng xác nhận, 7000/7002: đang xử lý
+        elif result_code in (1000, 7000, 7002):
+            query_status = QUERY_PENDING
+        else:
+            query_status = QUERY_FAILED
+
+        trans_id = res_json.get('transId')
+
+        return {
+            'status': query_status,
+            'amount': res_json.get('amount'),
+            'transaction_id': str(trans_id) if trans_id is not None else None,
+            'message': res_json.get('message')
+        }
+
+    def parse_callback(self, transaction_data):
+        order_id = transaction_data.get('orderId') or ''
+
+        return {
+            'event_id': f"{order_id}:{transaction_data.get('transId')}",
+            'payment_id': order_id.split('_')[0],
+            'is_success': transaction_data.get('resultCode') == 0,
+            'transaction_id': transaction_data.get('transId')
+        }
+
 
 # stripe là embedded
 class StripePaymentStrategy(PaymentStrategy):
     def __init__(self):
-        stripe.api_key = settings.STRIPE_SECRET_KEY
+        # client riêng giữ api key + pool kết nối, ko gán lại stripe.api_key toàn cục mỗi lần thanh toán
+        # stripe tự retry kèm idempotency key nên session của nó ko cần retry thêm
+        # *_async của stripe chạy qua async_fallback_client (httpx)
+        connect, read = GATEWAY_TIMEOUT
+        self.client = stripe.StripeClient(
+            settings.STRIPE_SECRET_KEY,
+            http_client=stripe.RequestsClient(
+                timeout=GATEWAY_TIMEOUT,
+                session=create_session(retries=0),
+                async_fallback_client=stripe.HTTPXClient(timeout=httpx.Timeout(read, connect=connect))
+            ),
+            max_network_retries=GATEWAY_RETRIES
+        )
         self.publishable_key = settings.STRIPE_PUBLISHABLE_KEY
 
+    @staticmethod
+    def build_params(payment):
+        return {
+            'amount': int(payment.amount),
+            'currency': 'vnd',
+            'description': order_info(payment),
+            'metadata': {
+                'payment_id': payment.id,
+                'patient_id': payment.patient_id
+            },
+            'automatic_payment_methods': {'enabled': True}
+        }
+
+    def build_result(self, intent):
+        return {
+            'success': True,
+            'transaction_id': intent.id,
+            'gateway_ref': intent.id,
+            'message': 'Tạo thanh toán Stripe thành công',
+            'data': {
+                'client_secret': intent.client_secret,
+                'publishable_key': self.publishable_key,
+                'payment_intent_id': intent.id
+            }
+        }
+
+    @staticmethod
+    def build_error(e):
+        if isinstance(e, stripe.error.StripeError):
+            message = f'Stripe error: {str(e)}'
+        else:
+            message = f'Lỗi xử lý thanh toán: {str(e)}'
+
+        return {
+            'success': False,
+            'transaction_id': None,
+            'message': message
+        }
+
     def process(self, payment, **kwargs):
         try:
-            description = ''
-            if payment.appointment:
-                description = "Thanh toán lịch khám"
-            elif payment.get_prescription:
-                description = "Thanh toán đơn thuốc"
-
             # tạo 1 giao dịch chờ
-            intent = stripe.PaymentIntent.create(
-                amount=int(payment.amount),
-                currency='vnd',
-                description=description,
-                metadata={
-                    'payment_id': payment.id,
-                    'patient_id': payment.patient.id
-                },
-                automatic_payment_methods={'enabled': True}
-            )
+            intent = self.client.v1.payment_intents.create(params=self.build_params(payment))
 
-            return {
-                'success': True,
-                'transaction_id': intent.id,
-                'message': 'Tạo thanh toán Stripe thành công',
-                'data': {
-                    'client_secret': intent.client_secret,
-                    'publishable_key': self.publishable_key,
-                    'payment_intent_id': intent.id
-                }
-            }
+            return self.build_result(intent)
 
-        except stripe.error.StripeError as e:
-            return {
-                'success': False,
-                'transaction_id': None,
-                'message': f'Stripe error: {str(e)}'
-            }
         except Exception as e:
-            return {
-                'success': False,
-                'transaction_id': None,
-                'message': f'Lỗi xử lý thanh toán: {str(e)}'
-            }
+            return self.build_error(e)
+
+    async def aprocess(self, payment, **kwargs):
+        try:
+            intent = await self.client.v1.payment_intents.create_async(params=self.build_params(payment))
+
+            return self.build_result(intent)
+
+        except Exception as e:
+            return self.build_error(e)
 
     def verify(self, payment, transaction_data):
         try:
@@ -240,19 +370,49 @@ class StripePaymentStrategy(PaymentStrategy):
             print(str(e))
             return False
 
+    def query(self, payment):
+        intent = self.client.v1.payment_intents.retrieve(payment.gateway_ref)
+
+        if intent.status == 'succeeded':
+            query_status = QUERY_PAID
+        elif intent.status == 'canceled':
+            query_status = QUERY_FAILED
+        else:
+            query_status = QUERY_PENDING
+
+        return {
+            'status': query_status,
+            'amount': intent.amount,
+            'transaction_id': intent.id,
+            'message': intent.status
+        }
+
+    def parse_callback(self, transaction_data):
+        event = transaction_data.get('data', {})
+        data_object = event.get('data', {}).get('object', {})
+
+        return {
+            'event_id': event.get('id'),
+            'payment_id': data_object.get('metadata', {}).get('payment_id'),
+            'is_success': event.get('type') == 'payment_intent.succeeded',
+            'transaction_id': data_object.get('id')
+        }
+
+
 class VNPayPaymentStrategy(PaymentStrategy):
     def __init__(self):
         self.tmn_code = settings.VNPAY_TMN_CODE
         self.hash_secret = settings.VNPAY_HASH_SECRET_KEY
         self.payment_url = settings.VNPAY_PAYMENT_URL
+        self.api_url = settings.VNPAY_API_URL
+        self.session = gateway_clients.session
 
     def process(self, payment, **kwargs):
         try:
-            order_info = ''
-            if payment.appointment:
-                order_info = "Thanh toán lịch khám"
-            elif payment.get_prescription:
-                order_info = "Thanh toán đơn thuốc"
+            # TxnRef = {payment_id}_{thời gian tạo}: mỗi lần thanh toán lại là 1 mã mới,
+            # thời gian tạo cần khi tra cứu (vnp_TransactionDate)
+            create_date = timezone.localtime().strftime('%Y%m%d%H%M%S')
+            txn_ref = f"{payment.id}_{create_date}"
 
             vnp = vnpay()
 
@@ -261,11 +421,11 @@ class VNPayPaymentStrategy(PaymentStrategy):
             vnp.request_data['vnp_TmnCode'] = self.tmn_code
             vnp.request_data['vnp_Amount'] = str(int(payment.amount * 100))
             vnp.request_data['vnp_CurrCode'] = 'VND'
-            vnp.request_data['vnp_TxnRef'] = payment.code
-            vnp.request_data['vnp_OrderInfo'] = order_info
+            vnp.request_data['vnp_TxnRef'] = txn_ref
+            vnp.request_data['vnp_OrderInfo'] = order_info(payment)
             vnp.request_data['vnp_OrderType'] = 'other'
             vnp.request_data['vnp_Locale'] = 'vn'
-            vnp.request_data['vnp_CreateDate'] = timezone.now().strftime('%Y%m%d%H%M%S')
+            vnp.request_data['vnp_CreateDate'] = create_date
             vnp.request_data['vnp_IpAddr'] = kwargs.get('ip_addr')
             vnp.request_data['vnp_ReturnUrl'] = kwargs.get('redirect_url')
 
@@ -274,10 +434,11 @@ class VNPayPaymentStrategy(PaymentStrategy):
             return {
                 'success': True,
                 'transaction_id': payment.id,
+                'gateway_ref': txn_ref,
                 'message': 'Tạo thanh toán VNPay thành công',
                 'data': {
                     'payment_url': payment_url,
-                    'transaction_ref': payment.id
+                    'transaction_ref': txn_ref
                 }
             }
 
@@ -288,6 +449,10 @@ class VNPayPaymentStrategy(PaymentStrategy):
                 'message': f'Lỗi tạo thanh toán VNPay: {str(e)}'
             }
 
+    # chỉ ký url, ko gọi mạng nên chạy thẳng trong event loop
+    async def aprocess(self, payment, **kwargs):
+        return self.process(payment, **kwargs)
+
     def verify(self, payment, transaction_data):
         try:
             vnp = vnpay()
@@ -299,7 +464,66 @@ class VNPayPaymentStrategy(PaymentStrategy):
             print(str(e))
             return False
 
+    def query(self, payment):
+        txn_ref = payment.gateway_ref
+        transaction_date = txn_ref.split('_')[1]
+        request_id = uuid.uuid4().hex
+        create_date = timezone.localtime().strftime('%Y%m%d%H%M%S')
+        ip_addr = '127.0.0.1'
+        info = f"Tra cuu giao dich {txn_ref}"
+
+        # querydr ký chuỗi các trường nối bằng '|' theo đúng thứ tự
+        data = '|'.join([request_id, '2.1.0', 'querydr', self.tmn_code, txn_ref, transaction_date,
+                         create_date, ip_addr, info])
+        secure_hash = hmac.new(self.hash_secret.encode('utf-8'), data.encode('utf-8'), hashlib.sha512).hexdigest()
+
+        response = self.session.post(self.api_url, json={
+            'vnp_RequestId': request_id,
+            'vnp_Version': '2.1.0',
+            'vnp_Command': 'querydr',
+            'vnp_TmnCode': self.tmn_code,
+            'vnp_TxnRef': txn_ref,
+            'vnp_OrderInfo': info,
+            'vnp_TransactionDate': transaction_date,
+            'vnp_CreateDate': create_date,
+            'vnp_IpAddr': ip_addr,
+            'vnp_SecureHash': secure_hash,
+        }, timeout=GATEWAY_TIMEOUT)
+        response.raise_for_status()
+        res_json = response.json()
+
+        if res_json.get('vnp_ResponseCode') != '00':
+            raise ValueError(f"VNPay error: {res_json.get('vnp_Message')}")
+
+        transaction_status = res_json.get('vnp_TransactionStatus')
+        if transaction_status == '00':
+            query_status = QUERY_PAID
+        elif transaction_status == '01':
+            query_status = QUERY_PENDING
+        else:
+            query_status = QUERY_FAILED
+
+        return {
+            'status': query_status,
+            # vnpay tính tiền x100
+            'amount': int(res_json.get('vnp_Amount') or 0) // 100,
+            'transaction_id': res_json.get('vnp_TransactionNo'),
+            'message': res_json.get('vnp_Message')
+        }
+
+    def parse_callback(self, transaction_data):
+        txn_ref = transaction_data.get('vnp_TxnRef') or ''
+
+        return {
+            'event_id': (f"{txn_ref}:{transaction_data.get('vnp_TransactionNo')}"
+                         f":{transaction_data.get('vnp_PayDate')}"),
+            'payment_id': txn_ref.split('_')[0],
+            'is_success': transaction_data.get('vnp_ResponseCode') == '00',
+            'transaction_id': transaction_data.get('vnp_TransactionNo')
+        }
+
 
+# mỗi strategy chỉ tạo 1 lần cho cả process (strategy ko giữ trạng thái của từng giao dịch)
 class PaymentStrategyFactory:
     _strategies = {
         'CASH': CashPaymentStrategy,
@@ -307,9 +531,21 @@ class PaymentStrategyFactory:
         'STRIPE': StripePaymentStrategy,
         'VNPAY': VNPayPaymentStrategy,
     }
+    _instances = {}
+    _lock = threading.Lock()
 
     @classmethod
     def get_strategy(cls, method):
-        strategy_class = cls._strategies.get(method)
+        strategy = cls._instances.get(method)
+
+        if strategy is None:
+            strategy_class = cls._strategies.get(method)
+
+            if strategy_class is None:
+                raise ValueError(f"Phương thức thanh toán không hỗ trợ: {method}")
+
+            with cls._lock:
+                strategy = cls._instances.setdefault(method, strategy_class())
+
+        return strategy
 
-        return strategy_class()
@@ -0,0 +1,72 @@
+from celery import shared_task
+from django.utils import timezone
+from datetime import timedelta
+
+from apps.payment.models import PaymentEvent
+from apps.payment.revenue import RevenueRollupService
+from apps.payment.services import PaymentEventService, ReconciliationService
+
+# sự kiện chưa xử lý sau bấy nhiêu phút thì coi là kẹt
+REPROCESS_AFTER_MINUTES = 5
+
+REPROCESS_BATCH_SIZE = 500
+
+# hóa đơn tạo giao dịch online quá bấy nhiêu phút mà chưa thanh toán thì đem đối soát
+RECONCILE_AFTER_MINUTES = 30
+
+# cũ hơn thì thôi ko tra cứu nữa
+RECONCILE_WINDOW_DAYS = 7
+
+RECONCILE_CHUNK_SIZE = 200
+
+# số request tra cứu chạy song song tới cổng
+RECONCILE_WORKERS = 8
+
+
+# cập nhật hóa đơn theo sự kiện callback đã lưu, lỗi (db...) thì thử lại
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=5, retry_backoff_max=600, retry_jitter=True,
+             max_retries=6)
+def process_payment_event(self, event_id):
+    return PaymentEventService.process(event_id)
+
+
+# quét sự kiện đã lưu mà chưa xử lý được (broker lỗi, worker chết...) thì đẩy lại
+@shared_task
+def process_pending_payment_events():
+    ids = list(PaymentEvent.objects.filter(
+        processed_date__isnull=True,
+        created_date__lt=timezone.now() - timedelta(minutes=REPROCESS_AFTER_MINUTES)
+    ).order_by('created_date').values_list('id', flat=True)[:REPROCESS_BATCH_SIZE])
+
+    for event_id in ids:
+        PaymentEventService.enqueue(event_id)
+
+    return len(ids)
+
+
+# đối soát hóa đơn online chưa thanh toán với cổng thanh toán
+@shared_task
+def reconcile_payments():
+    now = timezone.now()
+
+    report = ReconciliationService.run(
+        checkout_before=now - timedelta(minutes=RECONCILE_AFTER_MINUTES),
+        checkout_after=now - timedelta(days=RECONCILE_WINDOW_DAYS),
+        chunk_size=RECONCILE_CHUNK_SIZE,
+        workers=RECONCILE_WORKERS
+    )
+
+    print(f"Đối soát #{report.id}: {report.checked} hóa đơn, {report.paid} cập nhật đã thanh toán, "
+          f"{report.mismatched} lệch tiền, {report.errors} lỗi")
+
+    return report.id
+
+
+# tính lại bảng doanh thu cộng dồn các tháng gần đây mỗi đêm, full=True (hoặc lịch sử chưa từng tính) thì tính toàn bộ
+@shared_task
+def rebuild_revenue_rollups(full=False):
+    rows = RevenueRollupService.rebuild(full)
+
+    print(f"Đã tính lại {rows} dòng doanh thu")
+
+    return rows
@@ -1,3 +1,183 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import threading
+from datetime import time, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.clinic.models import Appointment
+from apps.payment.models import Payment, ReconciliationRun
+from apps.payment.services import ReconciliationService
+from apps.payment.strategies import PaymentStrategyFactory
+from apps.users.models import User, UserRole, EmployeeRole
+
+MOMO_SETTINGS = {
+    'MOMO_PARTNER_CODE': 'MOMOTEST',
+    'MOMO_ACCESS_KEY': 'access',
+    'MOMO_SECRET_KEY': 'secret',
+    'MOMO_IPN_URL': 'http://localhost/ipn',
+}
+
+
+# cổng MoMo giả chạy local: trả kết quả tra cứu theo orderId, sai chữ ký thì báo lỗi
+class FakeMoMoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # orderId -> (resultCode, amount) hoặc None để trả lỗi 500
+    orders = {}
+    requests = []
+    omit_trans_id = False
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        FakeMoMoHandler.requests.append(body)
+
+        raw_signature = (f"accessKey={MOMO_SETTINGS['MOMO_ACCESS_KEY']}&orderId={body['orderId']}"
+                         f"&partnerCode={body['partnerCode']}&requestId={body['requestId']}")
+        signature = hmac.new(MOMO_SETTINGS['MOMO_SECRET_KEY'].encode(), raw_signature.encode(),
+                             hashlib.sha256).hexdigest()
+
+        order = self.orders.get(body['orderId'])
+
+        if self.path != '/v2/gateway/api/query' or order is None:
+            return self.reply(500, {'message': 'Internal error'})
+
+        if body['signature'] != signature:
+            return self.reply(200, {'resultCode': 11, 'message': 'Sai chữ ký'})
+
+        result_code, amount = order
+        data = {'orderId': body['orderId'], 'resultCode': result_code, 'amount': amount, 'message': 'ok'}
+        if not self.omit_trans_id:
+            data['transId'] = 1000 + len(FakeMoMoHandler.requests)
+
+        self.reply(200, data)
+
+    def reply(self, code, data):
+        content = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class ReconciliationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMoMoHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+        endpoint = f'http://127.0.0.1:{cls.server.server_port}/v2/gateway/api/create'
+        cls.settings_override = override_settings(MOMO_ENDPOINT=endpoint, **MOMO_SETTINGS)
+        cls.settings_override.enable()
+        # strategy là singleton nên tạo lại theo settings của test
+        PaymentStrategyFactory._instances.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.settings_override.disable()
+        PaymentStrategyFactory._instances.clear()
+        super().tearDownClass()
+
+    def setUp(self):
+        FakeMoMoHandler.orders = {}
+        FakeMoMoHandler.requests = []
+        FakeMoMoHandler.omit_trans_id = False
+
+        doctor = User.objects.create_user(email='doctor@clinic.com', password='123', first_name='A', last_name='B',
+                                          user_role=UserRole.EMPLOYEE, employee_role=EmployeeRole.DOCTOR)
+        self.patient = User.objects.create_user(email='patient@clinic.com', password='123', first_name='P',
+                                                last_name='Q', user_role=UserRole.PATIENT)
+        self.appointment = Appointment.objects.bulk_create([
+            Appointment(doctor=doctor, patient=self.patient, date=timezone.now().date(), start_time=time(9, 0),
+                        end_time=time(9, 30), status='COMPLETED')
+        ])[0]
+        self.now = timezone.now()
+
+    def create_payment(self, order_id, order, amount=150000, minutes_ago=60, **kwargs):
+        Payment.objects.bulk_create([Payment(patient=self.patient, appointment=self.appointment, amount=amount,
+                                             method='MOMO', gateway_ref=order_id, **kwargs)])
+        payment = Payment.objects.get(gateway_ref=order_id)
+        Payment.objects.filter(id=payment.id).update(checkout_date=self.now - timedelta(minutes=minutes_ago))
+
+        if order is not None:
+            FakeMoMoHandler.orders[order_id] = order
+
+        return payment
+
+    def run_reconciliation(self, chunk_size=3):
+        return ReconciliationService.run(checkout_before=self.now - timedelta(minutes=30),
+                                         checkout_after=self.now - timedelta(days=7),
+                                         chunk_size=chunk_size, workers=4)
+
+    def test_reconcile_statuses(self):
+        paid = [self.create_payment(f'{i}_paid', (0, 150000)) for i in range(5)]
+        pending = self.create_payment('pending', (1000, 150000))
+        failed = self.create_payment('failed', (1006, 150000))
+        mismatch = self.create_payment('mismatch', (0, 1000))
+        error = self.create_payment('error', None)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            report = self.run_reconciliation()
+
+        self.assertEqual((report.checked, report.paid, report.pending, report.failed, report.mismatched,
+                          report.errors), (9, 5, 1, 1, 1, 1))
+        self.assertIsNotNone(report.finished_date)
+        self.assertEqual(ReconciliationRun.objects.count(), 1)
+
+        for payment in paid:
+            payment.refresh_from_db()
+            self.assertTrue(payment.is_paid)
+            self.assertIsNotNone(payment.paid_date)
+            self.assertTrue(payment.transaction_id)
+
+        for payment in [pending, failed, mismatch, error]:
+            payment.refresh_from_db()
+            self.assertFalse(payment.is_paid)
+
+        details = {d['payment_id']: d['status'] for d in report.details}
+        self.assertEqual(details, {**{p.id: 'PAID' for p in paid}, mismatch.id: 'MISMATCH', error.id: 'ERROR'})
+
+        # bulk_update ko có signal nên thông báo phải gửi riêng
+        self.assertEqual(self.patient.notifications.filter(type='PAYMENT_SUCCESS').count(), 5)
+
+    def test_skip_out_of_window(self):
+        self.create_payment('recent', (0, 150000), minutes_ago=5)
+        self.create_payment('old', (0, 150000), minutes_ago=60 * 24 * 10)
+        self.create_payment('done', (0, 150000), is_paid=True)
+
+        report = self.run_reconciliation()
+
+        self.assertEqual(report.checked, 0)
+        self.assertEqual(FakeMoMoHandler.requests, [])
+
+    # hóa đơn tạo từ lâu nhưng mới thanh toán online vẫn được đối soát
+    def test_window_uses_checkout_date(self):
+        payment = self.create_payment('late', (0, 150000))
+        Payment.objects.filter(id=payment.id).update(created_date=self.now - timedelta(days=30))
+
+        self.assertEqual(self.run_reconciliation().paid, 1)
+
+    def test_missing_transaction_id(self):
+        payment = self.create_payment('no_trans', (0, 150000))
+        FakeMoMoHandler.omit_trans_id = True
+
+        self.run_reconciliation()
+
+        payment.refresh_from_db()
+        self.assertTrue(payment.is_paid)
+        self.assertIsNone(payment.transaction_id)
+
+    def test_rerun_is_noop(self):
+        self.create_payment('1_paid', (0, 150000))
+
+        self.assertEqual(self.run_reconciliation().paid, 1)
+        self.assertEqual(self.run_reconciliation().checked, 0)
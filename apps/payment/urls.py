@@ -1,9 +1,9 @@
 from django.urls import path, include
-from apps.payment.views import PaymentViewSet
+from apps.payment.views import PaymentViewSet, OnlinePaymentView
 from clinic_management.urls import router
 
 router.register('payments', PaymentViewSet, basename='payments')
 
 urlpatterns = [
-
+    path('payments/<int:pk>/online/', OnlinePaymentView.as_view(), name='payments-online'),
 ]
@@ -1,13 +1,18 @@
+from asgiref.sync import sync_to_async
 from django.utils import timezone
 from drf_yasg.utils import swagger_auto_schema, no_body
 from rest_framework import viewsets, status, generics
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from apps.payment import paginators
 from apps.payment.models import Payment, PaymentMethod
 from apps.payment.perms import IsOwnerPayment, IsOwnerOnlinePayment
+from apps.payment.services import PaymentEventService
 from apps.payment.serializers import PaymentSerializer, OnlinePaymentSerializer, PaymentStatusSerializer, \
     PaymentDetailSerializer
 from apps.payment.strategies import PaymentStrategyFactory
@@ -20,6 +25,8 @@ from apps.users.perms import IsNurse
 
 
 class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView):
+    pagination_class = paginators.PaymentPaginator
+
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
             return [IsOwnerPayment(), IsAuthenticated()]
@@ -27,7 +34,7 @@ class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
             return [IsNurse()]
         if self.action == 'callback':
             return [AllowAny()]
-        if self.action in ['check_status', 'online_payment']:
+        if self.action == 'check_status':
             return [IsOwnerOnlinePayment(), IsAuthenticated()]
         return [IsAuthenticated()]
 
@@ -100,56 +107,14 @@ class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
         else:
             return Response({"error": result['message']}, status=status.HTTP_400_BAD_REQUEST)
 
-    @swagger_auto_schema(
-        operation_description='Tạo yêu cầu thanh toán Online (Momo, VNPay, Stripe).\nTrả về URL để redirect user sang trang thanh toán.',
-        request_body=OnlinePaymentSerializer,
-        responses={
-            status.HTTP_200_OK: online_payment_response,
-            status.HTTP_400_BAD_REQUEST: "Lỗi tạo giao dịch"
-        }
-    )
-    @action(methods=['post'], detail=True, url_path='online')
-    def online_payment(self, request, pk):
-        serializer = OnlinePaymentSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-
-        payment = get_object_or_404(Payment, id=pk, active=True)
-        payment_method = serializer.validated_data['payment_method']
-
-        # Get client IP
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip_addr = x_forwarded_for.split(',')[0]
-        else:
-            ip_addr = request.META.get('REMOTE_ADDR')
-
-        try:
-            strategy = PaymentStrategyFactory.get_strategy(payment_method)
-
-            result = strategy.process(payment, ip_addr=ip_addr,
-                                      redirect_url=serializer.validated_data.get('redirect_url'))
-
-            if result['success']:
-                payment.method = payment_method
-                payment.save(update_fields=['method'])
-
-                return Response({
-                    "message": result['message'],
-                    "transaction_id": result['transaction_id'],
-                    "payment_data": result['data']
-                }, status=status.HTTP_200_OK)
-            else:
-                return Response({"error": result['message']}, status=status.HTTP_400_BAD_REQUEST)
-
-        except ValueError as e:
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-
     @swagger_auto_schema(
         manual_parameters=[param_callback_method],
-        operation_description='Webhook nhận kết quả thanh toán từ bên thứ 3 (Momo/VNPay/Stripe). \nAPI này được gọi tự động bởi cổng thanh toán, Client không gọi trực tiếp.',
+        operation_description='Webhook nhận kết quả thanh toán từ bên thứ 3 (Momo/VNPay/Stripe). \nAPI này được gọi tự động bởi cổng thanh toán, Client không gọi trực tiếp.\n'
+                              'Sự kiện được lưu lại rồi xử lý ngầm, cổng gửi lại cùng sự kiện thì chỉ xử lý 1 lần.',
         responses={
-            status.HTTP_200_OK: "Payment success",
-            status.HTTP_400_BAD_REQUEST: "Invalid signature / Payment failed"
+            status.HTTP_200_OK: "Đã nhận sự kiện (Payment success / Payment failed)",
+            status.HTTP_400_BAD_REQUEST: "Invalid signature",
+            status.HTTP_404_NOT_FOUND: "Không tìm thấy hóa đơn"
         }
     )
     @action(methods=['post'], detail=False, url_path='callback/(?P<method>[^/.]+)')
@@ -163,43 +128,35 @@ class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
                     'stripe_signature': request.headers.get('Stripe-Signature'),
                     'data': request.data
                 }
+                payload = request.data
             elif method == 'vnpay':
                 transaction_data = request.query_params.dict()
+                payload = transaction_data
             else:
                 transaction_data = request.data
+                payload = request.data
 
-            if method == 'momo':
-                id = transaction_data.get('orderId').split('_')[0]
-                is_success = transaction_data.get('resultCode') == 0
-                transaction_id = transaction_data.get('transId')
-            elif method == 'stripe':
-                data_object = transaction_data.get('data', {}).get('object', {})
-
-                id = data_object.get('metadata', {}).get('payment_id')
-                is_success = transaction_data.get('type') == 'payment_intent.succeeded'
-                transaction_id = data_object.get('id')
-            else:
-                id = transaction_data.get('vnp_TxnRef')
-                is_success = transaction_data.get('vnp_ResponseCode') == '00'
-                transaction_id = transaction_data.get('vnp_TransactionNo')
+            callback = strategy.parse_callback(transaction_data)
 
-            if not id:
+            if not callback['payment_id']:
                 return Response({"error": "Không tìm thấy Payment ID"}, status=status.HTTP_400_BAD_REQUEST)
 
-            payment = get_object_or_404(Payment, id=id, active=True)
-
-            if not strategy.verify(payment, transaction_data):
+            # kiểm chữ ký trước khi lưu (strategy ko dùng tới payment khi verify)
+            if not strategy.verify(None, transaction_data):
                 return Response({"error": "Invalid signature"}, status=status.HTTP_400_BAD_REQUEST)
 
-            if is_success:
-                payment.is_paid = True
-                payment.paid_date = timezone.now()
-                payment.transaction_id = transaction_id
-                payment.save()
+            payment_id = Payment.objects.filter(id=callback['payment_id'], active=True) \
+                .values_list('id', flat=True).first()
+            if not payment_id:
+                return Response({"error": "Không tìm thấy hóa đơn"}, status=status.HTTP_404_NOT_FOUND)
+
+            # trả 200 ngay kể cả sự kiện trùng để cổng ko gửi lại, cập nhật hóa đơn chạy ngầm
+            PaymentEventService.record(method.upper(), payment_id, callback, payload)
 
+            if callback['is_success']:
                 return Response({"message": "Payment success"}, status=status.HTTP_200_OK)
             else:
-                return Response({"error": "Payment failed"}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({"message": "Payment failed"}, status=status.HTTP_200_OK)
 
         except ValueError as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -214,4 +171,90 @@ class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
     def check_status(self, request, pk):
         payment = get_object_or_404(Payment, id=pk, active=True)
 
-        return Response(PaymentStatusSerializer(payment, data=request.data).data, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(PaymentStatusSerializer(payment, data=request.data).data, status=status.HTTP_200_OK)
+
+
+# DRF chưa hỗ trợ view async: xác thực/phân quyền/throttle vẫn dùng của DRF nhưng chạy ở thread,
+# còn handler (post...) là coroutine nên lúc chờ mạng ko giữ thread nào
+class AsyncAPIView(APIView):
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            handler = getattr(self, request.method.lower(), None)
+            if handler is None:
+                handler = sync_to_async(self.http_method_not_allowed)
+
+            response = await handler(request, *args, **kwargs)
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def options(self, request, *args, **kwargs):
+        return await sync_to_async(super().options)(request, *args, **kwargs)
+
+
+# POST /payments/{id}/online/ chạy async để lúc chờ MoMo/Stripe ko chiếm worker
+class OnlinePaymentView(AsyncAPIView):
+    permission_classes = [IsAuthenticated, IsOwnerOnlinePayment]
+
+    @swagger_auto_schema(
+        operation_description='Tạo yêu cầu thanh toán Online (Momo, VNPay, Stripe).\nTrả về URL để redirect user sang trang thanh toán.',
+        request_body=OnlinePaymentSerializer,
+        responses={
+            status.HTTP_200_OK: online_payment_response,
+            status.HTTP_400_BAD_REQUEST: "Lỗi tạo giao dịch"
+        }
+    )
+    async def post(self, request, pk):
+        serializer = OnlinePaymentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        payment = await Payment.objects.select_related('patient').filter(id=pk, active=True).afirst()
+        if not payment:
+            raise NotFound()
+
+        self.check_object_permissions(request, payment)
+
+        payment_method = serializer.validated_data['payment_method']
+
+        # Get client IP
+        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        if x_forwarded_for:
+            ip_addr = x_forwarded_for.split(',')[0]
+        else:
+            ip_addr = request.META.get('REMOTE_ADDR')
+
+        try:
+            strategy = PaymentStrategyFactory.get_strategy(payment_method)
+
+            result = await strategy.aprocess(payment, ip_addr=ip_addr,
+                                             redirect_url=serializer.validated_data.get('return_url'))
+
+            if result['success']:
+                payment.method = payment_method
+                payment.gateway_ref = result['gateway_ref']
+                payment.checkout_date = timezone.now()
+                await payment.asave(update_fields=['method', 'gateway_ref', 'checkout_date', 'updated_date'])
+
+                return Response({
+                    "message": result['message'],
+                    "transaction_id": result['transaction_id'],
+                    "payment_data": result['data']
+                }, status=status.HTTP_200_OK)
+            else:
+                return Response({"error": result['message']}, status=status.HTTP_400_BAD_REQUEST)
+
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
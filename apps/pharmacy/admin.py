@@ -241,7 +241,7 @@ class ImportReceiptAdmin(admin.ModelAdmin):
             # Update stock
             for detail in receipt.details.all():
                 detail.medicine.current_stock += detail.quantity
-                detail.medicine.save()
+                detail.medicine.save(update_fields=['current_stock', 'updated_date'])
             receipt.status = 'COMPLETED'
             receipt.save()
             updated += 1
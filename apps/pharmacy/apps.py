@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class PharmacyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'apps.pharmacy'
\ No newline at end of file
+    name = 'apps.pharmacy'
+
+    def ready(self):
+        import apps.pharmacy.signals
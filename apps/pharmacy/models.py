@@ -1,5 +1,6 @@
 from cloudinary.models import CloudinaryField
 from django.db import models
+from model_utils import FieldTracker
 
 
 class MedicineUnit(models.TextChoices):
@@ -49,6 +50,10 @@ class Medicine(BaseModel):
     image = CloudinaryField(null=True, blank=True)
     cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    # chỉ đánh lại index tìm kiếm khi tên/mô tả đổi
+    tracker = FieldTracker(fields=['name', 'description'])
+
+
 class PrescriptionDetail(BaseModel):
     prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE, related_name='items')
     medicine = models.ForeignKey(Medicine, on_delete=models.PROTECT, related_name='details')
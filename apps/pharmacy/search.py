@@ -0,0 +1,3 @@
+from apps.clinic.search import SearchIndex
+
+medicine_index = SearchIndex('medicine', {'name': 3, 'description': 1})
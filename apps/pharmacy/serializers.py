@@ -6,6 +6,7 @@ from apps.clinic.models import AppointmentStatus
 from apps.payment.signals import dispense_completed
 from apps.pharmacy.models import PrescriptionDetail, Prescription, Medicine, DispenseLog, ImportReceiptStatus, \
     ImportReceipt, ImportDetail
+from apps.pharmacy.search import medicine_index
 
 
 class PrescriptionDetailsSerializer(serializers.ModelSerializer):
@@ -83,6 +84,16 @@ class MedicineSerializer(serializers.ModelSerializer):
         model = Medicine
         fields = ['id', 'name', 'category']
 
+    # đang tìm kiếm thì trả thêm đoạn khớp được đánh dấu
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+
+        terms = self.context.get('search_terms')
+        if terms:
+            data['highlight'] = medicine_index.highlight(instance, terms)
+
+        return data
+
 
 class MedicineDetailSerializer(MedicineSerializer):
     class Meta:
@@ -117,7 +128,7 @@ class DispenseSerializer(serializers.Serializer):
 
         for item in items:
             item.medicine.current_stock -= item.quantity
-            item.medicine.save()
+            item.medicine.save(update_fields=['current_stock', 'updated_date'])
 
             logs.append(DispenseLog(
                 pharmacist=user,
@@ -243,7 +254,7 @@ class ChangeReceiptSerializer(serializers.Serializer):
 
                 medicine.current_stock += detail.quantity
 
-                medicine.save()
+                medicine.save(update_fields=['current_stock', 'updated_date'])
 
             instance.status = ImportReceiptStatus.COMPLETED
 
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.pharmacy.models import Medicine
+from apps.pharmacy.search import medicine_index
+
+
+# cập nhật chỉ mục tìm kiếm thuốc
+@receiver(post_save, sender=Medicine)
+def index_medicine(sender, instance, created, **kwargs):
+    if created or medicine_index.changed(instance):
+        medicine_index.refresh(instance)
+
+
+@receiver(post_delete, sender=Medicine)
+def unindex_medicine(sender, instance, **kwargs):
+    medicine_index.remove(instance)
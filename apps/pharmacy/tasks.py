@@ -27,7 +27,7 @@ def auto_commit_daily_report():
                 pass
             else:
                 med.current_stock = detail.actual_quantity
-                med.save()
+                med.save(update_fields=['current_stock', 'updated_date'])
 
         return f"Đã chốt sổ thành công ngày {today}"
 
@@ -1,6 +1,6 @@
 from drf_yasg import openapi
 
-param_q = openapi.Parameter('q', openapi.IN_QUERY, description="Tìm kiếm theo tên thuốc", type=openapi.TYPE_STRING)
+param_q = openapi.Parameter('q', openapi.IN_QUERY, description="Tìm kiếm theo tên, mô tả thuốc (ko phân biệt dấu)", type=openapi.TYPE_STRING)
 param_cate_id = openapi.Parameter('category_id', openapi.IN_QUERY, description="Lọc theo ID danh mục",
                                   type=openapi.TYPE_INTEGER)
 param_date = openapi.Parameter('date', openapi.IN_QUERY, description="Lọc theo ngày (YYYY-MM-DD)",
@@ -7,6 +7,7 @@ from apps.pharmacy.models import Medicine, Prescription, ImportReceipt
 from apps.pharmacy.serializers import MedicineSerializer, MedicineDetailSerializer, PrescriptionSerializer, \
     DispenseSerializer, ImportReceiptSerializer, ImportReceiptDetailSerializer, ChangeReceiptSerializer
 from apps.pharmacy import paginators
+from apps.pharmacy.search import medicine_index
 from apps.pharmacy.ultis import param_q, param_cate_id, detail_response_schema, param_date, param_import_status
 from apps.users.perms import IsDoctorOrPharmacist, IsPharmacist
 
@@ -25,8 +26,8 @@ class MedicineView(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
         query = self.queryset
 
         q = self.request.query_params.get('q')
-        if q:
-            query = query.filter(name__icontains=q)
+        if q and self.action == 'list':
+            query = medicine_index.search(query, q)
 
         cate_id = self.request.query_params.get('category_id')
         if cate_id:
@@ -34,6 +35,15 @@ class MedicineView(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
 
         return query
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+
+        q = self.request.query_params.get('q')
+        if q and self.action == 'list':
+            context['search_terms'] = medicine_index.terms(q)
+
+        return context
+
     @swagger_auto_schema(
         manual_parameters=[param_q, param_cate_id],
         operation_description="Lấy danh sách thuốc (Hỗ trợ tìm kiếm và lọc theo danh mục)"
@@ -138,6 +138,18 @@ class DoctorInfoSerializer(BasicInfoSerializer):
         fields = BasicInfoSerializer.Meta.fields + ['public_profile']
 
 
+# danh sach bac si kem lich trong cua ngay can dat (lay tu context)
+class DoctorAvailabilitySerializer(DoctorInfoSerializer):
+    availability = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DoctorInfoSerializer.Meta.model
+        fields = DoctorInfoSerializer.Meta.fields + ['availability']
+
+    def get_availability(self, instance):
+        return self.context.get('availability', {}).get(instance.id)
+
+
 # thong tin trong lich hen
 class PatientInfoSerializer(BasicInfoSerializer):
     public_profile = PatientProfilePublicSerializer(source='patient_profile')
@@ -0,0 +1,79 @@
+from django.core.cache import cache
+from django.db.models import Count, Q, F
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+from apps.clinic.models import Appointment, AppointmentStatus
+from apps.users.models import User, UserRole, Gender
+
+DEMOGRAPHICS_TIMEOUT = 60 * 60
+
+# (nhãn, tuổi từ, tuổi đến), None là ko giới hạn
+AGE_GROUPS = [
+    ('0-17', None, 17),
+    ('18-30', 18, 30),
+    ('31-45', 31, 45),
+    ('46-60', 46, 60),
+    ('61-75', 61, 75),
+    ('76+', 76, None),
+]
+
+
+def age_filter(start, end):
+    q = Q()
+    if start is not None:
+        q &= Q(age__gte=start)
+    if end is not None:
+        q &= Q(age__lte=end)
+    return q
+
+
+# thống kê bệnh nhân (giới tính, nhóm tuổi, chuyên khoa đã khám) cho trang admin + api BI
+# tính xong lưu cache, có bệnh nhân mới đăng ký thì xóa cache
+class DemographicsService:
+    KEY = 'patient_demographics'
+
+    @staticmethod
+    def invalidate():
+        cache.delete(DemographicsService.KEY)
+
+    @staticmethod
+    def get():
+        stats = cache.get(DemographicsService.KEY)
+
+        if stats is None:
+            stats = DemographicsService.compute()
+            cache.set(DemographicsService.KEY, stats, timeout=DEMOGRAPHICS_TIMEOUT)
+
+        return stats
+
+    # giới tính + nhóm tuổi đếm chung 1 query, tuổi tính theo năm sinh như trước
+    @staticmethod
+    def compute():
+        now = timezone.now()
+
+        counts = User.objects.filter(user_role=UserRole.PATIENT).annotate(
+            age=now.year - ExtractYear('date_of_birth')
+        ).aggregate(
+            total=Count('id'),
+            **{f'gender_{value}': Count('id', filter=Q(gender=value)) for value, _ in Gender.choices},
+            **{f'age_{i}': Count('id', filter=age_filter(start, end))
+               for i, (_, start, end) in enumerate(AGE_GROUPS)}
+        )
+
+        # dùng chuyên khoa của bác sĩ để xác định
+        specialty_stats = Appointment.objects.filter(
+            status=AppointmentStatus.COMPLETED,
+            doctor__doctor_profile__specialty__isnull=False
+        ).values(specialty_name=F('doctor__doctor_profile__specialty__name')) \
+            .annotate(count=Count('id')).order_by('-count')
+
+        return {
+            'total_patients': counts['total'],
+            'age_stats': [{'age_group': label, 'count': counts[f'age_{i}']}
+                          for i, (label, _, _) in enumerate(AGE_GROUPS)],
+            'gender_stats': [{'gender': value, 'gender_display': label, 'count': counts[f'gender_{value}']}
+                             for value, label in Gender.choices],
+            'specialty_stats': list(specialty_stats),
+            'generated_date': now,
+        }
@@ -1,8 +1,10 @@
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 from apps.users.models import User, UserRole, PatientProfile, DoctorProfile, EmployeeRole, NurseProfile, \
     PharmacistProfile
+from apps.users.services import DemographicsService
 
 
 @receiver(post_save, sender=User)
@@ -10,6 +12,8 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         if instance.user_role == UserRole.PATIENT:
             PatientProfile.objects.create(user=instance)
+            # có bệnh nhân mới thì thống kê cũ ko còn đúng
+            transaction.on_commit(DemographicsService.invalidate)
 
         elif instance.user_role == UserRole.EMPLOYEE:
             if instance.employee_role == EmployeeRole.DOCTOR:
@@ -1,3 +1,58 @@
-from django.test import TestCase
+from datetime import date, time
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.clinic.models import Appointment, Specialty
+from apps.users.models import User, UserRole, EmployeeRole, Gender
+from apps.users.services import DemographicsService
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DemographicsServiceTest(TestCase):
+    def setUp(self):
+        DemographicsService.invalidate()
+        year = timezone.now().year
+
+        patients = [(Gender.MALE, 10), (Gender.MALE, 25), (Gender.FEMALE, 40), (Gender.FEMALE, 80),
+                    (Gender.OTHER, 60), (None, None)]
+        self.patients = [self.create_patient(gender, date(year - age, 1, 1) if age is not None else None)
+                         for gender, age in patients]
+
+        specialty = Specialty.objects.create(name='Nội')
+        doctor = User.objects.create_user(email='doctor@clinic.com', password='123', first_name='A', last_name='B',
+                                          user_role=UserRole.EMPLOYEE, employee_role=EmployeeRole.DOCTOR)
+        doctor.doctor_profile.specialty = specialty
+        doctor.doctor_profile.save()
+
+        Appointment.objects.bulk_create([
+            Appointment(doctor=doctor, patient=self.patients[0], date=timezone.now().date(), start_time=time(9, 0),
+                        end_time=time(9, 30), status=status) for status in ['COMPLETED', 'COMPLETED', 'PENDING']
+        ])
+
+    def create_patient(self, gender, date_of_birth):
+        return User.objects.create_user(email=f'patient{User.objects.count()}@clinic.com', password='123',
+                                        first_name='P', last_name='Q', user_role=UserRole.PATIENT,
+                                        gender=gender, date_of_birth=date_of_birth)
+
+    def test_compute(self):
+        with self.assertNumQueries(2):
+            stats = DemographicsService.compute()
+
+        self.assertEqual(stats['total_patients'], 6)
+        self.assertEqual({s['age_group']: s['count'] for s in stats['age_stats']},
+                         {'0-17': 1, '18-30': 1, '31-45': 1, '46-60': 1, '61-75': 0, '76+': 1})
+        self.assertEqual({s['gender']: s['count'] for s in stats['gender_stats']},
+                         {Gender.MALE: 2, Gender.FEMALE: 2, Gender.OTHER: 1})
+        self.assertEqual(stats['specialty_stats'], [{'specialty_name': 'Nội', 'count': 2}])
+
+    def test_cache_invalidated_on_register(self):
+        self.assertEqual(DemographicsService.get()['total_patients'], 6)
+
+        with self.assertNumQueries(0):
+            DemographicsService.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_patient(Gender.MALE, None)
+
+        self.assertEqual(DemographicsService.get()['total_patients'], 7)
@@ -26,3 +26,72 @@ google_login_response = openapi.Schema(
         'scope': openapi.Schema(type=openapi.TYPE_STRING, description='Phạm vi truy cập'),
     }
 )
+
+param_from = openapi.Parameter('from', openapi.IN_QUERY, description="Từ ngày (YYYY-MM-DD), mặc định hôm nay",
+                               type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE)
+
+param_to = openapi.Parameter('to', openapi.IN_QUERY,
+                             description="Đến ngày (YYYY-MM-DD), mặc định ngày cuối cùng được phép đặt lịch",
+                             type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE)
+
+param_duration = openapi.Parameter('duration', openapi.IN_QUERY,
+                                   description="Thời lượng khám (phút) để chia slot, mặc định 30",
+                                   type=openapi.TYPE_INTEGER)
+
+param_available_on = openapi.Parameter('available_on', openapi.IN_QUERY,
+                                       description="Ngày muốn đặt lịch (YYYY-MM-DD), có thì trả kèm lịch trống "
+                                                   "của từng bác sĩ",
+                                       type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE)
+
+time_range_schema = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'start': openapi.Schema(type=openapi.TYPE_STRING, example='08:00'),
+        'end': openapi.Schema(type=openapi.TYPE_STRING, example='08:30'),
+    }
+)
+
+availability_response = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'doctor': openapi.Schema(type=openapi.TYPE_INTEGER, description='Id bác sĩ'),
+        'duration': openapi.Schema(type=openapi.TYPE_INTEGER, description='Thời lượng slot (phút)'),
+        'days': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'date': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+                'free_intervals': openapi.Schema(type=openapi.TYPE_ARRAY, items=time_range_schema,
+                                                 description='Các khoảng giờ trống'),
+                'slots': openapi.Schema(type=openapi.TYPE_ARRAY, items=time_range_schema,
+                                        description='Các slot có thể đặt'),
+            }
+        )),
+    }
+)
+
+
+def count_item(key):
+    return openapi.Schema(type=openapi.TYPE_OBJECT, properties={
+        key: openapi.Schema(type=openapi.TYPE_STRING),
+        'count': openapi.Schema(type=openapi.TYPE_INTEGER),
+    })
+
+
+demographics_response = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'total_patients': openapi.Schema(type=openapi.TYPE_INTEGER),
+        'age_stats': openapi.Schema(type=openapi.TYPE_ARRAY, items=count_item('age_group')),
+        'gender_stats': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'gender': openapi.Schema(type=openapi.TYPE_STRING, example='Male'),
+                'gender_display': openapi.Schema(type=openapi.TYPE_STRING, example='Nam'),
+                'count': openapi.Schema(type=openapi.TYPE_INTEGER),
+            }
+        )),
+        'specialty_stats': openapi.Schema(type=openapi.TYPE_ARRAY, items=count_item('specialty_name')),
+        'generated_date': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                                         description='Thời điểm tính (số liệu được cache tối đa 1 giờ)'),
+    }
+)
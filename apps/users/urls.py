@@ -2,7 +2,7 @@ from django.urls import path
 
 from clinic_management.urls import router
 from .views import UserView, GoogleLoginView, ResetPasswordRequestView, VerifyOTPView, \
-    ResetPasswordView, DoctorBookingView
+    ResetPasswordView, DoctorBookingView, PatientDemographicsView
 
 router.register('users', UserView, basename='users')
 router.register('doctors', DoctorBookingView, basename='doctors')
@@ -12,4 +12,5 @@ urlpatterns = [
     path('auth/password-reset/request/', ResetPasswordRequestView.as_view(), name='request'),
     path('auth/password-reset/verify/', VerifyOTPView.as_view(), name='verify'),
     path('auth/password-reset/confirm/', ResetPasswordView.as_view(), name='confirm'),
+    path('stats/patient-demographics/', PatientDemographicsView.as_view(), name='patient-demographics'),
 ]
@@ -1,19 +1,25 @@
 from django.conf import settings
 from django.core.cache import cache
 from django.core.mail import send_mail
+from django.utils import timezone
 from django.utils.crypto import get_random_string
+from django.utils.dateparse import parse_date
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import viewsets, generics, status
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from apps.clinic.services import AvailabilityService
+from apps.clinic.utils import get_max_booking_date
 from .models import User, PatientProfile, UserRole, EmployeeRole
+from .services import DemographicsService
 from .serializers import UserSerializer, GoogleAuthSerializer, UserDetailSerializer, UserUpdateSerializer, \
     PatientProfileSerializer, ChangePasswordSerializer, ResetPasswordRequestSerializer, VerifyOTPSerializer, \
-    ResetPasswordSerializer, UpdateFCMSerializer, DoctorInfoSerializer
-from .ultis import message_response, google_login_response, verify_otp_response
+    ResetPasswordSerializer, UpdateFCMSerializer, DoctorInfoSerializer, DoctorAvailabilitySerializer
+from .ultis import message_response, google_login_response, verify_otp_response, param_from, param_to, \
+    param_duration, param_available_on, availability_response, demographics_response
 
 
 class UserView(viewsets.ViewSet, generics.CreateAPIView):
@@ -280,8 +286,85 @@ class DoctorBookingView(viewsets.ViewSet, generics.ListAPIView):
     ).order_by('-doctor_profile__rating')
 
     @swagger_auto_schema(
-        operation_description="Lấy danh sách bác sĩ (Sắp xếp theo đánh giá từ cao xuống thấp)",
-        responses={200: DoctorInfoSerializer(many=True)}
+        manual_parameters=[param_available_on, param_duration],
+        operation_description="Lấy danh sách bác sĩ (Sắp xếp theo đánh giá từ cao xuống thấp). "
+                              "Truyền available_on để lấy kèm slot trống gần nhất và số phút trống trong ngày",
+        responses={200: DoctorAvailabilitySerializer(many=True)}
     )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        if not request.query_params.get('available_on'):
+            return super().list(request, *args, **kwargs)
+
+        try:
+            date = parse_date(request.query_params.get('available_on'))
+            duration = int(request.query_params.get('duration', 30))
+        except ValueError:
+            return Response({"error": "Tham số không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not date or duration <= 0:
+            return Response({"error": "Tham số không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if date < timezone.now().date():
+            return Response({"error": "Không thể xem lịch trống trong quá khứ."}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        doctors = page if page is not None else list(queryset)
+
+        # tính lịch trống cho cả trang 1 lần thay vì từng bác sĩ
+        availability = AvailabilityService.get_summary([d.id for d in doctors], date, duration)
+        context = self.get_serializer_context()
+        context['availability'] = availability
+        serializer = DoctorAvailabilitySerializer(doctors, many=True, context=context)
+
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        manual_parameters=[param_from, param_to, param_duration],
+        operation_description="Xem khung giờ trống của bác sĩ để chọn giờ đặt lịch",
+        responses={200: availability_response}
+    )
+    @action(methods=['get'], detail=True, url_path='availability')
+    def get_availability(self, request, pk):
+        doctor = self.get_object()
+
+        today = timezone.now().date()
+        max_date = get_max_booking_date()
+
+        try:
+            from_date = parse_date(request.query_params.get('from', '')) or today
+            to_date = parse_date(request.query_params.get('to', '')) or max_date
+            duration = int(request.query_params.get('duration', 30))
+        except ValueError:
+            return Response({"error": "Tham số không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if duration <= 0:
+            return Response({"error": "Thời lượng phải lớn hơn 0."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # chỉ xem trong khoảng được phép đặt lịch
+        from_date = max(from_date, today)
+        to_date = min(to_date, max_date)
+
+        days = AvailabilityService.get_availability(doctor.id, from_date, to_date, duration) \
+            if from_date <= to_date else []
+
+        return Response({
+            "doctor": doctor.id,
+            "duration": duration,
+            "days": days
+        }, status=status.HTTP_200_OK)
+
+
+# cho các công cụ BI lấy số liệu giống trang thống kê bệnh nhân ở admin
+class PatientDemographicsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_description="Thống kê bệnh nhân theo giới tính, nhóm tuổi, chuyên khoa (chỉ admin)",
+        responses={200: demographics_response}
+    )
+    def get(self, request):
+        return Response(DemographicsService.get(), status=status.HTTP_200_OK)
@@ -1,14 +1,14 @@
 from django.contrib import admin
-from django.db.models.functions import ExtractYear, TruncMonth
 from django.urls import path
 from django.template.response import TemplateResponse
 from django.db.models import Count, Sum, Avg, Max, Min, Q, F
 from django.utils import timezone
 from datetime import timedelta
-from apps.clinic.models import Appointment, AppointmentStatus, Service
+from apps.clinic.models import Service, Specialty
+from apps.clinic.stats import ServiceStats
 from apps.medical.models import MedicalRecord, TestOrder, TestStatus
-from apps.payment.models import Payment, PaymentMethod
-from apps.users.models import User, UserRole, Gender, PatientProfile
+from apps.payment.models import PaymentMethod, RevenueRollup, RevenuePeriod, RevenueSource
+from apps.users.services import DemographicsService
 
 
 class MyClinicAdminSite(admin.AdminSite):
@@ -24,77 +24,15 @@ class MyClinicAdminSite(admin.AdminSite):
         return urls + super().get_urls()
 
     def patient_stats_view(self, request):
-        total_patients = User.objects.filter(user_role=UserRole.PATIENT).count()
-
-        current_year = timezone.now().year
-
-        patients = User.objects.filter(user_role=UserRole.PATIENT, date_of_birth__isnull=False).annotate(
-            age=current_year - ExtractYear('date_of_birth'))
-
-        age_groups_data = patients.aggregate(
-            group_0_17=Count('id', filter=Q(age__lte=17)),
-            group_18_30=Count('id', filter=Q(age__gte=18, age__lte=30)),
-            group_31_45=Count('id', filter=Q(age__gte=31, age__lte=45)),
-            group_46_60=Count('id', filter=Q(age__gte=46, age__lte=60)),
-            group_61_75=Count('id', filter=Q(age__gte=61, age__lte=75)),
-            group_76_plus=Count('id', filter=Q(age__gte=76))
-        )
-
-        labels = {
-            'group_0_17': '0-17',
-            'group_18_30': '18-30',
-            'group_31_45': '31-45',
-            'group_46_60': '46-60',
-            'group_61_75': '61-75',
-            'group_76_plus': '76+'
-        }
-
-        age_stats = []
-
-        for key, count in age_groups_data.items():
-            age_stats.append({
-                'age_group': labels.get(key, key),
-                'count': count
-            })
-
-        gender_stats = []
-
-        for gender in Gender.choices:
-            count = User.objects.filter(user_role=UserRole.PATIENT, gender=gender[0]).count()
-            gender_stats.append({
-                'gender': gender[0],
-                'gender_display': gender[1],
-                'count': count
-            })
-
-        # dùng chuyên khoa của bác sĩ để xác định
-        specialty_stats = Appointment.objects.filter(
-            status=AppointmentStatus.COMPLETED,
-            doctor__doctor_profile__specialty__isnull=False
-        ).values(specialty_name=F('doctor__doctor_profile__specialty__name')) \
-            .annotate(count=Count('id')).order_by('-count')
-
-        stats = {
-            'total_patients': total_patients,
-            'age_stats': age_stats,
-            'gender_stats': gender_stats,
-            'specialty_stats': specialty_stats,
-        }
+        stats = DemographicsService.get()
 
         return TemplateResponse(request, 'admin/patient_stats.html', stats)
 
     def service_stats_view(self, request):
-        total_services = Service.objects.filter(active=True).count()
-
-        services_stats = Service.objects.filter(active=True).annotate(
-            appointment_use=Count('appointments', filter=Q(appointments__status=AppointmentStatus.COMPLETED)),
-            test_order_use=Count('test_orders_service', filter=Q(test_orders_service__status=TestStatus.COMPLETED))
-        ).annotate(
-            total_use=F('appointment_use') + F('test_order_use')
-        ).order_by('-total_use')
+        services_stats = list(ServiceStats.usage().select_related('specialty').order_by('-total_use'))
 
-        total_use = services_stats.aggregate(total=Sum('total_use'))
-        total_use = total_use['total'] or 0
+        total_services = len(services_stats)
+        total_use = sum(s.total_use for s in services_stats)
 
         specialties = {}
 
@@ -150,26 +88,22 @@ class MyClinicAdminSite(admin.AdminSite):
 
         return TemplateResponse(request, 'admin/disease_stats.html', context)
 
+    # chỉ đọc bảng doanh thu cộng dồn (RevenueRollup theo tháng), ko quét Payment
     def revenue_stats_view(self, request):
         current_year = timezone.now().year
 
-        totals = Payment.objects.filter(is_paid=True).aggregate(
+        rollups = RevenueRollup.objects.filter(period=RevenuePeriod.MONTH)
+
+        totals = rollups.aggregate(
             total=Sum('amount'),
-            from_appt=Sum('amount', filter=Q(appointment__isnull=False)),
-            from_med=Sum('amount', filter=Q(prescription__isnull=False))
+            from_appt=Sum('amount', filter=Q(source=RevenueSource.APPOINTMENT)),
+            from_med=Sum('amount', filter=Q(source=RevenueSource.PRESCRIPTION))
         )
 
-        monthly_stats = Payment.objects.filter(
-            is_paid=True,
-            paid_date__year=current_year
-        ).annotate(
-            month=TruncMonth('paid_date')
-        ).values('month').annotate(
-            revenue=Sum('amount')
-        ).order_by('month')
+        monthly_stats = rollups.filter(date__year=current_year).values('date').annotate(revenue=Sum('amount'))
 
         monthly_data = []
-        temp_map = {item['month'].month: item['revenue'] for item in monthly_stats}
+        temp_map = {item['date'].month: item['revenue'] for item in monthly_stats}
 
         for i in range(1, 13):
             monthly_data.append({
@@ -177,22 +111,26 @@ class MyClinicAdminSite(admin.AdminSite):
                 'revenue': temp_map.get(i, 0)
             })
 
-        services_data = Service.objects.filter(active=True).annotate(
-            appt_use=Count('appointments', filter=Q(appointments__status=AppointmentStatus.COMPLETED)),
-            test_use=Count('test_orders_service', filter=Q(test_orders_service__status=TestStatus.COMPLETED))
-        ).annotate(
-            total_use=F('appt_use') + F('test_use')
-        ).annotate(
-            revenue=F('total_use') * F('price')
-        ).order_by('-revenue')[:10]
+        top_services = list(rollups.exclude(service_id=0).values('service_id').annotate(
+            revenue=Sum('amount'),
+            total_use=Sum('count')
+        ).order_by('-revenue')[:10])
 
-        specialty_data = Appointment.objects.filter(
-            status=AppointmentStatus.COMPLETED
-        ).values(
-            name=F('doctor__doctor_profile__specialty__name')
-        ).annotate(
-            revenue=Sum('total_price')
-        ).order_by('-revenue')
+        service_names = dict(Service.objects.filter(id__in=[s['service_id'] for s in top_services])
+                             .values_list('id', 'name'))
+
+        services_data = [{'name': service_names.get(s['service_id'], ''), **s} for s in top_services]
+
+        # doanh thu khám/dịch vụ theo chuyên khoa (specialty_id = 0 là chưa phân loại)
+        specialty_stats = list(rollups.filter(source=RevenueSource.APPOINTMENT).values('specialty_id').annotate(
+            revenue=Sum('amount')
+        ).order_by('-revenue'))
+
+        specialty_names = dict(Specialty.objects.filter(id__in=[s['specialty_id'] for s in specialty_stats])
+                               .values_list('id', 'name'))
+
+        specialty_data = [{'name': specialty_names.get(s['specialty_id']), 'revenue': s['revenue']}
+                          for s in specialty_stats]
 
         context = {
             'current_year': current_year,
@@ -162,12 +162,32 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'apps.clinic.tasks.auto_clone_schedule',
         'schedule': crontab(day_of_week=1, hour=0, minute=0)
     },
-    'send-appointment-reminders-every-hour': {
+    'send-appointment-reminders-every-5-minutes': {
         'task': 'apps.notifications.tasks.send_appointment_reminders',
-        'schedule': crontab(minute=0),  # Mỗi giờ
+        'schedule': crontab(minute='*/5'),
+    },
+    'redeliver-notifications-every-5-minutes': {
+        'task': 'apps.notifications.tasks.redeliver_notifications',
+        'schedule': crontab(minute='*/5'),
+    },
+    'process-pending-payment-events-every-5-minutes': {
+        'task': 'apps.payment.tasks.process_pending_payment_events',
+        'schedule': crontab(minute='*/5'),
+    },
+    'reconcile-payments-hourly': {
+        'task': 'apps.payment.tasks.reconcile_payments',
+        'schedule': crontab(minute=15),
+    },
+    'rebuild-revenue-rollups-daily': {
+        'task': 'apps.payment.tasks.rebuild_revenue_rollups',
+        'schedule': crontab(hour=1, minute=30),
+    },
+    'reconcile-unread-counts-hourly': {
+        'task': 'apps.notifications.tasks.reconcile_unread_counts',
+        'schedule': crontab(minute=30),
     },
     'cleanup-old-notifications-daily': {
-        'task': 'apps.notifications.tasks.cleanup_old_notifications',
+        'task': 'apps.notifications.tasks.cleanup_notifications',
         'schedule': crontab(hour=2, minute=0),  # 2h sáng mỗi ngày
     },
 }
@@ -185,6 +205,19 @@ DEFAULT_FROM_EMAIL = 'ClinicApp <noreply@clinicapp.com>'
 OTP_EXPIRY_MINUTES = 10
 OTP_MAX_ATTEMPTS = 3
 
+# số ngày giữ thông báo đã đọc theo loại, loại ko khai báo dùng default
+NOTIFICATION_RETENTION_DAYS = {
+    'default': 30,
+    'SYSTEM_ANNOUNCEMENT': 7,
+    'APPOINTMENT_REMINDER': 7,
+}
+
+# các mốc nhắc lịch hẹn (số phút trước giờ hẹn)
+APPOINTMENT_REMINDER_LEAD_MINUTES = [24 * 60, 2 * 60, 15]
+
+# thông báo đã xóa mềm giữ thêm bấy nhiêu ngày rồi xóa hẳn
+NOTIFICATION_DELETED_RETENTION_DAYS = 7
+
 AUTH_USER_MODEL = 'users.User'
 
 # Password validation
@@ -257,3 +290,4 @@ STRIPE_WEBHOOK_SECRET = env('STRIPE_WEBHOOK_SECRET')
 VNPAY_TMN_CODE = env('VNPAY_TMN_CODE')
 VNPAY_HASH_SECRET_KEY = env('VNPAY_HASH_SECRET_KEY')
 VNPAY_PAYMENT_URL = env('VNPAY_PAYMENT_URL')
+VNPAY_API_URL = env('VNPAY_API_URL', default='https://sandbox.vnpayment.vn/merchant_webapi/api/transaction')